@@ -0,0 +1,47 @@
+"""
+Management command to free stock held by abandoned checkouts
+Usage: python manage.py release_expired_reservations [--batch-size 1000] [--every 300]
+
+Checkouts free the expired holds on the variants they reserve; this sweeps
+the rest, so the catalog stops counting them against available stock.
+--every keeps it running, sweeping every N seconds (the Procfile `sweeper`
+process).
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from apps.cart.models import StockReservation
+
+
+class Command(BaseCommand):
+    help = 'Release stock reservations past their expiry'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of reservations to release per transaction'
+        )
+        parser.add_argument(
+            '--every',
+            type=int,
+            default=None,
+            help='Keep running, sweeping every N seconds'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            self.sweep(options['batch_size'])
+            if not options['every']:
+                break
+            time.sleep(options['every'])
+
+    def sweep(self, batch_size):
+        released = 0
+        while True:
+            count = StockReservation.objects.release_expired(limit=batch_size)
+            released += count
+            if count < batch_size:
+                break
+        self.stdout.write(self.style.SUCCESS(f'[OK] Released {released} expired reservations'))
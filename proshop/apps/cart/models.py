@@ -1,7 +1,13 @@
-from django.db import models
+from collections import Counter
+from datetime import timedelta
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Greatest
 from django.conf import settings
+from django.utils import timezone
+from django.utils.functional import cached_property
 from decimal import Decimal
-from apps.shop.models import Product, ProductVariant
+from apps.shop.models import Product, ProductVariant, per_variant
 
 
 class CartManager(models.Manager):
@@ -20,6 +26,28 @@ class CartManager(models.Manager):
         )
         return cart
 
+    def load_for_user(self, user):
+        """get_or_create_for_user() with the cart contents loaded"""
+        return self.load_contents(self.get_or_create_for_user(user))
+
+    def load_contents(self, cart):
+        """
+        (Re)load the items of `cart` with their variants, products and
+        images: two queries, however many items the cart holds. Call it
+        again after changing the items.
+        """
+        cart.forget_contents()
+        models.prefetch_related_objects(
+            [cart],
+            models.Prefetch(
+                'items',
+                queryset=CartItem.objects.select_related('variant__product')
+                .prefetch_related('variant__images')
+                .order_by('added_at', 'pk'),
+            ),
+        )
+        return cart
+
 
 class Cart(models.Model):
     """Shopping cart for anonymous or authenticated users"""
@@ -55,54 +83,142 @@ class Cart(models.Model):
             return f"Cart for {self.user.username}"
         return f"Cart for {self.session_id}"
     
+    @cached_property
+    def totals(self):
+        """(total quantity, total price), computed in one pass over the items"""
+        quantity, price = 0, Decimal('0')
+        for item in self.items.all():
+            quantity += item.quantity
+            price += item.get_subtotal()
+        return quantity, price
+
     @property
     def total_items(self):
         """Total quantity of items in cart"""
-        return sum(item.quantity for item in self.items.all())
+        return self.totals[0]
     
     @property
     def total_price(self):
         """Total price of all items"""
-        return sum(item.get_subtotal() for item in self.items.all())
+        return self.totals[1]
     
     @property
     def has_items(self):
-        """Check if cart has any items"""
+        """Check if cart has any items (free once the items are loaded)"""
         return self.items.exists()
+
+    def forget_contents(self):
+        """Drop the loaded items and totals, e.g. after the items changed"""
+        getattr(self, '_prefetched_objects_cache', {}).pop('items', None)
+        self.__dict__.pop('totals', None)
     
+    def get_item(self, item_id):
+        """The loaded item with this id, or None if it is not in this cart"""
+        return next((item for item in self.items.all() if str(item.pk) == str(item_id)), None)
+
+    def add_variant(self, variant, quantity):
+        """
+        Add `quantity` of `variant` at its current price, unless the cart
+        would then hold more than its available (unreserved) stock. Returns (quantity in cart, added).
+        """
+        with transaction.atomic():
+            cart_item, created = CartItem.objects.get_or_create(
+                cart=self,
+                variant=variant,
+                defaults={
+                    'quantity': quantity,
+                    'price_at_add': variant.price,
+                }
+            )
+            if not created:
+                # Item already in cart, increase quantity
+                if cart_item.quantity + quantity > variant.available_stock:
+                    return cart_item.quantity, False
+                cart_item.quantity += quantity
+                cart_item.save()
+        Cart.objects.load_contents(self)
+        return cart_item.quantity, True
+
+    def set_item_quantity(self, item, quantity):
+        """Set the quantity of one of the items"""
+        item.quantity = quantity
+        item.save()
+        Cart.objects.load_contents(self)
+
+    def remove_item(self, item):
+        """Remove one of the items"""
+        item.delete()
+        Cart.objects.load_contents(self)
+
     def clear(self):
-        """Empty the cart"""
-        self.items.all().delete()
-    
-    def merge_from_session(self, session_key):
+        """Empty the cart; returns the number of items removed"""
+        count, _ = self.items.all().delete()
+        self.forget_contents()
+        return count
+
+    def apply_operations(self, operations, variants):
         """
-        Merge items from session cart to user cart
-        Used when user logs in
+        Apply (op, variant_id, quantity) operations - see
+        fold_operations() - in one transaction, with one bulk insert,
+        update and delete. Raises InsufficientStock, changing nothing, if
+        a quantity raised goes over the available stock (`variants`:
+        {variant_id: ProductVariant} of the variants added or set).
         """
-        if not self.user or not session_key:
+        with transaction.atomic():
+            items = {
+                item.variant_id: item
+                for item in CartItem.objects.select_for_update().filter(cart=self)
+            }
+            before = {variant_id: item.quantity for variant_id, item in items.items()}
+            after = fold_operations(before, operations)
+            shortfalls = stock_shortfalls(before, after, variants)
+            if shortfalls:
+                raise InsufficientStock(shortfalls)
+
+            now = timezone.now()
+            changed = []
+            for variant_id, item in items.items():
+                if variant_id in after and after[variant_id] != item.quantity:
+                    item.quantity, item.updated_at = after[variant_id], now
+                    changed.append(item)
+            CartItem.objects.bulk_update(changed, ['quantity', 'updated_at'])
+            CartItem.objects.bulk_create([
+                CartItem(cart=self, variant_id=variant_id, quantity=quantity, price_at_add=variants[variant_id].price)
+                for variant_id, quantity in after.items()
+                if variant_id not in items
+            ])
+            removed = [item.pk for variant_id, item in items.items() if variant_id not in after]
+            if removed:
+                CartItem.objects.filter(pk__in=removed).delete()
+        Cart.objects.load_contents(self)
+
+    def merge_lines(self, lines):
+        """
+        Add (variant_id, quantity, price_at_add) lines, e.g. from an
+        anonymous cart; quantities of variants already here are summed.
+        """
+        lines = list(lines)
+        if not lines:
             return
-        
-        try:
-            session_cart = Cart.objects.get(session_id=session_key, user=None)
-            for item in session_cart.items.all():
-                # Try to get existing item in user cart
-                cart_item, created = CartItem.objects.get_or_create(
-                    cart=self,
-                    variant=item.variant,
-                    defaults={
-                        'quantity': item.quantity,
-                        'price_at_add': item.price_at_add,
-                    }
+        with transaction.atomic():
+            existing = {
+                item.variant_id: item
+                for item in CartItem.objects.select_for_update().filter(
+                    cart=self, variant_id__in=[variant_id for variant_id, _, _ in lines]
                 )
-                if not created:
-                    # If item exists, increase quantity
-                    cart_item.quantity += item.quantity
-                    cart_item.save()
-            
-            # Delete session cart
-            session_cart.delete()
-        except Cart.DoesNotExist:
-            pass
+            }
+            new_items = []
+            for variant_id, quantity, price in lines:
+                item = existing.get(variant_id)
+                if item is None:
+                    new_items.append(
+                        CartItem(cart=self, variant_id=variant_id, quantity=quantity, price_at_add=price)
+                    )
+                else:
+                    item.quantity += quantity
+            CartItem.objects.bulk_update(existing.values(), ['quantity'])
+            CartItem.objects.bulk_create(new_items)
+        self.forget_contents()
 
 
 class CartItem(models.Model):
@@ -151,4 +267,268 @@ class CartItem(models.Model):
     
     def is_in_stock(self):
         """Check if requested quantity is available"""
-        return self.variant.stock >= self.quantity
+        return self.variant.available_stock >= self.quantity
+
+
+class InsufficientStock(Exception):
+    """
+    Raised by StockReservation.objects.reserve() and apply_operations();
+    `items` lists the shortfalls.
+    """
+
+    def __init__(self, items):
+        super().__init__(f'{len(items)} item(s) out of stock')
+        self.items = items
+
+
+def fold_operations(quantities, operations):
+    """
+    Apply cart operations to {variant_id: quantity} (returns a copy):
+    ('add', variant_id, n) adds n, ('set', variant_id, n) sets the line to
+    n (adding it if needed), ('remove', variant_id, None) drops the line
+    if it is there.
+    """
+    quantities = dict(quantities)
+    for op, variant_id, quantity in operations:
+        if op == 'add':
+            quantities[variant_id] = quantities.get(variant_id, 0) + quantity
+        elif op == 'set':
+            quantities[variant_id] = quantity
+        else:
+            quantities.pop(variant_id, None)
+    return quantities
+
+
+def stock_shortfalls(before, after, variants):
+    """The lines raised from `before` to `after` beyond their variant's available stock."""
+    return [
+        {'sku': variants[variant_id].sku, 'requested': quantity, 'available': variants[variant_id].available_stock}
+        for variant_id, quantity in after.items()
+        if quantity > before.get(variant_id, 0) and quantity > variants[variant_id].available_stock
+    ]
+
+
+def _per_variant_totals(rows):
+    """{variant_id: total quantity} of (variant_id, quantity) rows."""
+    totals = Counter()
+    for variant_id, quantity in rows:
+        totals[variant_id] += quantity
+    return totals
+
+
+class StockReservationManager(models.Manager):
+    """
+    Holds on stock while a cart is being paid for.
+
+    ProductVariant.reserved is the sum of the active holds on the variant,
+    so available stock (stock - reserved) is read without aggregating.
+    Holds and counters change together, in one transaction, through
+    conditional UPDATEs on the variant rows (locked in id order):
+    - reserve(): reserved += n WHERE stock >= reserved + n
+    - commit(), Order.commit_stock(): stock -= n, reserved -= n WHERE
+      stock >= n (payment received)
+    - release() / release_expired(): reserved -= n
+
+    Holds attached to a payment session stay until that session is paid
+    (commit) or expires (release): the customer may still pay for it. A
+    cart that checks out again holds its stock a second time until the
+    expire_superseded_checkouts sweep expires the earlier session.
+    """
+
+    def reserve(self, cart, ttl=None):
+        """
+        Hold the cart's items for `ttl` seconds (STOCK_RESERVATION_TTL),
+        replacing the cart's previous holds that no payment session owns
+        yet. Raises InsufficientStock, holding nothing, if any item cannot
+        be covered. Returns the holds created, for attach(): a concurrent
+        checkout of the same cart may replace them in the meantime.
+        """
+        ttl = ttl or getattr(settings, 'STOCK_RESERVATION_TTL', 1800)
+        quantities = Counter()
+        for item in cart.items.all():
+            quantities[item.variant_id] += item.quantity
+        expires_at = timezone.now() + timedelta(seconds=ttl)
+
+        with transaction.atomic():
+            # Abandoned holds on these variants count until they are freed
+            self.release(cart=cart, checkout_session_id='')
+            self.release_expired(variant_ids=quantities)
+            variants = self._lock_variants(quantities)
+            shortfalls = [
+                {'sku': variant.sku, 'requested': quantities[variant.pk], 'available': variant.available_stock}
+                for variant in variants
+                if variant.available_stock < quantities[variant.pk]
+            ]
+            if not shortfalls:
+                # The rows are locked and checked: the condition is a guard
+                amount = per_variant(quantities)
+                updated = ProductVariant.objects.filter(
+                    pk__in=quantities, stock__gte=F('reserved') + amount
+                ).update(reserved=F('reserved') + amount)
+                if updated != len(quantities):
+                    shortfalls = [
+                        {'sku': None, 'requested': quantity, 'available': 0}
+                        for variant_id, quantity in quantities.items()
+                        if variant_id not in {variant.pk for variant in variants}
+                    ]
+            if shortfalls:
+                transaction.set_rollback(True)
+                raise InsufficientStock(shortfalls)
+            return self.bulk_create([
+                StockReservation(cart=cart, variant_id=variant_id, quantity=quantity, expires_at=expires_at)
+                for variant_id, quantity in quantities.items()
+            ])
+
+    def attach(self, holds, checkout_session_id):
+        """
+        Tag `holds` (from reserve()) with the payment session they belong
+        to. Returns how many were still there to tag.
+        """
+        return self.filter(
+            pk__in=[hold.pk for hold in holds], checkout_session_id=''
+        ).update(checkout_session_id=checkout_session_id)
+
+    def commit(self, checkout_session_id, paid=None):
+        """
+        Turn the holds of a paid session into stock decrements
+        (ProductVariant.objects.commit_stock), once per session: the first
+        call claims it as a CommittedCheckout (as Order.commit_stock() does),
+        redelivered webhooks find it claimed and do nothing. A session whose
+        holds were released before the payment came in is settled from
+        `paid`, the {variant_id: quantity} paid for; without it nothing is
+        claimed and None is returned, for the caller to fetch what was paid
+        for (outside this transaction's row locks) and call again. Returns
+        the shortfalls of variants whose stock can no longer cover what was
+        paid for.
+        """
+        with transaction.atomic():
+            if not CommittedCheckout.objects.claim(checkout_session_id):
+                return []
+            holds = self.take(checkout_session_id=checkout_session_id)
+            if holds:
+                return ProductVariant.objects.commit_stock(holds, held=holds)
+            if paid is None:
+                transaction.set_rollback(True)
+                return None
+            return ProductVariant.objects.commit_stock(paid)
+
+    def superseded_sessions(self):
+        """
+        Payment sessions still holding stock for a cart that has checked
+        out again since (a newer session holds it too)
+        """
+        latest = (
+            self.filter(cart=OuterRef('cart')).exclude(checkout_session_id='')
+            .order_by('-created_at', '-pk').values('checkout_session_id')[:1]
+        )
+        return set(
+            self.filter(cart__isnull=False).exclude(checkout_session_id='')
+            .exclude(checkout_session_id=Subquery(latest))
+            .values_list('checkout_session_id', flat=True)
+        )
+
+    def take(self, **filters):
+        """
+        Drop holds without freeing their stock; returns their
+        {variant_id: quantity} for the caller to settle on the counters.
+        """
+        return _per_variant_totals(self._take(self.filter(**filters)))
+
+    def release(self, **filters):
+        """Drop holds (e.g. cart=..., checkout_session_id=...) and free their stock."""
+        with transaction.atomic(savepoint=False):
+            self._unreserve(self.take(**filters))
+
+    def release_expired(self, variant_ids=None, limit=None):
+        """Drop (up to `limit`) holds past their expiry, optionally only on `variant_ids`; returns how many."""
+        expired = self.filter(expires_at__lte=timezone.now())
+        if variant_ids is not None:
+            expired = expired.filter(variant_id__in=variant_ids)
+        if limit is not None:
+            expired = expired.order_by('expires_at')[:limit]
+        with transaction.atomic(savepoint=False):
+            rows = self._take(expired)
+            self._unreserve(_per_variant_totals(rows))
+        return len(rows)
+
+    def _take(self, holds):
+        """Lock and delete `holds`; returns the (variant_id, quantity) of the rows deleted."""
+        rows = list(holds.select_for_update().values_list('pk', 'variant_id', 'quantity'))
+        if rows:
+            self.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+        return [(variant_id, quantity) for _, variant_id, quantity in rows]
+
+    @staticmethod
+    def _lock_variants(quantities):
+        """Lock the variant rows in id order (no deadlocks between checkouts)."""
+        if not quantities:
+            return []
+        return list(ProductVariant.objects.select_for_update().filter(pk__in=quantities).order_by('pk'))
+
+    @staticmethod
+    def _unreserve(quantities):
+        if quantities:
+            amount = per_variant(quantities)
+            ProductVariant.objects.filter(pk__in=quantities).update(
+                reserved=Greatest(F('reserved') - amount, Value(0))
+            )
+
+
+class StockReservation(models.Model):
+    """A time-limited hold on a variant's stock for one cart's checkout"""
+
+    variant = models.ForeignKey(
+        ProductVariant,
+        on_delete=models.CASCADE,
+        related_name='reservations'
+    )
+    cart = models.ForeignKey(
+        Cart,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='reservations'
+    )
+    quantity = models.PositiveIntegerField()
+    checkout_session_id = models.CharField(
+        max_length=200,
+        blank=True,
+        default='',
+        db_index=True,
+        help_text="Payment (Stripe checkout) session the hold belongs to"
+    )
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = StockReservationManager()
+
+    def __str__(self):
+        return f"{self.quantity} x {self.variant_id} until {self.expires_at:%Y-%m-%d %H:%M}"
+
+
+class CommittedCheckoutManager(models.Manager):
+    """The one record of which paid sessions have had their stock taken"""
+
+    def claim(self, checkout_session_id):
+        """
+        Record the session as committed; False if it already was. Call it
+        in the transaction that takes the stock, so the claim and the
+        decrement commit (or roll back) together.
+        """
+        _, created = self.get_or_create(checkout_session_id=checkout_session_id)
+        return created
+
+
+class CommittedCheckout(models.Model):
+    """
+    A paid payment session whose stock has been taken, by
+    StockReservationManager.commit() or Order.commit_stock()
+    """
+
+    checkout_session_id = models.CharField(max_length=200, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = CommittedCheckoutManager()
+
+    def __str__(self):
+        return self.checkout_session_id
@@ -67,7 +67,6 @@ class CartSerializer(serializers.ModelSerializer):
     )
     has_items = serializers.BooleanField(read_only=True)
     user_id = serializers.IntegerField(
-        source='user.id',
         read_only=True,
         allow_null=True
     )
@@ -94,28 +93,24 @@ class AddToCartSerializer(serializers.Serializer):
         help_text="Quantity to add"
     )
     
-    def validate_variant_id(self, value):
-        """Validate variant exists"""
-        try:
-            ProductVariant.objects.get(id=value, is_active=True)
-        except ProductVariant.DoesNotExist:
-            raise serializers.ValidationError("Variant not found or inactive")
-        return value
-    
     def validate(self, attrs):
-        """Validate quantity against stock"""
+        """
+        Validate the variant exists and the quantity against its stock.
+        The variant (with its product) is returned as attrs['variant'].
+        """
         variant_id = attrs.get('variant_id')
         quantity = attrs.get('quantity')
         
         try:
-            variant = ProductVariant.objects.get(id=variant_id)
-            if quantity > variant.stock:
-                raise serializers.ValidationError(
-                    f"Requested quantity ({quantity}) exceeds available stock ({variant.stock})"
-                )
+            variant = ProductVariant.objects.select_related('product').get(id=variant_id, is_active=True)
         except ProductVariant.DoesNotExist:
-            pass
+            raise serializers.ValidationError({'variant_id': "Variant not found or inactive"})
+        if quantity > variant.available_stock:
+            raise serializers.ValidationError(
+                f"Requested quantity ({quantity}) exceeds available stock ({variant.available_stock})"
+            )
         
+        attrs['variant'] = variant
         return attrs
 
 
@@ -135,6 +130,62 @@ class UpdateCartItemSerializer(serializers.Serializer):
         return value
 
 
+class CartOperationSerializer(serializers.Serializer):
+    """
+    One operation of a batch: add or set a quantity of a variant, or
+    remove it.
+    """
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    variant_id = serializers.IntegerField(
+        help_text="ProductVariant ID"
+    )
+    quantity = serializers.IntegerField(
+        required=False,
+        min_value=1,
+        help_text="Quantity to add, or the new quantity (add, set)"
+    )
+    
+    def validate(self, attrs):
+        """Require a quantity for add and set"""
+        if attrs['op'] != 'remove' and 'quantity' not in attrs:
+            raise serializers.ValidationError({'quantity': "This field is required."})
+        return attrs
+
+
+class BatchCartSerializer(serializers.Serializer):
+    """
+    Serializer for applying several cart operations at once.
+    """
+    operations = CartOperationSerializer(
+        many=True,
+        allow_empty=False,
+        max_length=100,
+        help_text="Operations, applied in order"
+    )
+    
+    def validate(self, attrs):
+        """
+        Look up the variants added or set in one query; they are returned
+        as attrs['variants'] ({id: variant}) and the operations as
+        (op, variant_id, quantity) tuples.
+        """
+        operations = [
+            (operation['op'], operation['variant_id'], operation.get('quantity'))
+            for operation in attrs['operations']
+        ]
+        variant_ids = {variant_id for op, variant_id, _ in operations if op != 'remove'}
+        variants = ProductVariant.objects.select_related('product').filter(is_active=True).in_bulk(variant_ids)
+        missing = sorted(variant_ids - variants.keys())
+        if missing:
+            raise serializers.ValidationError(
+                {'variant_id': f"Variants not found or inactive: {', '.join(map(str, missing))}"}
+            )
+        
+        attrs['operations'] = operations
+        attrs['variants'] = variants
+        return attrs
+
+
 class CheckoutSessionSerializer(serializers.Serializer):
     """
     Serializer for checkout session creation.
@@ -0,0 +1,13 @@
+"""
+Cart signals: anonymous carts follow the visitor into their account
+"""
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+from .stores import merge_into_user_cart
+
+
+@receiver(user_logged_in)
+def merge_stored_cart(sender, request, user, **kwargs):
+    """Merge the visitor's stored cart into the user's cart on login"""
+    if request is not None:
+        merge_into_user_cart(request, user)
@@ -0,0 +1,385 @@
+"""
+Anonymous cart storage
+
+Carts of anonymous visitors are not stored as Cart/CartItem rows: they
+live in a key-value store under a random token kept in a signed cookie,
+so browsing and bots generate no database (or session) writes. A
+StoredCart offers the same operations and serializer fields as Cart and
+is turned into rows only when needed:
+- on login, its lines are merged into the user's cart (apps.cart.signals)
+- on checkout, materialize() copies it into a Cart keyed by the token
+  (holds on stock and orders need rows)
+
+Stores (settings.CART_STORE):
+- RedisCartStore: one Redis hash per cart, quantities changed with
+  HINCRBY or WATCH/MULTI, expiry refreshed on every change (production)
+- CacheCartStore: the whole cart as one entry of a Django cache; updates
+  are read-modify-write, so concurrent changes to one cart can be lost
+  (development, tests)
+
+Settings: CART_STORE_CACHE (cache alias), CART_STORE_TTL (seconds after the
+last change), CART_COOKIE_NAME.
+"""
+import secrets
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import NamedTuple
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from apps.shop.models import ProductVariant
+from .models import Cart, CartItem, InsufficientStock, fold_operations, stock_shortfalls
+
+
+COOKIE_SALT = 'apps.cart.stores'
+
+
+class StoredLine(NamedTuple):
+    """One variant in a stored cart."""
+    quantity: int
+    price: Decimal      # price_at_add
+    added_at: float     # Unix timestamp
+
+
+# ---- stores ----
+
+class BaseCartStore:
+    """Lines of anonymous carts, keyed by cart token and variant id."""
+
+    def __init__(self):
+        self.ttl = getattr(settings, 'CART_STORE_TTL', settings.SESSION_COOKIE_AGE)
+
+    def get_lines(self, token):
+        """Return {variant_id: StoredLine}."""
+        raise NotImplementedError
+
+    def add(self, token, variant_id, quantity, price):
+        """Add `quantity` (may be negative) of a variant; returns the new quantity."""
+        raise NotImplementedError
+
+    def set_quantity(self, token, variant_id, quantity):
+        """Set the quantity of a variant already in the cart; False if it is not."""
+        raise NotImplementedError
+
+    def remove(self, token, variant_id):
+        """Remove a variant; False if it was not in the cart."""
+        raise NotImplementedError
+
+    def set_lines(self, token, lines):
+        """Write {variant_id: (quantity, price)} in one go; quantity 0 removes the line."""
+        raise NotImplementedError
+
+    def clear(self, token):
+        """Drop the whole cart."""
+        raise NotImplementedError
+
+
+class RedisCartStore(BaseCartStore):
+    """
+    Hash `cart:<token>` with fields q:<variant> (quantity), p:<variant>
+    (price at add) and t:<variant> (added at).
+    """
+
+    key_prefix = 'cart:'
+
+    def __init__(self, client=None):
+        super().__init__()
+        if client is None:
+            from django_redis import get_redis_connection
+
+            client = get_redis_connection(getattr(settings, 'CART_STORE_CACHE', 'default'))
+        self.client = client
+
+    def key(self, token):
+        return f'{self.key_prefix}{token}'
+
+    def get_lines(self, token):
+        fields = {
+            name.decode(): value.decode()
+            for name, value in self.client.hgetall(self.key(token)).items()
+        }
+        lines = {}
+        for name, value in fields.items():
+            kind, _, variant_id = name.partition(':')
+            # A quantity without its price is not a line that was added: never sell it for 0
+            if kind == 'q' and int(value) > 0 and f'p:{variant_id}' in fields:
+                lines[int(variant_id)] = StoredLine(
+                    int(value),
+                    Decimal(fields[f'p:{variant_id}']),
+                    float(fields.get(f't:{variant_id}', 0)),
+                )
+        return lines
+
+    def add(self, token, variant_id, quantity, price):
+        key = self.key(token)
+        pipe = self.client.pipeline()
+        pipe.hincrby(key, f'q:{variant_id}', quantity)
+        pipe.hsetnx(key, f'p:{variant_id}', str(price))
+        pipe.hsetnx(key, f't:{variant_id}', time.time())
+        pipe.expire(key, self.ttl)
+        new_quantity = pipe.execute()[0]
+        if new_quantity <= 0:
+            self.remove(token, variant_id)
+        return new_quantity
+
+    def set_quantity(self, token, variant_id, quantity):
+        key = self.key(token)
+
+        def update(pipe):
+            # WATCHed: a remove between the check and the write retries it
+            if not pipe.hexists(key, f'q:{variant_id}'):
+                return False
+            pipe.multi()
+            pipe.hset(key, f'q:{variant_id}', quantity)
+            pipe.expire(key, self.ttl)
+            return True
+
+        return self.client.transaction(update, key, value_from_callable=True)
+
+    def remove(self, token, variant_id):
+        key = self.key(token)
+        return bool(self.client.hdel(key, f'q:{variant_id}', f'p:{variant_id}', f't:{variant_id}'))
+
+    def set_lines(self, token, lines):
+        key = self.key(token)
+        pipe = self.client.pipeline()
+        for variant_id, (quantity, price) in lines.items():
+            if quantity:
+                pipe.hset(key, f'q:{variant_id}', quantity)
+                pipe.hsetnx(key, f'p:{variant_id}', str(price))
+                pipe.hsetnx(key, f't:{variant_id}', time.time())
+            else:
+                pipe.hdel(key, f'q:{variant_id}', f'p:{variant_id}', f't:{variant_id}')
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def clear(self, token):
+        self.client.delete(self.key(token))
+
+
+class CacheCartStore(BaseCartStore):
+    """The cart as one {variant_id: [quantity, price, added_at]} cache entry."""
+
+    key_prefix = 'cart:'
+
+    def __init__(self):
+        super().__init__()
+        self.cache = caches[getattr(settings, 'CART_STORE_CACHE', 'default')]
+
+    def key(self, token):
+        return f'{self.key_prefix}{token}'
+
+    def get_lines(self, token):
+        return {
+            int(variant_id): StoredLine(quantity, Decimal(price), added_at)
+            for variant_id, (quantity, price, added_at) in self.cache.get(self.key(token), {}).items()
+        }
+
+    def add(self, token, variant_id, quantity, price):
+        data = self.cache.get(self.key(token), {})
+        line = data.get(str(variant_id)) or [0, str(price), time.time()]
+        line[0] += quantity
+        if line[0] > 0:
+            data[str(variant_id)] = line
+        else:
+            data.pop(str(variant_id), None)
+        self.cache.set(self.key(token), data, self.ttl)
+        return line[0]
+
+    def set_quantity(self, token, variant_id, quantity):
+        data = self.cache.get(self.key(token), {})
+        if str(variant_id) not in data:
+            return False
+        data[str(variant_id)][0] = quantity
+        self.cache.set(self.key(token), data, self.ttl)
+        return True
+
+    def remove(self, token, variant_id):
+        data = self.cache.get(self.key(token), {})
+        if data.pop(str(variant_id), None) is None:
+            return False
+        self.cache.set(self.key(token), data, self.ttl)
+        return True
+
+    def set_lines(self, token, lines):
+        data = self.cache.get(self.key(token), {})
+        for variant_id, (quantity, price) in lines.items():
+            if quantity:
+                data.setdefault(str(variant_id), [0, str(price), time.time()])[0] = quantity
+            else:
+                data.pop(str(variant_id), None)
+        self.cache.set(self.key(token), data, self.ttl)
+
+    def clear(self, token):
+        self.cache.delete(self.key(token))
+
+
+def get_cart_store():
+    """Instantiate settings.CART_STORE."""
+    return import_string(settings.CART_STORE)()
+
+
+# ---- cookie ----
+
+def get_cart_token(request):
+    """The cart token from the signed cookie, or None (missing or tampered)."""
+    return request.get_signed_cookie(
+        settings.CART_COOKIE_NAME, default=None, salt=COOKIE_SALT, max_age=settings.CART_STORE_TTL
+    )
+
+
+def set_cart_cookie(response, token):
+    """(Re)issue the cart cookie; its lifetime follows the store TTL."""
+    response.set_signed_cookie(
+        settings.CART_COOKIE_NAME, token, salt=COOKIE_SALT,
+        max_age=settings.CART_STORE_TTL,
+        secure=settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+        samesite=settings.SESSION_COOKIE_SAMESITE,
+    )
+
+
+# ---- stored carts ----
+
+class StoredCart:
+    """
+    An anonymous cart read from the store, shaped like Cart for
+    CartSerializer: `items` are unsaved CartItems whose id is the variant
+    id. Changes go to the store and reload the cart.
+    """
+
+    id = None
+    user_id = None
+    created_at = None
+    updated_at = None
+
+    def __init__(self, token=None, store=None):
+        self.token = token
+        self.store = store or get_cart_store()
+        self.changed = False    # the cookie must be (re)issued
+        self.reload()
+
+    def reload(self):
+        """Read the lines and their variants, products and images (2 queries)."""
+        lines = self.store.get_lines(self.token) if self.token else {}
+        variants = (
+            ProductVariant.objects.select_related('product').prefetch_related('images').in_bulk(lines)
+            if lines else {}
+        )
+        self.items = sorted(
+            (
+                CartItem(
+                    id=variant_id, variant=variants[variant_id], quantity=line.quantity,
+                    price_at_add=line.price,
+                    added_at=datetime.fromtimestamp(line.added_at, timezone.utc),
+                    updated_at=None,
+                )
+                for variant_id, line in lines.items()
+                if variant_id in variants   # Variants deleted since
+            ),
+            key=lambda item: (item.added_at, item.id),
+        )
+
+    @property
+    def total_items(self):
+        """Total quantity of items in cart"""
+        return sum(item.quantity for item in self.items)
+
+    @property
+    def total_price(self):
+        """Total price of all items"""
+        return sum((item.get_subtotal() for item in self.items), Decimal('0'))
+
+    @property
+    def has_items(self):
+        """Check if cart has any items"""
+        return bool(self.items)
+
+    def get_item(self, item_id):
+        """The item with this id (the variant id), or None"""
+        return next((item for item in self.items if str(item.pk) == str(item_id)), None)
+
+    def add_variant(self, variant, quantity):
+        """
+        Atomically add `quantity` of `variant`; rolled back when the cart
+        would hold more than its stock. Returns (quantity in cart, added).
+        """
+        if self.token is None:
+            self.token = secrets.token_urlsafe(16)
+        new_quantity = self.store.add(self.token, variant.pk, quantity, variant.price)
+        if new_quantity > variant.available_stock:
+            return self.store.add(self.token, variant.pk, -quantity, variant.price), False
+        self.changed = True
+        self.reload()
+        return new_quantity, True
+
+    def set_item_quantity(self, item, quantity):
+        """Set the quantity of one of the items"""
+        self.changed = self.store.set_quantity(self.token, item.variant_id, quantity)
+        self.reload()
+
+    def remove_item(self, item):
+        """Remove one of the items"""
+        self.changed = self.store.remove(self.token, item.variant_id)
+        self.reload()
+
+    def apply_operations(self, operations, variants):
+        """
+        Cart.apply_operations() on the store: the changed lines are
+        written in one call, or not at all if InsufficientStock is raised.
+        """
+        before = {item.variant_id: item.quantity for item in self.items}
+        after = fold_operations(before, operations)
+        shortfalls = stock_shortfalls(before, after, variants)
+        if shortfalls:
+            raise InsufficientStock(shortfalls)
+        lines = {
+            variant_id: (quantity, variants[variant_id].price)
+            for variant_id, quantity in after.items()
+            if quantity != before.get(variant_id)
+        }
+        lines.update((variant_id, (0, None)) for variant_id in before.keys() - after.keys())
+        if not lines:
+            return
+        if self.token is None:
+            self.token = secrets.token_urlsafe(16)
+        self.store.set_lines(self.token, lines)
+        self.changed = True
+        self.reload()
+
+    def clear(self):
+        """Empty the cart; returns the number of items removed"""
+        count = len(self.items)
+        if self.token:
+            self.store.clear(self.token)
+        self.items = []
+        return count
+
+    def lines(self):
+        """(variant_id, quantity, price_at_add) of every item"""
+        return [(item.variant_id, item.quantity, item.price_at_add) for item in self.items]
+
+
+def materialize(stored_cart):
+    """
+    Copy a stored cart into the Cart keyed by its token (for checkout),
+    replacing what an earlier checkout copied there. The stored cart is
+    kept: a visitor who does not pay still has it. Returns the Cart with
+    its contents loaded.
+    """
+    cart = Cart.objects.get_or_create_for_session(stored_cart.token)
+    cart.clear()
+    cart.merge_lines(stored_cart.lines())
+    return Cart.objects.load_contents(cart)
+
+
+def merge_into_user_cart(request, user):
+    """Move the request's stored cart, if any, into the user's cart (login)."""
+    token = get_cart_token(request)
+    if not token:
+        return
+    stored_cart = StoredCart(token)
+    if stored_cart.has_items:
+        Cart.objects.get_or_create_for_user(user).merge_lines(stored_cart.lines())
+    stored_cart.clear()
@@ -1,7 +1,19 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 from django.test import TestCase
 from django.contrib.auth.models import User
-from apps.shop.models import Category, Product
-from .models import Cart, CartItem
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management import call_command
+from django.utils import timezone
+from apps.shop.models import Category, Product, ProductVariant, ProductImage
+from apps.utils.query_budgets import QueryBudgetTestMixin
+from .models import Cart, CartItem, InsufficientStock, StockReservation
+from .stores import RedisCartStore
+from .serializers import CartSerializer
 
 
 class CartTestCase(TestCase):
@@ -21,3 +33,534 @@ class CartTestCase(TestCase):
     def test_cart_creation(self):
         cart = Cart.objects.create(user=self.user)
         self.assertEqual(cart.user, self.user)
+
+
+class CartItemEndpointTestCase(TestCase):
+    """PATCH and DELETE share /api/cart/items/<id>/."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='cart@example.com', password='secret123')
+        product = Product.objects.create(name='Mug', description='Test', sku='MUG1', base_price=10)
+        variant = ProductVariant.objects.create(product=product, sku='MUG1-V', price=10, stock=5)
+        self.item = CartItem.objects.create(
+            cart=Cart.objects.get_or_create_for_user(self.user), variant=variant, quantity=1, price_at_add=10
+        )
+        self.client.force_login(self.user)
+
+    def test_update_then_remove(self):
+        url = f'/api/cart/items/{self.item.pk}/'
+        response = self.client.patch(url, {'quantity': 3}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 3)
+
+        self.assertEqual(self.client.delete(url).status_code, 200)
+        self.assertFalse(CartItem.objects.filter(pk=self.item.pk).exists())
+
+
+class CartQueryBudgetTestCase(QueryBudgetTestMixin, TestCase):
+    """Cart endpoints stay within apps.utils.query_budgets."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='budget@example.com', password='secret123')
+        self.cart = Cart.objects.get_or_create_for_user(self.user)
+        self.variants = []
+        self.add_items(2)
+        self.client.force_login(self.user)
+
+    def add_items(self, count):
+        """Put `count` more variants (each with an image) into the cart."""
+        for _ in range(count):
+            index = len(self.variants)
+            product = Product.objects.create(
+                name=f'Budget {index}', description='Test', sku=f'CB{index}', base_price=10
+            )
+            variant = ProductVariant.objects.create(product=product, sku=f'CB{index}-V', price=10, stock=50)
+            ProductImage.objects.create(product=product, variant=variant, image=f'products/cb{index}.jpg')
+            CartItem.objects.create(cart=self.cart, variant=variant, quantity=1, price_at_add=10)
+            self.variants.append(variant)
+
+    def grow(self):
+        self.add_items(3)
+
+    def test_read_and_checkout(self):
+        self.assertWithinQueryBudget('get', '/api/cart/', grow=self.grow)
+        self.assertWithinQueryBudget('post', '/api/cart/checkout/', {}, grow=self.grow)
+
+    def test_item_writes(self):
+        item = self.cart.items.first()
+        self.assertWithinQueryBudget(
+            'post', '/api/cart/add/', {'variant_id': self.variants[0].pk, 'quantity': 1}, grow=self.grow
+        )
+        self.assertWithinQueryBudget('patch', f'/api/cart/items/{item.pk}/', {'quantity': 2}, grow=self.grow)
+        self.assertWithinQueryBudget('delete', f'/api/cart/items/{item.pk}/')
+
+    def test_clear(self):
+        self.assertWithinQueryBudget('delete', '/api/cart/clear/', grow=self.grow)
+
+    def test_batch(self):
+        operations = [
+            {'op': 'add', 'variant_id': self.variants[0].pk, 'quantity': 1},
+            {'op': 'set', 'variant_id': self.variants[1].pk, 'quantity': 3},
+        ]
+        self.assertWithinQueryBudget('post', '/api/cart/batch/', {'operations': operations}, grow=self.grow)
+
+    def test_add_new_variant(self):
+        variant = ProductVariant.objects.create(product=self.variants[0].product, sku='CB-NEW', price=10, stock=5)
+        response = self.assertWithinQueryBudget(
+            'post', '/api/cart/add/', {'variant_id': variant.pk, 'quantity': 2}, status=201
+        )
+        self.assertEqual(response.json()['cart']['total_items'], 4)
+
+
+class CartLoaderTestCase(TestCase):
+    """Cart.objects.load_*() reads the whole cart in a fixed number of queries."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='loader@example.com', password='secret123')
+        cart = Cart.objects.get_or_create_for_user(self.user)
+        product = Product.objects.create(name='Mug', description='Test', sku='LOAD', base_price=10)
+        for index, (price, quantity) in enumerate([('10.00', 2), ('2.50', 3)]):
+            variant = ProductVariant.objects.create(product=product, sku=f'LOAD-{index}', price=price, stock=5)
+            CartItem.objects.create(cart=cart, variant=variant, quantity=quantity, price_at_add=price)
+
+    def test_totals_without_further_queries(self):
+        with self.assertNumQueries(3):
+            cart = Cart.objects.load_for_user(self.user)
+        with self.assertNumQueries(0):
+            data = CartSerializer(cart).data
+        self.assertEqual(data['total_items'], 5)
+        self.assertEqual(Decimal(data['total_price']), Decimal('27.50'))
+        self.assertTrue(data['has_items'])
+        self.assertEqual([item['product_sku'] for item in data['items']], ['LOAD-0', 'LOAD-1'])
+
+    def test_reload_after_change(self):
+        cart = Cart.objects.load_for_user(self.user)
+        self.assertEqual(cart.total_items, 5)
+        cart.items.all()[0].delete()
+        Cart.objects.load_contents(cart)
+        self.assertEqual(cart.total_items, 3)
+        cart.clear()
+        self.assertFalse(cart.has_items)
+        self.assertEqual(cart.total_items, 0)
+
+
+class StoredCartTestCase(TestCase):
+    """Anonymous carts live in the cart store until login or checkout."""
+
+    def setUp(self):
+        caches['carts'].clear()
+        product = Product.objects.create(name='Mug', description='Test', sku='ANON', base_price=10)
+        self.variant = ProductVariant.objects.create(product=product, sku='ANON-V', price=10, stock=5)
+
+    def add(self, quantity):
+        return self.client.post(
+            '/api/cart/add/', {'variant_id': self.variant.pk, 'quantity': quantity}, content_type='application/json'
+        )
+
+    def test_reading_writes_nothing(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/cart/')
+        self.assertEqual(response.json()['items'], [])
+        self.assertNotIn('cart', response.cookies)
+        self.assertFalse(Session.objects.exists())
+
+    def test_add_update_remove_without_rows(self):
+        self.assertEqual(self.add(2).status_code, 201)
+        self.assertIn('cart', self.client.cookies)
+        response = self.add(2)
+        self.assertEqual(response.json()['cart']['total_items'], 4)
+        response = self.add(2)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['current_quantity'], 4)
+
+        url = f'/api/cart/items/{self.variant.pk}/'
+        response = self.client.patch(url, {'quantity': 1}, content_type='application/json')
+        self.assertEqual(response.json()['total_price'], '10.00')
+        self.assertEqual(self.client.delete(url).json()['cart']['items'], [])
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(Session.objects.exists())
+
+    def test_tampered_cookie_is_ignored(self):
+        self.add(1)
+        self.client.cookies['cart'] = 'forged'
+        self.assertEqual(self.client.get('/api/cart/').json()['items'], [])
+
+    def test_login_merges_into_user_cart(self):
+        user = get_user_model().objects.create_user(email='anon@example.com', password='secret123')
+        cart = Cart.objects.get_or_create_for_user(user)
+        CartItem.objects.create(cart=cart, variant=self.variant, quantity=1, price_at_add=10)
+        self.add(2)
+
+        response = self.client.post('/accounts/login/', {'email': 'anon@example.com', 'password': 'secret123'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.client.get('/api/cart/').json()['total_items'], 3)
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/cart/').json()['items'], [])
+
+    def test_checkout_materializes(self):
+        self.add(3)
+        response = self.client.post('/api/cart/checkout/', {}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        cart = Cart.objects.get(user=None)
+        self.assertEqual(cart.session_id, self.client.cookies['cart'].value.split(':')[0])
+        self.assertEqual(cart.total_items, 3)
+        # Unpaid: the visitor keeps the cart, and checking out again replaces the copy
+        self.assertEqual(self.client.get('/api/cart/').json()['total_items'], 3)
+        self.client.post('/api/cart/checkout/', {}, content_type='application/json')
+        self.assertEqual(Cart.objects.get(user=None).total_items, 3)
+
+
+class FakeRedis:
+    """
+    Just enough of redis.Redis for RedisCartStore: hashes, expiry,
+    MULTI/EXEC pipelines and WATCH (transaction()).
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.ttls = {}
+        self.versions = {}
+        self.racing = None  # Runs once between a transaction's reads and its EXEC
+
+    def _write(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+        if not self.hashes.get(key):
+            self.hashes.pop(key, None)
+            self.ttls.pop(key, None)
+
+    def hgetall(self, key):
+        return {name.encode(): value.encode() for name, value in self.hashes.get(key, {}).items()}
+
+    def hexists(self, key, field):
+        return field in self.hashes.get(key, {})
+
+    def hincrby(self, key, field, amount):
+        fields = self.hashes.setdefault(key, {})
+        fields[field] = str(int(fields.get(field, 0)) + amount)
+        self._write(key)
+        return int(fields[field])
+
+    def hset(self, key, field, value):
+        fields = self.hashes.setdefault(key, {})
+        created = field not in fields
+        fields[field] = str(value)
+        self._write(key)
+        return int(created)
+
+    def hsetnx(self, key, field, value):
+        if field in self.hashes.get(key, {}):
+            return 0
+        return self.hset(key, field, value)
+
+    def hdel(self, key, *fields):
+        stored = self.hashes.get(key, {})
+        removed = sum(stored.pop(field, None) is not None for field in fields)
+        self._write(key)
+        return removed
+
+    def expire(self, key, seconds):
+        if key not in self.hashes:
+            return False
+        self.ttls[key] = seconds
+        return True
+
+    def delete(self, key):
+        existed = key in self.hashes
+        self.hashes.pop(key, None)
+        self._write(key)
+        return int(existed)
+
+    def pipeline(self):
+        return FakePipeline(self, queued=True)
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        while True:
+            pipe = FakePipeline(self, queued=False)
+            watched = {key: self.versions.get(key, 0) for key in watches}
+            value = func(pipe)
+            if self.racing:
+                racing, self.racing = self.racing, None
+                racing()
+            if any(self.versions.get(key, 0) != version for key, version in watched.items()):
+                continue  # WatchError: redis-py calls func again
+            results = pipe.execute()
+            return value if value_from_callable else results
+
+
+class FakePipeline:
+    """Commands run at once until multi(), then queue until execute()."""
+
+    def __init__(self, client, queued):
+        self.client = client
+        self.queued = queued
+        self.commands = []
+
+    def multi(self):
+        self.queued = True
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [command(*args) for command, args in commands]
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+        if not self.queued:
+            return command
+
+        def queue(*args):
+            self.commands.append((command, args))
+            return self
+        return queue
+
+
+class RedisCartStoreTestCase(TestCase):
+    """RedisCartStore (the production cart store) against FakeRedis."""
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.store = RedisCartStore(client=self.redis)
+        self.key = self.store.key('token')
+
+    def test_add(self):
+        self.assertEqual(self.store.add('token', 1, 2, Decimal('10.00')), 2)
+        self.assertEqual(self.store.add('token', 1, 1, Decimal('12.00')), 3)
+        line = self.store.get_lines('token')[1]
+        self.assertEqual((line.quantity, line.price), (3, Decimal('10.00')))  # Price at the first add
+        self.assertEqual(self.redis.ttls[self.key], self.store.ttl)
+
+        self.assertEqual(self.store.add('token', 1, -3, Decimal('10.00')), 0)
+        self.assertEqual(self.store.get_lines('token'), {})
+        self.assertNotIn(self.key, self.redis.hashes)
+
+    def test_set_quantity(self):
+        self.store.add('token', 1, 2, Decimal('10.00'))
+        self.redis.ttls[self.key] = 1
+        self.assertTrue(self.store.set_quantity('token', 1, 5))
+        self.assertEqual(self.store.get_lines('token')[1].quantity, 5)
+        self.assertEqual(self.redis.ttls[self.key], self.store.ttl)
+
+        self.assertFalse(self.store.set_quantity('token', 2, 5))
+        self.assertEqual(set(self.store.get_lines('token')), {1})
+
+    def test_set_quantity_racing_remove(self):
+        self.store.add('token', 1, 2, Decimal('10.00'))
+        self.redis.racing = lambda: self.store.remove('token', 1)
+        self.assertFalse(self.store.set_quantity('token', 1, 5))
+        self.assertNotIn(self.key, self.redis.hashes)
+
+    def test_unpriced_line_is_skipped(self):
+        self.store.add('token', 1, 2, Decimal('10.00'))
+        self.redis.hset(self.key, 'q:2', 3)
+        self.assertEqual(set(self.store.get_lines('token')), {1})
+
+    def test_remove_and_clear(self):
+        self.store.add('token', 1, 2, Decimal('10.00'))
+        self.store.add('token', 2, 1, Decimal('5.00'))
+        self.assertTrue(self.store.remove('token', 1))
+        self.assertFalse(self.store.remove('token', 1))
+        self.assertEqual(set(self.store.get_lines('token')), {2})
+        self.store.clear('token')
+        self.assertEqual(self.store.get_lines('token'), {})
+
+    def test_set_lines(self):
+        self.store.add('token', 1, 2, Decimal('10.00'))
+        self.store.set_lines('token', {1: (0, None), 2: (4, Decimal('5.00')), 3: (1, Decimal('7.50'))})
+        self.assertEqual(
+            {variant_id: (line.quantity, line.price) for variant_id, line in self.store.get_lines('token').items()},
+            {2: (4, Decimal('5.00')), 3: (1, Decimal('7.50'))},
+        )
+        self.assertEqual(self.redis.ttls[self.key], self.store.ttl)
+
+    def test_expired_cart_is_empty(self):
+        self.store.add('token', 1, 2, Decimal('10.00'))
+        del self.redis.hashes[self.key]  # TTL ran out
+        self.assertEqual(self.store.get_lines('token'), {})
+        self.assertFalse(self.store.set_quantity('token', 1, 3))
+        self.assertEqual(self.store.get_lines('token'), {})
+
+    def test_login_merges_into_user_cart(self):
+        product = Product.objects.create(name='Mug', description='Test', sku='REDIS', base_price=10)
+        variant = ProductVariant.objects.create(product=product, sku='REDIS-V', price=10, stock=5)
+        user = get_user_model().objects.create_user(email='redis@example.com', password='secret123')
+        with mock.patch('apps.cart.stores.get_cart_store', return_value=self.store):
+            self.client.post(
+                '/api/cart/add/', {'variant_id': variant.pk, 'quantity': 2}, content_type='application/json'
+            )
+            self.assertEqual(len(self.redis.hashes), 1)
+            self.client.post('/accounts/login/', {'email': 'redis@example.com', 'password': 'secret123'})
+            self.assertEqual(self.client.get('/api/cart/').json()['total_items'], 2)
+        self.assertEqual(self.redis.hashes, {})
+        self.assertEqual(CartItem.objects.get(cart__user=user).quantity, 2)
+
+
+class StockReservationTestCase(TestCase):
+    """Checkout holds on stock: reserve, commit, release and expiry."""
+
+    def setUp(self):
+        product = Product.objects.create(name='Mug', description='Test', sku='HOLD', base_price=10)
+        self.variant = ProductVariant.objects.create(product=product, sku='HOLD-V', price=10, stock=5)
+        users = get_user_model().objects
+        self.carts = []
+        for index, quantity in enumerate([3, 3]):
+            cart = Cart.objects.get_or_create_for_user(
+                users.create_user(email=f'hold{index}@example.com', password='secret123')
+            )
+            CartItem.objects.create(cart=cart, variant=self.variant, quantity=quantity, price_at_add=10)
+            self.carts.append(Cart.objects.load_contents(cart))
+
+    def stock(self):
+        self.variant.refresh_from_db()
+        return self.variant.stock, self.variant.reserved
+
+    def test_reserve_is_all_or_nothing(self):
+        StockReservation.objects.reserve(self.carts[0])
+        StockReservation.objects.reserve(self.carts[0])  # Replaces its own holds
+        self.assertEqual(self.stock(), (5, 3))
+        self.assertEqual(self.variant.available_stock, 2)
+
+        with self.assertRaises(InsufficientStock) as raised:
+            StockReservation.objects.reserve(self.carts[1])
+        self.assertEqual(raised.exception.items, [{'sku': 'HOLD-V', 'requested': 3, 'available': 2}])
+        self.assertEqual(self.stock(), (5, 3))
+        self.assertFalse(StockReservation.objects.filter(cart=self.carts[1]).exists())
+
+    def test_concurrent_checkouts_attach_their_own_holds(self):
+        first = StockReservation.objects.reserve(self.carts[0])
+        second = StockReservation.objects.reserve(self.carts[0])  # Double click
+        self.assertEqual(StockReservation.objects.attach(second, 'cs_second'), 1)
+        self.assertEqual(StockReservation.objects.attach(first, 'cs_first'), 0)
+        self.assertEqual(
+            list(StockReservation.objects.values_list('checkout_session_id', 'quantity')), [('cs_second', 3)]
+        )
+        self.assertEqual(self.stock(), (5, 3))
+
+    def test_commit_and_release(self):
+        holds = StockReservation.objects.reserve(self.carts[0])
+        StockReservation.objects.attach(holds, 'cs_paid')
+        self.assertEqual(StockReservation.objects.commit('cs_paid'), [])
+        self.assertEqual(self.stock(), (2, 0))
+        self.assertEqual(StockReservation.objects.commit('cs_paid'), [])  # Webhook retried
+        self.assertEqual(self.stock(), (2, 0))
+
+        self.carts[1].items.update(quantity=2)
+        StockReservation.objects.reserve(Cart.objects.load_contents(self.carts[1]))
+        StockReservation.objects.release(cart=self.carts[1])
+        self.assertEqual(self.stock(), (2, 0))
+
+    def test_commit_never_oversells(self):
+        holds = StockReservation.objects.reserve(self.carts[0])
+        StockReservation.objects.attach(holds, 'cs_short')
+        self.variant.stock = 1
+        self.variant.save()  # Stock corrected by hand; `reserved` is not written back
+        self.assertEqual(
+            StockReservation.objects.commit('cs_short'), [{'sku': 'HOLD-V', 'requested': 3, 'available': 1}]
+        )
+        self.assertEqual(self.stock(), (1, 0))
+
+    def test_expired_holds_are_swept(self):
+        StockReservation.objects.reserve(self.carts[0])
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        output = StringIO()
+        call_command('release_expired_reservations', batch_size=1, stdout=output)
+        self.assertIn('Released 1 expired reservations', output.getvalue())
+        self.assertEqual(self.stock(), (5, 0))
+
+    def test_reserve_frees_expired_holds(self):
+        StockReservation.objects.reserve(self.carts[0])
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        StockReservation.objects.reserve(self.carts[1])
+        self.assertEqual(self.stock(), (5, 3))
+        self.assertFalse(StockReservation.objects.filter(cart=self.carts[0]).exists())
+
+    def test_catalog_shows_stock_net_of_holds(self):
+        product = self.variant.product
+        self.carts[0].items.update(quantity=5)
+        StockReservation.objects.reserve(Cart.objects.load_contents(self.carts[0]))
+        product.refresh_from_db()
+        self.assertEqual((product.effective_total_stock, product.get_available_stock()), (0, 0))
+        response = self.client.get('/api/products/', {'in_stock': 'true'})
+        self.assertEqual(response.json()['results'], [])
+
+        StockReservation.objects.release(cart=self.carts[0])
+        product.refresh_from_db()
+        self.assertEqual(product.effective_total_stock, 5)
+
+    def test_cart_add_respects_holds(self):
+        StockReservation.objects.reserve(self.carts[0])
+        self.client.force_login(self.carts[1].user)
+        response = self.client.post(
+            '/api/cart/add/', {'variant_id': self.variant.pk, 'quantity': 3}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/cart/checkout/', {}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['out_of_stock'][0]['available'], 2)
+
+    def test_placeholder_checkout_holds_nothing(self):
+        self.client.force_login(self.carts[0].user)
+        response = self.client.post('/api/cart/checkout/', {}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stock(), (5, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+
+class CartBatchTestCase(TestCase):
+    """POST /api/cart/batch/ applies all its operations or none."""
+
+    def setUp(self):
+        caches['carts'].clear()
+        product = Product.objects.create(name='Mug', description='Test', sku='BATCH', base_price=10)
+        self.variants = [
+            ProductVariant.objects.create(product=product, sku=f'BATCH-{index}', price=10, stock=5)
+            for index in range(3)
+        ]
+
+    def batch(self, *operations):
+        return self.client.post('/api/cart/batch/', {'operations': list(operations)}, content_type='application/json')
+
+    def lines(self, response):
+        return {item['product_sku']: item['quantity'] for item in response.json()['cart']['items']}
+
+    def check_operations(self):
+        first, second, third = (variant.pk for variant in self.variants)
+        response = self.batch(
+            {'op': 'add', 'variant_id': first, 'quantity': 2},
+            {'op': 'add', 'variant_id': first, 'quantity': 1},
+            {'op': 'set', 'variant_id': second, 'quantity': 4},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.lines(response), {'BATCH-0': 3, 'BATCH-1': 4})
+
+        response = self.batch(
+            {'op': 'remove', 'variant_id': first},
+            {'op': 'set', 'variant_id': second, 'quantity': 1},
+            {'op': 'add', 'variant_id': third, 'quantity': 6},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['out_of_stock'], [{'sku': 'BATCH-2', 'requested': 6, 'available': 5}])
+
+        response = self.batch(
+            {'op': 'remove', 'variant_id': first},
+            {'op': 'set', 'variant_id': second, 'quantity': 1},
+            {'op': 'add', 'variant_id': third, 'quantity': 5},
+        )
+        self.assertEqual(self.lines(response), {'BATCH-1': 1, 'BATCH-2': 5})
+        return self.client.get('/api/cart/').json()
+
+    def test_user_cart(self):
+        user = get_user_model().objects.create_user(email='batch@example.com', password='secret123')
+        self.client.force_login(user)
+        self.assertEqual(self.check_operations()['total_items'], 6)
+        self.assertEqual(CartItem.objects.filter(cart__user=user).count(), 2)
+
+    def test_stored_cart(self):
+        self.assertEqual(self.check_operations()['total_items'], 6)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_invalid_operations(self):
+        self.assertEqual(self.batch().status_code, 400)
+        self.assertEqual(self.batch({'op': 'set', 'variant_id': self.variants[0].pk}).status_code, 400)
+        response = self.batch({'op': 'add', 'variant_id': 999999, 'quantity': 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('variant_id', response.json())
@@ -2,22 +2,22 @@
 Cart ViewSets and API endpoints for shopping cart management.
 """
 import uuid
-from django.db import transaction
 from django.shortcuts import get_object_or_404
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
 
-from .models import Cart, CartItem
+from .models import Cart, InsufficientStock
+from .stores import StoredCart, get_cart_token, materialize, set_cart_cookie
 from .serializers import (
     CartSerializer,
     CartItemSerializer,
     AddToCartSerializer,
     UpdateCartItemSerializer,
+    BatchCartSerializer,
     CheckoutSessionSerializer,
 )
-from apps.shop.models import ProductVariant
 
 
 class IsAnonymousOrAuthenticated(permissions.BasePermission):
@@ -37,32 +37,44 @@ class CartViewSet(viewsets.ViewSet):
     - POST /api/cart/add/ → Add item to cart
     - PATCH /api/cart/items/<id>/ → Update item quantity
     - DELETE /api/cart/items/<id>/ → Remove item from cart
+    - POST /api/cart/batch/ → Add, set and remove several items at once
     - DELETE /api/cart/ → Clear entire cart
     - POST /api/cart/checkout/ → Create checkout session
     
-    Anonymous users: Cart stored per session
+    Anonymous users: StoredCart in the cart store (apps.cart.stores),
+    identified by a signed cookie; item ids are variant ids
     Authenticated users: Cart linked to user account
     """
     
     permission_classes = [IsAnonymousOrAuthenticated]
     
-    def _get_cart_for_user_or_session(self, request):
+    def _get_cart_for_user_or_session(self, request, load=True):
         """
-        Get or create cart for user or session.
+        Get or create cart for user, with its items, variants, products and
+        images loaded (a fixed number of queries) unless `load` is False,
+        or read the visitor's stored cart (nothing is written until an item
+        is added).
         
         Returns:
-            Cart object
+            Cart or StoredCart object
         """
         if request.user.is_authenticated:
-            cart = Cart.objects.get_or_create_for_user(request.user)
+            if load:
+                cart = Cart.objects.load_for_user(request.user)
+            else:
+                cart = Cart.objects.get_or_create_for_user(request.user)
         else:
-            # Use session key for anonymous users
-            if not request.session.session_key:
-                request.session.create()
-            session_key = request.session.session_key
-            cart = Cart.objects.get_or_create_for_session(session_key)
-        
+            cart = StoredCart(get_cart_token(request))
+        self.cart = cart
         return cart
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """Issue the cart cookie when a stored cart was changed"""
+        response = super().finalize_response(request, response, *args, **kwargs)
+        cart = getattr(self, 'cart', None)
+        if isinstance(cart, StoredCart) and cart.changed:
+            set_cart_cookie(response, cart.token)
+        return response
     
     def list(self, request):
         """
@@ -86,60 +98,32 @@ class CartViewSet(viewsets.ViewSet):
         serializer = AddToCartSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        variant_id = serializer.validated_data['variant_id']
+        # Looked up (with its product) while validating
+        variant = serializer.validated_data['variant']
         quantity = serializer.validated_data['quantity']
         
-        try:
-            variant = ProductVariant.objects.select_related('product').get(
-                id=variant_id,
-                is_active=True
-            )
-        except ProductVariant.DoesNotExist:
-            return Response(
-                {'error': 'Variant not found or inactive'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-        
         # Check stock
-        if quantity > variant.stock:
+        if quantity > variant.available_stock:
             return Response(
                 {
-                    'error': f'Insufficient stock. Available: {variant.stock}, Requested: {quantity}',
-                    'available_stock': variant.stock
+                    'error': f'Insufficient stock. Available: {variant.available_stock}, Requested: {quantity}',
+                    'available_stock': variant.available_stock
                 },
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         cart = self._get_cart_for_user_or_session(request)
-        
-        # Use atomic transaction to prevent race conditions
-        with transaction.atomic():
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                variant=variant,
-                defaults={
-                    'quantity': quantity,
-                    'price_at_add': variant.price,
-                }
+        current_quantity, added = cart.add_variant(variant, quantity)
+        if not added:
+            return Response(
+                {
+                    'error': f'Cannot add {quantity} more items. Total would exceed stock.',
+                    'current_quantity': current_quantity,
+                    'available_stock': variant.available_stock
+                },
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
-            if not created:
-                # Item already in cart, increase quantity
-                new_quantity = cart_item.quantity + quantity
-                if new_quantity > variant.stock:
-                    return Response(
-                        {
-                            'error': f'Cannot add {quantity} more items. Total would exceed stock.',
-                            'current_quantity': cart_item.quantity,
-                            'available_stock': variant.stock
-                        },
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                cart_item.quantity = new_quantity
-                cart_item.save()
         
-        # Refresh cart from database
-        cart.refresh_from_db()
         serializer = CartSerializer(cart)
         return Response(
             {
@@ -160,10 +144,8 @@ class CartViewSet(viewsets.ViewSet):
         }
         """
         cart = self._get_cart_for_user_or_session(request)
-        
-        try:
-            cart_item = cart.items.get(id=item_id)
-        except CartItem.DoesNotExist:
+        cart_item = cart.get_item(item_id)
+        if cart_item is None:
             return Response(
                 {'error': 'Cart item not found'},
                 status=status.HTTP_404_NOT_FOUND
@@ -175,43 +157,40 @@ class CartViewSet(viewsets.ViewSet):
         new_quantity = serializer.validated_data['quantity']
         
         # Check stock
-        if new_quantity > cart_item.variant.stock:
+        if new_quantity > cart_item.variant.available_stock:
             return Response(
                 {
-                    'error': f'Insufficient stock. Available: {cart_item.variant.stock}',
-                    'available_stock': cart_item.variant.stock
+                    'error': f'Insufficient stock. Available: {cart_item.variant.available_stock}',
+                    'available_stock': cart_item.variant.available_stock
                 },
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        cart_item.quantity = new_quantity
-        cart_item.save()
+        cart.set_item_quantity(cart_item, new_quantity)
         
-        # Refresh and return updated cart
-        cart.refresh_from_db()
+        # Return updated cart
         serializer = CartSerializer(cart)
         return Response(serializer.data)
     
-    @action(detail=False, methods=['delete'], url_path='items/(?P<item_id>[^/.]+)')
+    # Same URL as update_item: two separate actions would register the
+    # pattern twice and the first one would answer every method
+    @update_item.mapping.delete
     def remove_item(self, request, item_id=None):
         """
         DELETE /api/cart/items/<id>/ - Remove item from cart
         """
         cart = self._get_cart_for_user_or_session(request)
-        
-        try:
-            cart_item = cart.items.get(id=item_id)
-        except CartItem.DoesNotExist:
+        cart_item = cart.get_item(item_id)
+        if cart_item is None:
             return Response(
                 {'error': 'Cart item not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
         
         variant_sku = cart_item.variant.sku
-        cart_item.delete()
+        cart.remove_item(cart_item)
         
-        # Refresh and return updated cart
-        cart.refresh_from_db()
+        # Return updated cart
         serializer = CartSerializer(cart)
         return Response(
             {
@@ -220,14 +199,56 @@ class CartViewSet(viewsets.ViewSet):
             }
         )
     
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        POST /api/cart/batch/ - Apply several operations at once
+        
+        Request body:
+        {
+            "operations": [
+                {"op": "add", "variant_id": 1, "quantity": 2},
+                {"op": "set", "variant_id": 2, "quantity": 1},
+                {"op": "remove", "variant_id": 3}
+            ]
+        }
+        
+        Operations apply in order and all together: if any line would go
+        over the available stock, nothing changes.
+        """
+        serializer = BatchCartSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data['operations']
+        
+        # A user's cart is read, locked, by apply_operations()
+        cart = self._get_cart_for_user_or_session(request, load=False)
+        try:
+            cart.apply_operations(operations, serializer.validated_data['variants'])
+        except InsufficientStock as e:
+            return Response(
+                {
+                    'error': 'Insufficient stock',
+                    'out_of_stock': e.items
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(
+            {
+                'message': f'Applied {len(operations)} operations to cart',
+                'cart': CartSerializer(cart).data
+            }
+        )
+    
     @action(detail=False, methods=['delete'])
     def clear(self, request):
         """
         DELETE /api/cart/ - Clear entire cart
         """
         cart = self._get_cart_for_user_or_session(request)
-        item_count = cart.items.count()
-        cart.clear()
+        item_count = cart.clear()
+        if isinstance(cart, Cart):
+            Cart.objects.load_contents(cart)
         
         return Response(
             {
@@ -260,15 +281,21 @@ class CartViewSet(viewsets.ViewSet):
                 {'error': 'Cannot checkout with empty cart'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+        # Anonymous carts become Cart rows at checkout
+        if isinstance(cart, StoredCart):
+            cart = materialize(cart)
         
-        # Check all items are still in stock
+        # Check all items are still in stock. Nothing is held: no payment
+        # session settles this placeholder, so holds would only lock stock
+        # away until they expire (POST /api/payment/checkout/ holds it)
         out_of_stock_items = []
         for item in cart.items.all():
             if not item.is_in_stock():
                 out_of_stock_items.append({
                     'sku': item.variant.sku,
                     'requested': item.quantity,
-                    'available': item.variant.stock
+                    'available': item.variant.available_stock
                 })
         
         if out_of_stock_items:
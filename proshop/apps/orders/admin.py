@@ -12,11 +12,11 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ('order_number', 'user', 'status', 'payment_status', 'total', 'created_at')
     list_filter = ('status', 'payment_status', 'created_at')
     search_fields = ('order_number', 'user__username', 'tracking_number')
-    readonly_fields = ('order_number', 'created_at', 'updated_at')
+    readonly_fields = ('order_number', 'stock_committed', 'created_at', 'updated_at')
     inlines = [OrderItemInline]
     fieldsets = (
         ('Order Information', {
-            'fields': ('order_number', 'user', 'status', 'payment_status')
+            'fields': ('order_number', 'user', 'status', 'payment_status', 'stock_committed')
         }),
         ('Shipping Address', {
             'fields': ('shipping_address', 'shipping_city', 'shipping_state', 'shipping_postal_code', 'shipping_country')
@@ -4,11 +4,25 @@ Order API Views for REST endpoints
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions, filters, pagination
+from rest_framework.exceptions import NotFound, ValidationError
+from django.db.models import Prefetch
+from django.utils.dateparse import parse_date
 from django_filters.rest_framework import DjangoFilterBackend
+from apps.utils.exports import EXPORT_RENDERERS, stream_export
+from apps.utils.pagination import KeysetPagination
+from .exports import ORDER_EXPORT_HEADER, order_export_queryset, order_record, order_rows
 from .models import Order, OrderItem
 from .serializers import OrderSerializer, OrderItemSerializer
 
 
+def serialized_orders(user):
+    """A user's orders with everything OrderSerializer reads, in two queries."""
+    items = OrderItem.objects.select_related('product', 'variant').order_by('pk')
+    return Order.objects.filter(user=user).select_related('user').prefetch_related(
+        Prefetch('items', queryset=items)
+    )
+
+
 class OrderListView(APIView):
     """
     List authenticated user's orders
@@ -17,14 +31,15 @@ class OrderListView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        """Get user's orders"""
+        """Get user's orders (cursor-paginated, ?page= still supported)"""
+        paginator = KeysetPagination()
         try:
-            orders = Order.objects.filter(user=request.user).order_by('-created_at')
-            serializer = OrderSerializer(orders, many=True)
-            return Response({
-                'count': orders.count(),
-                'results': serializer.data
-            }, status=status.HTTP_200_OK)
+            orders = serialized_orders(request.user).order_by('-created_at')
+            page = paginator.paginate_queryset(orders, request, view=self)
+            serializer = OrderSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+        except NotFound:
+            raise
         except Exception as e:
             return Response(
                 {'error': str(e)},
@@ -42,7 +57,7 @@ class OrderDetailView(APIView):
     def get(self, request, pk):
         """Get order details"""
         try:
-            order = Order.objects.get(id=pk, user=request.user)
+            order = serialized_orders(request.user).get(id=pk)
             serializer = OrderSerializer(order)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Order.DoesNotExist:
@@ -67,7 +82,7 @@ class OrderByNumberView(APIView):
     def get(self, request, order_number):
         """Get order by number"""
         try:
-            order = Order.objects.get(order_number=order_number, user=request.user)
+            order = serialized_orders(request.user).get(order_number=order_number)
             serializer = OrderSerializer(order)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Order.DoesNotExist:
@@ -118,3 +133,42 @@ class OrderCancelView(APIView):
                 {'error': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+
+class OrderExportView(APIView):
+    """
+    Stream all orders with their items (staff only)
+    GET /orders/api/export/?format=csv|ndjson
+
+    Query parameters:
+    - ?status=shipped / ?payment_status=paid
+    - ?created_after=2024-01-01 / ?created_before=2024-02-01 (dates, inclusive)
+    """
+    permission_classes = [permissions.IsAdminUser]
+    renderer_classes = EXPORT_RENDERERS
+
+    def get(self, request):
+        """Stream the export"""
+        orders = order_export_queryset()
+        for field in ('status', 'payment_status'):
+            value = request.query_params.get(field)
+            if value:
+                orders = orders.filter(**{field: value})
+        for param, lookup in (('created_after', 'created_at__date__gte'), ('created_before', 'created_at__date__lte')):
+            value = request.query_params.get(param)
+            if value:
+                try:
+                    day = parse_date(value)
+                except ValueError:
+                    day = None
+                if day is None:
+                    raise ValidationError({param: 'Expected a date (YYYY-MM-DD)'})
+                orders = orders.filter(**{lookup: day})
+        return stream_export(
+            orders,
+            request.accepted_renderer.format,
+            filename='orders',
+            header=ORDER_EXPORT_HEADER,
+            rows=order_rows,
+            record=order_record,
+        )
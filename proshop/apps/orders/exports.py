@@ -0,0 +1,84 @@
+"""
+Order export (see apps.utils.exports)
+
+CSV has one row per order item with the order columns repeated; NDJSON has
+one order per line with its items nested.
+"""
+from django.db.models import Prefetch
+from .models import Order, OrderItem
+
+
+ORDER_EXPORT_HEADER = [
+    'order_number', 'created_at', 'status', 'payment_status', 'customer_email',
+    'subtotal', 'shipping_cost', 'tax', 'total',
+    'shipping_city', 'shipping_country',
+    'product_sku', 'product_name', 'variant_sku', 'quantity', 'price', 'discount', 'line_total',
+]
+
+
+def order_export_queryset():
+    """Orders with customer and items (product/variant joined), oldest first."""
+    items = OrderItem.objects.select_related('product', 'variant').order_by('pk')
+    return Order.objects.select_related('user').prefetch_related(
+        Prefetch('items', queryset=items)
+    ).order_by('pk')
+
+
+def order_rows(order):
+    """CSV rows for one order."""
+    base = [
+        order.order_number,
+        order.created_at.isoformat(),
+        order.status,
+        order.payment_status,
+        order.user.email,
+        order.subtotal,
+        order.shipping_cost,
+        order.tax,
+        order.total,
+        order.shipping_city,
+        order.shipping_country,
+    ]
+    items = order.items.all()
+    if not items:
+        yield base + [''] * 7
+    for item in items:
+        yield base + [
+            item.product.sku,
+            item.product.name,
+            item.variant.sku if item.variant else '',
+            item.quantity,
+            item.price,
+            item.discount,
+            item.get_total_price(),
+        ]
+
+
+def order_record(order):
+    """NDJSON document for one order."""
+    return {
+        'id': order.pk,
+        'order_number': order.order_number,
+        'created_at': order.created_at,
+        'status': order.status,
+        'payment_status': order.payment_status,
+        'customer_email': order.user.email,
+        'subtotal': order.subtotal,
+        'shipping_cost': order.shipping_cost,
+        'tax': order.tax,
+        'total': order.total,
+        'shipping_city': order.shipping_city,
+        'shipping_country': order.shipping_country,
+        'items': [
+            {
+                'product_sku': item.product.sku,
+                'product_name': item.product.name,
+                'variant_sku': item.variant.sku if item.variant else None,
+                'quantity': item.quantity,
+                'price': item.price,
+                'discount': item.discount,
+                'line_total': item.get_total_price(),
+            }
+            for item in order.items.all()
+        ],
+    }
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.10 on 2026-10-17 01:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("orders", "0002_order_stripe_session_id_alter_order_order_number_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="stock_committed",
+            field=models.BooleanField(
+                default=False,
+                editable=False,
+                help_text="Ordered quantities taken off stock",
+            ),
+        ),
+    ]
@@ -1,5 +1,7 @@
-from django.db import models
+from collections import Counter
+from django.db import models, transaction
 from django.conf import settings
+from apps.cart.models import CommittedCheckout, StockReservation
 from apps.shop.models import Product, ProductVariant
 
 
@@ -26,6 +28,7 @@ class Order(models.Model):
     order_number = models.CharField(max_length=50, unique=True, db_index=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS, default='unpaid')
+    stock_committed = models.BooleanField(default=False, editable=False, help_text="Ordered quantities taken off stock")
 
     # Stripe Session ID
     stripe_session_id = models.CharField(max_length=200, blank=True, null=True, db_index=True)
@@ -76,6 +79,33 @@ class Order(models.Model):
         self.status = 'confirmed'
         self.save()
 
+    def commit_stock(self):
+        """
+        Take the ordered quantities off stock, once: the first call flags
+        the order with a conditional UPDATE (redelivered payment webhooks
+        racing each other wait on the row and find it flagged), later
+        calls do nothing. An order paid through Stripe is also claimed as
+        its session's CommittedCheckout, the key StockReservation.objects
+        .commit() settles a session by: whichever of the two runs first
+        takes the stock. The checkout holds of the order's Stripe session
+        are consumed. Returns the shortfalls, [{'sku', 'requested', 'available'}].
+        """
+        with transaction.atomic():
+            first = Order.objects.filter(pk=self.pk, stock_committed=False).update(stock_committed=True)
+            self.stock_committed = True
+            if not first:
+                return []
+            if self.stripe_session_id and not CommittedCheckout.objects.claim(self.stripe_session_id):
+                return []
+            quantities = Counter()
+            for variant_id, quantity in self.items.filter(variant__isnull=False).values_list('variant_id', 'quantity'):
+                quantities[variant_id] += quantity
+            held = (
+                StockReservation.objects.take(checkout_session_id=self.stripe_session_id)
+                if self.stripe_session_id else {}
+            )
+            return ProductVariant.objects.commit_stock(quantities, held=held)
+
     def mark_failed(self):
         """Mark order payment as failed"""
         self.payment_status = 'failed'
@@ -10,6 +10,10 @@ class OrderItemSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     variant_sku = serializers.CharField(source='variant.sku', read_only=True)
     variant_name = serializers.SerializerMethodField(read_only=True)
+    unit_price = serializers.DecimalField(source='price', max_digits=10, decimal_places=2, read_only=True)
+    total_price = serializers.DecimalField(
+        source='get_total_price', max_digits=10, decimal_places=2, read_only=True
+    )
 
     def get_variant_name(self, obj):
         if obj.variant:
@@ -1,10 +1,12 @@
 """
 Order signals for email notifications and other events
 """
+import time
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.core.mail import send_mail
 from django.conf import settings
+from apps.utils.metrics import EMAIL_SEND_DURATION
 from .models import Order
 
 
@@ -24,6 +26,18 @@ def send_order_notification_email(sender, instance, created, **kwargs):
         send_order_shipped_email(instance)
 
 
+def timed_send_mail(kind, subject, message, recipient_list):
+    """send_mail() recording its latency under email_send_duration_ms{kind}."""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        sent = send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, recipient_list, fail_silently=True)
+        outcome = 'sent' if sent else 'failed'
+        return sent
+    finally:
+        EMAIL_SEND_DURATION.observe((kind, outcome), (time.perf_counter() - started) * 1000)
+
+
 def send_order_confirmation_email(order):
     """Send order confirmation email"""
     try:
@@ -62,13 +76,7 @@ Proshop Team
 noreply@proshop.com
         """
         
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [order.user.email],
-            fail_silently=True,
-        )
+        timed_send_mail('confirmation', subject, message, [order.user.email])
     except Exception as e:
         print(f"Error sending order confirmation email: {str(e)}")
 
@@ -93,13 +101,7 @@ Best regards,
 Proshop Team
         """
         
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [order.user.email],
-            fail_silently=True,
-        )
+        timed_send_mail('paid', subject, message, [order.user.email])
     except Exception as e:
         print(f"Error sending payment email: {str(e)}")
 
@@ -122,12 +124,6 @@ Best regards,
 Proshop Team
         """
         
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [order.user.email],
-            fail_silently=True,
-        )
+        timed_send_mail('shipped', subject, message, [order.user.email])
     except Exception as e:
         print(f"Error sending shipping email: {str(e)}")
@@ -1,6 +1,16 @@
+import csv
+import io
+import json
+from datetime import timedelta
 from django.test import TestCase
 from django.contrib.auth.models import User
-from apps.shop.models import Category, Product
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from apps.shop.models import Category, Product, ProductVariant
+from apps.utils.query_budgets import QueryBudgetTestMixin
+from apps.cart.models import StockReservation
 from .models import Order, OrderItem
 
 
@@ -37,3 +47,149 @@ class OrderTestCase(TestCase):
         )
         self.assertEqual(order.order_number, 'ORD001')
         self.assertEqual(order.user, self.user)
+
+
+class OrderExportTestCase(TestCase):
+    """Staff-only streaming order export."""
+
+    def setUp(self):
+        user_model = get_user_model()
+        self.customer = user_model.objects.create_user(email='customer@example.com', password='secret123')
+        self.admin = user_model.objects.create_superuser(email='admin@example.com', password='secret123')
+        product = Product.objects.create(name='Mug', description='Test', sku='MUG1', base_price=10)
+        address = {
+            f'{kind}_{field}': 'X'
+            for kind in ('shipping', 'billing')
+            for field in ('address', 'city', 'state', 'postal_code', 'country')
+        }
+        for number, status in (('ORD1', 'pending'), ('ORD2', 'shipped')):
+            order = Order.objects.create(
+                user=self.customer, order_number=number, status=status, subtotal=20, total=20, **address
+            )
+            OrderItem.objects.create(order=order, product=product, quantity=2, price=10)
+
+    def content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_requires_staff(self):
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get('/orders/api/export/').status_code, 403)
+
+    def test_csv_has_one_row_per_item(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/orders/api/export/', {'status': 'shipped'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(io.StringIO(self.content(response))))
+        self.assertEqual([(row['order_number'], row['product_sku'], row['line_total']) for row in rows],
+                         [('ORD2', 'MUG1', '20.00')])
+
+    def test_ndjson_nests_items_in_constant_queries(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/orders/api/export/', {'format': 'ndjson'})
+        with self.assertNumQueries(2):
+            lines = self.content(response).splitlines()
+        orders = [json.loads(line) for line in lines]
+        self.assertEqual([order['order_number'] for order in orders], ['ORD1', 'ORD2'])
+        self.assertEqual(orders[0]['items'][0]['quantity'], 2)
+
+
+class OrderQueryBudgetTestCase(QueryBudgetTestMixin, TestCase):
+    """Order API endpoints stay within apps.utils.query_budgets."""
+
+    def setUp(self):
+        user_model = get_user_model()
+        self.customer = user_model.objects.create_user(email='budget@example.com', password='secret123')
+        self.admin = user_model.objects.create_superuser(email='budget-admin@example.com', password='secret123')
+        self.product = Product.objects.create(name='Mug', description='Test', sku='MUG1', base_price=10)
+        self.variant = ProductVariant.objects.create(product=self.product, sku='MUG1-V', price=10, stock=5)
+        self.order = self.add_orders(2)[0]
+
+    def add_orders(self, count):
+        """Orders for the customer, each with two items."""
+        address = {
+            f'{kind}_{field}': 'X'
+            for kind in ('shipping', 'billing')
+            for field in ('address', 'city', 'state', 'postal_code', 'country')
+        }
+        orders = []
+        for _ in range(count):
+            order = Order.objects.create(
+                user=self.customer, order_number=f'BUDGET{Order.objects.count()}', subtotal=20, total=20, **address
+            )
+            OrderItem.objects.create(order=order, product=self.product, variant=self.variant, quantity=1, price=10)
+            OrderItem.objects.create(order=order, product=self.product, quantity=1, price=10)
+            orders.append(order)
+        return orders
+
+    def grow(self):
+        self.add_orders(3)
+
+    def test_customer_endpoints(self):
+        self.client.force_login(self.customer)
+        response = self.assertWithinQueryBudget('get', '/orders/api/', grow=self.grow)
+        self.assertEqual(response.json()['results'][0]['items'][0]['total_price'], '10.00')
+        self.assertWithinQueryBudget('get', f'/orders/api/{self.order.pk}/')
+        self.assertWithinQueryBudget('get', f'/orders/api/number/{self.order.order_number}/')
+        self.assertWithinQueryBudget('post', f'/orders/api/{self.order.pk}/cancel/')
+
+    def test_export(self):
+        self.client.force_login(self.admin)
+        self.assertWithinQueryBudget('get', '/orders/api/export/?format=csv', grow=self.grow)
+
+
+class OrderStockCommitTestCase(TestCase):
+    """Order.commit_stock(): one guarded UPDATE, once per order."""
+
+    def setUp(self):
+        customer = get_user_model().objects.create_user(email='stock@example.com', password='secret123')
+        product = Product.objects.create(name='Mug', description='Test', sku='MUG1', base_price=10)
+        self.held = ProductVariant.objects.create(product=product, sku='MUG1-HELD', price=10, stock=5)
+        self.scarce = ProductVariant.objects.create(product=product, sku='MUG1-SCARCE', price=10, stock=1)
+        self.order = Order.objects.create(
+            user=customer, order_number='STOCK1', stripe_session_id='cs_stock', subtotal=50, total=50,
+            **{
+                f'{kind}_{field}': 'X'
+                for kind in ('shipping', 'billing')
+                for field in ('address', 'city', 'state', 'postal_code', 'country')
+            }
+        )
+        for variant, quantity in ((self.held, 2), (self.scarce, 2), (self.held, 1)):
+            OrderItem.objects.create(order=self.order, product=product, variant=variant, quantity=quantity, price=10)
+        StockReservation.objects.create(
+            variant=self.held, quantity=3, checkout_session_id='cs_stock',
+            expires_at=timezone.now() + timedelta(minutes=30),
+        )
+        ProductVariant.objects.filter(pk=self.held.pk).update(reserved=3)
+
+    def stock(self, variant):
+        variant.refresh_from_db()
+        return variant.stock, variant.reserved
+
+    def test_commit_once_with_shortfalls(self):
+        with CaptureQueriesContext(connection) as captured:
+            shortfalls = self.order.commit_stock()
+        self.assertEqual(shortfalls, [{'sku': 'MUG1-SCARCE', 'requested': 2, 'available': 1}])
+        variant_updates = [
+            query for query in captured.captured_queries
+            if query['sql'].startswith('UPDATE "shop_productvariant"')
+        ]
+        self.assertEqual(len(variant_updates), 1)
+        self.assertEqual(self.stock(self.held), (2, 0))
+        self.assertEqual(self.stock(self.scarce), (1, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+        # Redelivered webhook, with a stale copy of the order
+        self.assertEqual(Order.objects.get(pk=self.order.pk).commit_stock(), [])
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.stock_committed)
+        self.assertEqual(self.stock(self.held), (2, 0))
+
+    def test_session_settled_before_the_order_was_found(self):
+        # First delivery found no order and settled the session's holds
+        self.assertEqual(StockReservation.objects.commit('cs_stock'), [])
+        self.assertEqual(self.stock(self.held), (2, 0))
+
+        # Redelivery finds the order: the session is already settled
+        self.assertEqual(self.order.commit_stock(), [])
+        self.assertEqual(self.stock(self.held), (2, 0))
+        self.assertEqual(self.stock(self.scarce), (1, 0))
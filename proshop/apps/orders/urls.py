@@ -5,6 +5,7 @@ from .api_views import (
     OrderDetailView,
     OrderByNumberView,
     OrderCancelView,
+    OrderExportView,
 )
 
 urlpatterns = [
@@ -16,6 +17,7 @@ urlpatterns = [
     
     # API endpoints
     path('api/', OrderListView.as_view(), name='api-order-list'),
+    path('api/export/', OrderExportView.as_view(), name='api-order-export'),
     path('api/<int:pk>/', OrderDetailView.as_view(), name='api-order-detail'),
     path('api/number/<str:order_number>/', OrderByNumberView.as_view(), name='api-order-by-number'),
     path('api/<int:pk>/cancel/', OrderCancelView.as_view(), name='api-order-cancel'),
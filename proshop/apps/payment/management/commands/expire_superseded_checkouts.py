@@ -0,0 +1,52 @@
+"""
+Management command to expire Stripe sessions replaced by a newer checkout
+Usage: python manage.py expire_superseded_checkouts [--every 300]
+
+A cart that checks out again holds its stock for the new session while the
+earlier one may still be paid. This asks Stripe to expire the earlier
+sessions and frees their holds; a session Stripe will not expire (paid, or
+being paid) keeps them for its completed webhook. Kept off the checkout
+request so customers never wait on these calls. --every keeps it running,
+sweeping every N seconds (the Procfile `session_sweeper` process).
+"""
+import logging
+import time
+
+import stripe
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from apps.cart.models import StockReservation
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Expire Stripe checkout sessions replaced by a newer checkout of the same cart'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every',
+            type=int,
+            default=None,
+            help='Keep running, sweeping every N seconds'
+        )
+
+    def handle(self, *args, **options):
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        while True:
+            self.sweep()
+            if not options['every']:
+                break
+            time.sleep(options['every'])
+
+    def sweep(self):
+        expired = 0
+        for session_id in sorted(StockReservation.objects.superseded_sessions()):
+            try:
+                stripe.checkout.Session.expire(session_id)
+            except stripe.error.StripeError as e:
+                logger.info(f"Keeping holds of session {session_id}: {str(e)}")
+                continue
+            StockReservation.objects.release(checkout_session_id=session_id)
+            expired += 1
+        self.stdout.write(self.style.SUCCESS(f'[OK] Expired {expired} superseded checkout sessions'))
@@ -4,7 +4,8 @@ Payment success/cancel pages
 from django.shortcuts import render, redirect
 from django.views import View
 from django.contrib import messages
-from apps.orders.models import Order
+from django.db.models import Prefetch
+from apps.orders.models import Order, OrderItem
 
 
 class OrderSuccessView(View):
@@ -18,7 +19,11 @@ class OrderSuccessView(View):
         order = None
         if order_id:
             try:
-                order = Order.objects.get(id=order_id, user=request.user) if request.user.is_authenticated else Order.objects.get(id=order_id)
+                # The page lists every item with its product name
+                orders = Order.objects.select_related('user').prefetch_related(
+                    Prefetch('items', queryset=OrderItem.objects.select_related('product'))
+                )
+                order = orders.get(id=order_id, user=request.user) if request.user.is_authenticated else orders.get(id=order_id)
             except Order.DoesNotExist:
                 pass
         
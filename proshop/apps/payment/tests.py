@@ -1,7 +1,18 @@
+import time
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 from django.test import TestCase
 from django.contrib.auth.models import User
-from apps.shop.models import Category, Product
-from apps.orders.models import Order
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+import stripe
+from apps.shop.models import Category, Product, ProductVariant
+from apps.orders.models import Order, OrderItem
+from apps.utils.query_budgets import QueryBudgetTestMixin
+from apps.cart.models import Cart, CartItem, StockReservation
+from apps.utils import metrics
+from apps.utils.metrics import CHECKOUT_SESSIONS, WEBHOOK_EVENTS, WEBHOOK_LAG
 from .models import Payment
 
 
@@ -43,3 +54,189 @@ class PaymentTestCase(TestCase):
         )
         self.assertEqual(payment.order, self.order)
         self.assertEqual(payment.status, 'pending')
+
+
+
+class PaymentQueryBudgetTestCase(QueryBudgetTestMixin, TestCase):
+    """Checkout and payment pages stay within apps.utils.query_budgets."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='budget@example.com', password='secret123')
+        self.cart = Cart.objects.get_or_create_for_user(self.user)
+        self.product = Product.objects.create(name='Mug', description='Test', sku='PAY', base_price=10)
+        self.add_items(2)
+        self.order = Order.objects.create(
+            user=self.user, order_number='PAY1', stripe_session_id='cs_budget', subtotal=10, total=10,
+            **{
+                f'{kind}_{field}': 'X'
+                for kind in ('shipping', 'billing')
+                for field in ('address', 'city', 'state', 'postal_code', 'country')
+            }
+        )
+        self.client.force_login(self.user)
+
+    def add_items(self, count):
+        """Put `count` more variants of the product into the cart."""
+        start = self.cart.items.count()
+        for index in range(start, start + count):
+            variant = ProductVariant.objects.create(product=self.product, sku=f'PAY-{index}', price=10, stock=5)
+            CartItem.objects.create(cart=self.cart, variant=variant, quantity=1, price_at_add=10)
+
+    def grow(self):
+        """Three more cart items; the holds of the previous checkout released."""
+        self.add_items(3)
+        StockReservation.objects.release(cart=self.cart)
+
+    def add_order_items(self, count):
+        """Add `count` lines, each for a new product, to the order."""
+        for index in range(count):
+            product = Product.objects.create(
+                name=f'Line {index}', description='Test', sku=f'PAY-LINE-{self.order.items.count()}', base_price=10
+            )
+            OrderItem.objects.create(order=self.order, product=product, quantity=1, price=10)
+
+    def test_checkout(self):
+        session = SimpleNamespace(id='cs_budget', url='https://checkout.stripe.test/cs_budget')
+        with mock.patch('stripe.checkout.Session.create', return_value=session):
+            self.assertWithinQueryBudget('post', '/api/payment/checkout/', {}, grow=self.grow)
+
+    def test_status_and_pages(self):
+        session = SimpleNamespace(payment_status='paid')
+        with mock.patch('stripe.checkout.Session.retrieve', return_value=session):
+            self.assertWithinQueryBudget('get', '/api/payment/status/?session_id=cs_budget')
+        self.assertWithinQueryBudget(
+            'get', f'/payment/success/?order_id={self.order.pk}', grow=lambda: self.add_order_items(3)
+        )
+        self.assertWithinQueryBudget('get', '/payment/cancel/')
+
+
+class PaymentMetricsTestCase(TestCase):
+    """Checkout and webhook throughput counters."""
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_checkout_outcomes(self):
+        user = get_user_model().objects.create_user(email='metrics@example.com', password='secret123')
+        self.client.force_login(user)
+        response = self.client.post('/api/payment/checkout/', {}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(CHECKOUT_SESSIONS.snapshot(), {('empty_cart',): 1})
+
+    def test_webhook_outcomes_and_lag(self):
+        response = self.client.post('/api/payment/webhook/', b'{}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        event = {'type': 'customer.created', 'created': int(time.time()) - 90, 'data': {'object': {}}}
+        with mock.patch('stripe.Webhook.construct_event', return_value=event):
+            response = self.client.post('/api/payment/webhook/', b'{}', content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        events = WEBHOOK_EVENTS.snapshot()
+        self.assertEqual(events[('customer.created', 'ignored')], 1)
+        self.assertEqual(sum(count for (_, outcome), count in events.items() if outcome.startswith('invalid')), 1)
+        lag = WEBHOOK_LAG.snapshot()[('customer.created',)]
+        self.assertEqual(lag['count'], 1)
+        self.assertGreaterEqual(lag['sum'], 90)
+
+
+class CheckoutReservationTestCase(TestCase):
+    """Stock held by a Stripe checkout until it is paid or expires."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='hold@example.com', password='secret123')
+        self.product = Product.objects.create(name='Mug', description='Test', sku='HOLD', base_price=10)
+        self.variant = ProductVariant.objects.create(product=self.product, sku='HOLD-V', price=10, stock=5)
+        CartItem.objects.create(
+            cart=Cart.objects.get_or_create_for_user(self.user), variant=self.variant, quantity=2, price_at_add=10
+        )
+        self.client.force_login(self.user)
+
+    def checkout(self, session_id):
+        session = SimpleNamespace(id=session_id, url=f'https://checkout.stripe.test/{session_id}')
+        with mock.patch('stripe.checkout.Session.create', return_value=session) as create:
+            response = self.client.post('/api/payment/checkout/', {}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('expires_at', create.call_args.kwargs)
+
+    def sweep(self, expire_error=None):
+        with mock.patch('stripe.checkout.Session.expire', side_effect=expire_error) as expire:
+            call_command('expire_superseded_checkouts', stdout=StringIO())
+        return expire
+
+    def webhook(self, event_type, session_id):
+        event = {'type': event_type, 'created': int(time.time()), 'data': {'object': {'id': session_id}}}
+        with mock.patch('stripe.Webhook.construct_event', return_value=event):
+            response = self.client.post('/api/payment/webhook/', b'{}', content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def stock(self):
+        self.variant.refresh_from_db()
+        return self.variant.stock, self.variant.reserved
+
+    def test_expired_then_paid(self):
+        self.checkout('cs_first')
+        self.assertEqual(self.stock(), (5, 2))
+        self.webhook('checkout.session.expired', 'cs_first')
+        self.assertEqual(self.stock(), (5, 0))
+
+        self.checkout('cs_second')
+        with self.assertLogs('apps.payment.views', level='WARNING'):
+            self.webhook('checkout.session.completed', 'cs_second')   # No order in this test
+        self.assertEqual(self.stock(), (3, 0))
+
+    def test_sweep_expires_the_previous_session(self):
+        self.checkout('cs_first')
+        self.checkout('cs_second')
+        self.assertEqual(self.stock(), (5, 4))
+        expire = self.sweep()
+        expire.assert_called_once_with('cs_first')
+        self.assertEqual(self.stock(), (5, 2))
+        self.sweep().assert_not_called()
+
+    def test_sweep_keeps_holds_of_a_session_being_paid(self):
+        self.checkout('cs_first')
+        self.checkout('cs_second')
+        self.sweep(expire_error=stripe.error.InvalidRequestError('Session is complete', None))
+        self.assertEqual(self.stock(), (5, 4))
+        with self.assertLogs('apps.payment.views', level='WARNING'):
+            self.webhook('checkout.session.completed', 'cs_first')
+        self.assertEqual(self.stock(), (3, 2))
+
+    def test_paid_without_holds_takes_line_items_once(self):
+        self.checkout('cs_late')
+        self.webhook('checkout.session.expired', 'cs_late')
+        line_items = mock.Mock()
+        line_items.auto_paging_iter.return_value = [
+            {'quantity': 2, 'price': {'product': {'metadata': {'variant_id': str(self.variant.pk)}}}},
+        ]
+        with mock.patch('stripe.checkout.Session.list_line_items', return_value=line_items) as list_line_items, \
+                self.assertLogs('apps.payment.views', level='WARNING'):
+            self.webhook('checkout.session.completed', 'cs_late')
+            self.webhook('checkout.session.completed', 'cs_late')   # Redelivered
+        self.assertEqual(list_line_items.call_count, 1)
+        self.assertEqual(self.stock(), (3, 0))
+
+    def test_stripe_error_releases_holds(self):
+        error = stripe.error.APIConnectionError('down')
+        with mock.patch('stripe.checkout.Session.create', side_effect=error):
+            response = self.client.post('/api/payment/checkout/', {}, content_type='application/json')
+        self.assertGreaterEqual(response.status_code, 400)
+        self.assertEqual(self.stock(), (5, 0))
+
+    def test_paid_order_is_committed_once(self):
+        self.checkout('cs_order')
+        order = Order.objects.create(
+            user=self.user, order_number='HOLD1', stripe_session_id='cs_order', subtotal=20, total=20,
+            **{
+                f'{kind}_{field}': 'X'
+                for kind in ('shipping', 'billing')
+                for field in ('address', 'city', 'state', 'postal_code', 'country')
+            }
+        )
+        OrderItem.objects.create(order=order, product=self.product, variant=self.variant, quantity=2, price=10)
+        self.webhook('checkout.session.completed', 'cs_order')
+        self.webhook('checkout.session.completed', 'cs_order')   # Redelivered
+        self.assertEqual(self.stock(), (3, 0))
+        order.refresh_from_db()
+        self.assertEqual((order.payment_status, order.stock_committed), ('paid', True))
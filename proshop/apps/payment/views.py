@@ -3,8 +3,11 @@ Payment processing views with Stripe integration
 """
 import stripe
 import logging
+import time
+from collections import Counter
 from decimal import Decimal
 from django.conf import settings
+from django.db import transaction
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.http import HttpResponse
@@ -13,55 +16,70 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
 
-from apps.cart.models import Cart
+from apps.cart.models import Cart, InsufficientStock, StockReservation
+from apps.cart.stores import StoredCart, get_cart_token, materialize
 from apps.orders.models import Order
 from apps.payment.models import Payment, PaymentLog
+from apps.utils.metrics import CHECKOUT_SESSIONS, WEBHOOK_EVENTS, WEBHOOK_LAG
 
 # Configure Stripe
 stripe.api_key = settings.STRIPE_SECRET_KEY
 logger = logging.getLogger(__name__)
 
 
+def _paid_quantities(session_id):
+    """{variant_id: quantity} paid for in a Stripe checkout session (its line items)"""
+    quantities = Counter()
+    line_items = stripe.checkout.Session.list_line_items(session_id, limit=100, expand=['data.price.product'])
+    for item in line_items.auto_paging_iter():
+        variant_id = item['price']['product']['metadata'].get('variant_id')
+        if variant_id:
+            quantities[int(variant_id)] += item['quantity']
+    return quantities
+
+
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
 class CheckoutView(APIView):
     """
     Create a Stripe checkout session from cart
     POST /api/payment/checkout/
+
+    Not wrapped in ATOMIC_REQUESTS: the stock holds commit on their own,
+    so variant rows are not locked while Stripe is called.
     """
     permission_classes = [permissions.AllowAny]
 
     def post(self, request):
         """Create Stripe checkout session"""
         try:
-            # Get cart
+            # Get cart, items and their variants/products in a fixed number of queries
             if request.user.is_authenticated:
-                cart = Cart.objects.get_or_create_for_user(request.user)
+                cart = Cart.objects.load_for_user(request.user)
             else:
-                if not request.session.session_key:
-                    request.session.create()
-                cart = Cart.objects.get_or_create_for_session(request.session.session_key)
+                cart = StoredCart(get_cart_token(request))
 
             # Validate cart
             if not cart.has_items:
+                CHECKOUT_SESSIONS.inc(('empty_cart',))
                 return Response(
                     {'error': 'Cart is empty'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Check stock
-            out_of_stock = []
-            for item in cart.items.all():
-                if item.quantity > item.variant.stock:
-                    out_of_stock.append({
-                        'sku': item.variant.sku,
-                        'requested': item.quantity,
-                        'available': item.variant.stock
-                    })
-
-            if out_of_stock:
+            # Anonymous carts become Cart rows (keyed by the cart token) at checkout
+            if isinstance(cart, StoredCart):
+                cart = materialize(cart)
+
+            # Hold the stock until the Stripe session expires. The cart's
+            # earlier sessions keep theirs until expire_superseded_checkouts
+            try:
+                holds = StockReservation.objects.reserve(cart)
+            except InsufficientStock as e:
+                CHECKOUT_SESSIONS.inc(('out_of_stock',))
                 return Response(
                     {
                         'error': 'Some items are out of stock',
-                        'items': out_of_stock
+                        'items': e.items
                     },
                     status=status.HTTP_400_BAD_REQUEST
                 )
@@ -69,11 +87,15 @@ class CheckoutView(APIView):
             # Build line items for Stripe
             line_items = []
             for cart_item in cart.items.all():
+                # Variants have no name of their own: label them by attributes
+                variant_label = ', '.join(
+                    str(value) for value in cart_item.variant.attributes.values()
+                ) or cart_item.variant.sku
                 line_items.append({
                     'price_data': {
                         'currency': 'usd',
                         'product_data': {
-                            'name': f"{cart_item.variant.product.name} - {cart_item.variant.name}",
+                            'name': f"{cart_item.variant.product.name} - {variant_label}",
                             'metadata': {
                                 'variant_id': str(cart_item.variant.id),
                                 'product_id': str(cart_item.variant.product.id),
@@ -84,21 +106,31 @@ class CheckoutView(APIView):
                     'quantity': cart_item.quantity,
                 })
 
-            # Create Stripe session
-            session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=line_items,
-                mode='payment',
-                success_url=f"{settings.FRONTEND_URL or 'http://localhost:3000'}/checkout/success?session_id={{CHECKOUT_SESSION_ID}}",
-                cancel_url=f"{settings.FRONTEND_URL or 'http://localhost:3000'}/checkout/cancel",
-                customer_email=request.user.email if request.user.is_authenticated else None,
-                metadata={
-                    'user_id': str(request.user.id) if request.user.is_authenticated else 'anonymous',
-                    'session_key': request.session.session_key if not request.user.is_authenticated else None,
-                }
-            )
+            # Create Stripe session; it expires together with the stock holds
+            try:
+                session = stripe.checkout.Session.create(
+                    payment_method_types=['card'],
+                    line_items=line_items,
+                    mode='payment',
+                    success_url=f"{settings.FRONTEND_URL or 'http://localhost:3000'}/checkout/success?session_id={{CHECKOUT_SESSION_ID}}",
+                    cancel_url=f"{settings.FRONTEND_URL or 'http://localhost:3000'}/checkout/cancel",
+                    customer_email=request.user.email if request.user.is_authenticated else None,
+                    expires_at=int(holds[0].expires_at.timestamp()),
+                    metadata={
+                        'user_id': str(request.user.id) if request.user.is_authenticated else 'anonymous',
+                        'session_key': cart.session_id if not request.user.is_authenticated else None,
+                    }
+                )
+            except Exception:
+                StockReservation.objects.release(pk__in=[hold.pk for hold in holds], checkout_session_id='')
+                raise
+            if StockReservation.objects.attach(holds, session.id) < len(holds):
+                # A concurrent checkout of the cart replaced these holds;
+                # the session is settled from its line items if it is paid
+                logger.warning(f"Stock holds of session {session.id} were replaced by another checkout")
 
             logger.info(f"Created Stripe checkout session: {session.id}")
+            CHECKOUT_SESSIONS.inc(('created',))
 
             return Response({
                 'session_id': session.id,
@@ -109,12 +141,14 @@ class CheckoutView(APIView):
 
         except stripe.error.StripeError as e:
             logger.error(f"Stripe error: {str(e)}")
+            CHECKOUT_SESSIONS.inc(('stripe_error',))
             return Response(
                 {'error': str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
         except Exception as e:
             logger.error(f"Checkout error: {str(e)}")
+            CHECKOUT_SESSIONS.inc(('error',))
             return Response(
                 {'error': 'Failed to create checkout session'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -146,9 +180,11 @@ class WebhookView(APIView):
             )
         except ValueError as e:
             logger.error(f"Invalid payload: {str(e)}")
+            WEBHOOK_EVENTS.inc(('unknown', 'invalid_payload'))
             return HttpResponse(status=400)
         except stripe.error.SignatureVerificationError as e:
             logger.error(f"Invalid signature: {str(e)}")
+            WEBHOOK_EVENTS.inc(('unknown', 'invalid_signature'))
             return HttpResponse(status=400)
 
         # Return 200 OK immediately to prevent timeout
@@ -165,19 +201,28 @@ class WebhookView(APIView):
         event_data = event['data']['object']
 
         logger.info(f"Processing webhook event: {event_type}")
+        if event.get('created'):
+            # Delivery delay plus retries: how far behind Stripe we are
+            WEBHOOK_LAG.observe((event_type,), max(time.time() - event['created'], 0))
 
+        outcome = 'processed'
         try:
             if event_type == 'checkout.session.completed':
                 self._handle_checkout_completed(event_data)
+            elif event_type == 'checkout.session.expired':
+                self._handle_checkout_expired(event_data)
             elif event_type == 'payment_intent.succeeded':
                 self._handle_payment_succeeded(event_data)
             elif event_type == 'charge.failed':
                 self._handle_charge_failed(event_data)
             else:
                 logger.info(f"Unhandled event type: {event_type}")
+                outcome = 'ignored'
 
         except Exception as e:
             logger.error(f"Error processing event {event_type}: {str(e)}")
+            outcome = 'error'
+        WEBHOOK_EVENTS.inc((event_type, outcome))
 
     def _handle_checkout_completed(self, session):
         """Handle checkout.session.completed event"""
@@ -188,20 +233,21 @@ class WebhookView(APIView):
             order = Order.objects.filter(stripe_session_id=session_id).first()
 
             if not order:
+                # Nothing but the holds (or the session's line items) records what was paid for
+                shortfalls = StockReservation.objects.commit(session_id)
+                if shortfalls is None:
+                    # The holds are gone: fetch the line items, outside commit()'s row locks
+                    shortfalls = StockReservation.objects.commit(session_id, paid=_paid_quantities(session_id))
+                self._log_shortfalls(shortfalls, session_id)
                 logger.warning(f"No order found for session {session_id}")
                 return
 
-            # Mark order as paid
+            # Reduce stock (once per session: webhooks are redelivered), then
+            # mark order as paid
+            self._log_shortfalls(order.commit_stock(), session_id)
             order.mark_paid()
             logger.info(f"Order {order.order_number} marked as paid")
 
-            # Reduce stock
-            for item in order.items.all():
-                if item.variant:
-                    item.variant.stock -= item.quantity
-                    item.variant.save()
-                    logger.info(f"Reduced stock for {item.variant.sku} by {item.quantity}")
-
             # Create Payment record
             payment, created = Payment.objects.get_or_create(
                 order=order,
@@ -237,6 +283,19 @@ class WebhookView(APIView):
         except Exception as e:
             logger.error(f"Error handling checkout completed: {str(e)}")
 
+    @staticmethod
+    def _log_shortfalls(shortfalls, session_id):
+        """Paid for but not in stock: needs a refund or a restock"""
+        for shortfall in shortfalls:
+            logger.error(
+                f"Oversold {shortfall['sku']} on session {session_id}: "
+                f"{shortfall['requested']} paid, {shortfall['available']} in stock"
+            )
+
+    def _handle_checkout_expired(self, session):
+        """Handle checkout.session.expired event: free the stock held for it"""
+        StockReservation.objects.release(checkout_session_id=session['id'])
+
     def _handle_payment_succeeded(self, intent):
         """Handle payment_intent.succeeded event"""
         try:
@@ -1,6 +1,7 @@
 from django.test import TestCase
 from django.contrib.auth.models import User
 from apps.shop.models import Category, Product
+from apps.utils.query_budgets import QueryBudgetTestMixin
 from .models import Review
 
 
@@ -28,3 +29,30 @@ class ReviewTestCase(TestCase):
         )
         self.assertEqual(review.rating, 5)
         self.assertEqual(review.user, self.user)
+
+
+class ReviewQueryBudgetTestCase(QueryBudgetTestMixin, TestCase):
+    """Review actions stay within apps.utils.query_budgets."""
+
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+
+        user_model = get_user_model()
+        self.author = user_model.objects.create_user(email='author@example.com', password='secret123')
+        self.voter = user_model.objects.create_user(email='voter@example.com', password='secret123')
+        product = Product.objects.create(name='Mug', description='Test', sku='MUG1', base_price=10)
+        self.review = Review.objects.create(
+            product=product, user=self.author, title='Good', content='Good mug', rating=4
+        )
+
+    def test_votes(self):
+        self.client.force_login(self.voter)
+        for path in (f'/reviews/{self.review.pk}/helpful/', f'/reviews/{self.review.pk}/unhelpful/'):
+            # First vote creates, the second switches or withdraws it
+            self.assertWithinQueryBudget('post', path, status=302)
+            self.assertWithinQueryBudget('post', path, status=302)
+
+    def test_delete(self):
+        self.client.force_login(self.author)
+        self.assertWithinQueryBudget('post', f'/reviews/{self.review.pk}/delete/', status=302)
+        self.assertFalse(Review.objects.filter(pk=self.review.pk).exists())
@@ -41,7 +41,7 @@ def add_review(request, product_id):
 @login_required(login_url='login')
 def delete_review(request, review_id):
     """Delete a review"""
-    review = get_object_or_404(Review, id=review_id, user=request.user)
+    review = get_object_or_404(Review.objects.select_related('product'), id=review_id, user=request.user)
     product_slug = review.product.slug
     review.delete()
     messages.success(request, 'Review deleted successfully!')
@@ -51,7 +51,7 @@ def delete_review(request, review_id):
 @login_required(login_url='login')
 def vote_helpful(request, review_id):
     """Mark review as helpful"""
-    review = get_object_or_404(Review, id=review_id)
+    review = get_object_or_404(Review.objects.select_related('product'), id=review_id)
 
     vote, created = ReviewVote.objects.get_or_create(
         review=review,
@@ -72,7 +72,7 @@ def vote_helpful(request, review_id):
 @login_required(login_url='login')
 def vote_unhelpful(request, review_id):
     """Mark review as unhelpful"""
-    review = get_object_or_404(Review, id=review_id)
+    review = get_object_or_404(Review.objects.select_related('product'), id=review_id)
 
     vote, created = ReviewVote.objects.get_or_create(
         review=review,
@@ -269,10 +269,10 @@ class ProductAdmin(admin.ModelAdmin):
 @admin.register(ProductVariant)
 class ProductVariantAdmin(admin.ModelAdmin):
     """Admin for managing variants independently."""
-    list_display = ('sku', 'product', 'attributes_display', 'price', 'stock', 'is_default', 'is_active')
+    list_display = ('sku', 'product', 'attributes_display', 'price', 'stock', 'reserved', 'is_default', 'is_active')
     list_filter = ('is_active', 'is_default', 'product__category', ('created_at', admin.DateFieldListFilter))
     search_fields = ('sku', 'product__name', 'product__sku')
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('reserved', 'created_at', 'updated_at')
     
     fieldsets = (
         ('Product & Variant Info', {
@@ -283,7 +283,7 @@ class ProductVariantAdmin(admin.ModelAdmin):
             'description': 'JSON format: {"size": "XL", "color": "Red"}',
         }),
         ('Pricing & Stock', {
-            'fields': ('price', 'cost_price', 'stock', 'markup_percentage')
+            'fields': ('price', 'cost_price', 'stock', 'reserved', 'markup_percentage')
         }),
         ('Status', {
             'fields': ('is_default', 'is_active', 'ordering')
@@ -0,0 +1,392 @@
+"""
+Shop caching helpers
+Versioned cache keys for catalog data: any Category, Product, variant or
+image write bumps the catalog version, so stale entries are simply never
+read again. The same version backs the catalog ETag/Last-Modified headers.
+Writes that only move stock (including checkout holds) bump a separate
+stock version instead, read only by the validators of responses that show
+stock - the category tree and category responses are left alone.
+
+Anonymous API responses are cached per normalized URL and tagged with the
+products/categories they contain; a write only invalidates its own tags.
+
+The featured/bestsellers/new collections are kept as ordered id lists,
+refreshed when membership changes.
+"""
+import datetime
+import functools
+import hashlib
+import time
+import uuid
+import zlib
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.views.decorators.http import condition
+from rest_framework.response import Response
+from apps.utils.cache import Computed, fetch
+
+
+CATALOG_VERSION_KEY = 'shop:catalog:version'
+CATALOG_MODIFIED_KEY = 'shop:catalog:modified'
+STOCK_VERSION_KEY = 'shop:catalog:stock:version'
+STOCK_MODIFIED_KEY = 'shop:catalog:stock:modified'
+CATEGORY_TREE_KEY = 'shop:category-tree'
+CATEGORY_TREE_TIMEOUT = 60 * 60 * 24  # 1 day (entries are versioned)
+
+# Precomputed ordered id lists for the homepage product collections
+COLLECTION_KEY = 'shop:collection:{name}'
+COLLECTION_VERSION_KEY = 'shop:collection:{name}:version'
+COLLECTION_TIMEOUT = 60 * 60 * 24  # 1 day (refreshed on flag changes)
+PRODUCT_COLLECTIONS = {
+    'featured': 'is_featured',
+    'bestsellers': 'is_bestseller',
+    'new': 'is_new',
+}
+COLLECTION_ORDERING = ['-created_at', '-pk']
+
+# Anonymous API response cache, invalidated through tag versions
+RESPONSE_KEY = 'shop:response:{digest}'
+RESPONSE_TIMEOUT = 60 * 60 * 24  # 1 day (safety net - entries are tagged)
+TAG_VERSION_KEY = 'shop:tag:{tag}'
+PRODUCT_LIST_TAG = 'products'
+PRODUCT_STOCK_TAG = 'products:stock'
+# Carried by every product response; bumped by bulk writes too large to tag
+# product by product
+PRODUCT_BULK_TAG = 'products:bulk'
+# Product/variant fields that decide which products a list shows, or in
+# what order (filters, search, ordering); other writes only invalidate the
+# responses that contain the written products
+PRODUCT_LIST_FIELDS = {
+    'is_active', 'category', 'category_id', 'brand', 'is_featured', 'is_bestseller', 'is_new',
+    'name', 'description', 'sku', 'base_price', 'effective_min_price', 'created_at', 'rating',
+    'price', 'attributes', 'product', 'product_id',
+}
+# ... and the ones deciding membership of the ?in_stock lists
+PRODUCT_STOCK_FIELDS = {'stock', 'reserved', 'effective_total_stock'}
+
+
+def _get_version(version_key, modified_key):
+    version = cache.get(version_key)
+    if version is None:
+        # Seed from the clock so an evicted counter never reuses old keys
+        cache.add(version_key, int(time.time() * 1000), timeout=None)
+        cache.add(modified_key, time.time(), timeout=None)
+        version = cache.get(version_key, 0)
+    return version
+
+
+def _bump_version(version_key, modified_key):
+    try:
+        cache.incr(version_key)
+    except ValueError:
+        # Key missing (evicted or never set) - start a fresh version
+        cache.set(version_key, int(time.time() * 1000), timeout=None)
+    cache.set(modified_key, time.time(), timeout=None)
+
+
+def get_catalog_version():
+    """Return the current catalog version, initializing it if needed."""
+    return _get_version(CATALOG_VERSION_KEY, CATALOG_MODIFIED_KEY)
+
+
+def bump_catalog_version():
+    """Invalidate every versioned catalog cache entry."""
+    _bump_version(CATALOG_VERSION_KEY, CATALOG_MODIFIED_KEY)
+
+
+def get_stock_version():
+    """Return the current stock version, initializing it if needed."""
+    return _get_version(STOCK_VERSION_KEY, STOCK_MODIFIED_KEY)
+
+
+def bump_stock_version():
+    """Invalidate the validators of responses that show stock."""
+    _bump_version(STOCK_VERSION_KEY, STOCK_MODIFIED_KEY)
+
+
+def bump_catalog_version_on_commit():
+    """Bump the catalog version once the current transaction commits."""
+    transaction.on_commit(bump_catalog_version)
+
+
+def invalidate_catalog_on_commit(product_ids=(), category_ids=(), fields=None, all_products=False):
+    """
+    After commit, bump the catalog version and the response cache tags of
+    the given products and categories. The product list tags are only bumped
+    when the written fields (None: unknown, e.g. inserts and deletes) can
+    change list membership or order. all_products stands in for the product
+    ids of bulk writes: every product response is invalidated through the
+    bulk tag. Product writes of stock fields only bump the stock version,
+    not the catalog version.
+    """
+    tags = {category_tag(pk) for pk in category_ids}
+    product_ids = list(product_ids)
+    stock_only = not category_ids and bool(fields) and PRODUCT_STOCK_FIELDS.issuperset(fields)
+    if all_products:
+        tags.add(PRODUCT_BULK_TAG)
+    else:
+        tags.update(product_tag(pk) for pk in product_ids)
+    if product_ids or all_products:
+        if fields is None or PRODUCT_LIST_FIELDS.intersection(fields):
+            tags.update((PRODUCT_LIST_TAG, PRODUCT_STOCK_TAG))
+        elif PRODUCT_STOCK_FIELDS.intersection(fields):
+            tags.add(PRODUCT_STOCK_TAG)
+
+    def invalidate():
+        if stock_only:
+            bump_stock_version()
+        else:
+            bump_catalog_version()
+        invalidate_tags(tags)
+
+    transaction.on_commit(invalidate)
+
+
+def get_category_tree():
+    """
+    Return the nested category tree from the cache, building it from the
+    database on a miss (single-flight; the previous tree is served while a
+    rebuild is in progress). Warm calls only read two cache keys.
+    """
+    from .models import Category
+
+    return fetch(
+        CATEGORY_TREE_KEY,
+        Category.objects.build_tree,
+        CATEGORY_TREE_TIMEOUT,
+        version=get_catalog_version(),
+        name='category_tree',
+    )
+
+
+# ---- Product collections ----------------------------------------------------
+
+def get_collection_ids(name):
+    """
+    Return the ordered ids of the active products in a collection
+    ('featured', 'bestsellers' or 'new'), precomputed in the cache.
+    """
+    from .models import Product
+
+    flag = PRODUCT_COLLECTIONS[name]
+    version_key = COLLECTION_VERSION_KEY.format(name=name)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(version_key)
+
+    def compute():
+        return list(
+            Product.objects.order_by(*COLLECTION_ORDERING)
+            .filter(is_active=True, **{flag: True})
+            .values_list('pk', flat=True)
+        )
+
+    return fetch(
+        COLLECTION_KEY.format(name=name),
+        compute,
+        COLLECTION_TIMEOUT,
+        version=version,
+        name=f'collection_{name}',
+    )
+
+
+def refresh_collections(names):
+    """Mark collections as outdated; the next read recomputes (single-flight)."""
+    if names:
+        cache.set_many(
+            {COLLECTION_VERSION_KEY.format(name=name): uuid.uuid4().hex for name in names},
+            timeout=None,
+        )
+
+
+def refresh_collections_on_commit(names):
+    names = set(names)
+    if names:
+        transaction.on_commit(lambda: refresh_collections(names))
+
+
+def collections_changed_by(product, deleted=False):
+    """
+    Return the collections whose cached id list no longer matches the
+    product's membership (after a save or delete).
+    """
+    changed = set()
+    for name, flag in PRODUCT_COLLECTIONS.items():
+        entry = cache.get(COLLECTION_KEY.format(name=name))
+        if entry is None:
+            continue  # Not computed yet - nothing stale to refresh
+        member = not deleted and product.is_active and getattr(product, flag)
+        if member != (product.pk in entry['value']):
+            changed.add(name)
+    return changed
+
+
+# ---- HTTP validators --------------------------------------------------------
+
+def get_catalog_state(stock=False):
+    """
+    Return (version, last_modified) for the catalog as a whole - with
+    stock=True, also covering stock-only writes (see bump_stock_version).
+    Normally a single cache read; if the cache cannot hold the version
+    (e.g. DummyCache) it falls back to MAX(updated_at) and row counts.
+    """
+    keys = [(CATALOG_VERSION_KEY, CATALOG_MODIFIED_KEY)]
+    get_catalog_version()
+    if stock:
+        keys.append((STOCK_VERSION_KEY, STOCK_MODIFIED_KEY))
+        get_stock_version()
+    state = cache.get_many([key for pair in keys for key in pair])
+    if any(version_key not in state for version_key, _ in keys):
+        return _database_catalog_state()
+    version = '.'.join(str(state[version_key]) for version_key, _ in keys)
+    modified = max((state[modified_key] for _, modified_key in keys if modified_key in state), default=None)
+    if modified is not None:
+        modified = datetime.datetime.fromtimestamp(modified, tz=datetime.timezone.utc)
+    return version, modified
+
+
+def _database_catalog_state():
+    from .models import Category, Product, ProductImage, ProductVariant
+
+    parts, latest = [], None
+    for model in (Category, Product, ProductVariant, ProductImage):
+        row = model._default_manager.order_by().aggregate(latest=Max('updated_at'), count=Count('pk'))
+        parts.append(f"{row['count']}:{row['latest'].timestamp() if row['latest'] else 0}")
+        if row['latest'] and (latest is None or row['latest'] > latest):
+            latest = row['latest']
+    return 'db-%08x' % zlib.crc32('|'.join(parts).encode()), latest
+
+
+def _request_catalog_state(request, stock=False):
+    # condition() asks for the ETag and Last-Modified separately
+    attribute = '_catalog_stock_state' if stock else '_catalog_state'
+    state = getattr(request, attribute, None)
+    if state is None:
+        state = get_catalog_state(stock=stock)
+        setattr(request, attribute, state)
+    return state
+
+
+def catalog_etag(request, *args, stock=False, **kwargs):
+    """ETag for catalog responses; varies with the negotiated format."""
+    version, _ = _request_catalog_state(request, stock=stock)
+    accept = request.META.get('HTTP_ACCEPT', '')
+    return f'catalog-{version}-{zlib.crc32(accept.encode()):08x}'
+
+
+def catalog_last_modified(request, *args, stock=False, **kwargs):
+    """Last-Modified for catalog responses."""
+    return _request_catalog_state(request, stock=stock)[1]
+
+
+# Conditional GET for read-only catalog views: repeat clients get a 304
+# without any query or serialization work
+catalog_condition = condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
+# ... for the views whose responses show stock (products and variants)
+catalog_stock_condition = condition(
+    etag_func=functools.partial(catalog_etag, stock=True),
+    last_modified_func=functools.partial(catalog_last_modified, stock=True),
+)
+
+
+# ---- Tagged response cache --------------------------------------------------
+
+def product_tag(product_id):
+    return f'product:{product_id}'
+
+
+def category_tag(category_id):
+    return f'category:{category_id}'
+
+
+def invalidate_tags(tags):
+    """Give each tag a fresh version, orphaning every entry tagged with it."""
+    if tags:
+        version = uuid.uuid4().hex
+        cache.set_many({TAG_VERSION_KEY.format(tag=tag): version for tag in tags}, timeout=None)
+
+
+def get_tag_versions(tags):
+    """
+    Return {tag: version}, creating missing versions. Returns None if the
+    cache cannot hold them (nothing can be cached safely then).
+    """
+    keys = {TAG_VERSION_KEY.format(tag=tag): tag for tag in tags}
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+        found.update(cache.get_many(missing))
+        if any(key not in found for key in missing):
+            return None
+    return {keys[key]: version for key, version in found.items()}
+
+
+def response_cache_key(view, request):
+    """
+    Cache key for a GET request: path and query parameters normalized
+    (sorted, empty values and the view's defaults dropped), plus host and
+    negotiated format since both show up in the body.
+    """
+    defaults = view.get_response_cache_defaults()
+    params = []
+    for name in sorted(request.query_params):
+        values = sorted(value for value in request.query_params.getlist(name) if value != '')
+        if values and values != defaults.get(name):
+            params.append((name, values))
+    identity = '|'.join([
+        request.get_host(),
+        request.path,
+        request.accepted_renderer.format or '',
+        repr(params),
+    ])
+    return RESPONSE_KEY.format(digest=hashlib.md5(identity.encode()).hexdigest())
+
+
+def cached_response(view_method):
+    """
+    Serve an anonymous GET viewset action from the tagged response cache
+    (with stampede protection, see apps.utils.cache.fetch).
+
+    The view provides get_response_cache_tags() (called before and after
+    the action - tags known up front are versioned before the database is
+    read, so a concurrent write can never be cached under its new version)
+    and get_response_cache_defaults().
+    """
+    @functools.wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        if request.method != 'GET' or request.user.is_authenticated:
+            return view_method(view, request, *args, **kwargs)
+
+        computed = {}
+
+        def render():
+            versions = get_tag_versions(view.get_response_cache_tags())
+            catalog_version = (get_catalog_version(), get_stock_version())
+            response = computed['response'] = view_method(view, request, *args, **kwargs)
+            if versions is None or response.status_code != 200:
+                return Computed(response.data, cache=False)
+            late_versions = get_tag_versions(view.get_response_cache_tags() - versions.keys())
+            # Late tags are versioned after the read: a write in between
+            # (seen as a catalog or stock version bump) must not be cached as fresh
+            if late_versions is None or (
+                late_versions and (get_catalog_version(), get_stock_version()) != catalog_version
+            ):
+                return Computed(response.data, cache=False)
+            return Computed(response.data, version={**versions, **late_versions})
+
+        data = fetch(
+            response_cache_key(view, request),
+            render,
+            RESPONSE_TIMEOUT,
+            version=lambda tags: get_tag_versions(tags) == tags,
+            name='product_response',
+        )
+        response = computed.get('response') or Response(data)
+        response['X-Cache'] = 'MISS' if 'response' in computed else 'HIT'
+        return response
+
+    return wrapper
@@ -0,0 +1,94 @@
+"""
+Product catalog export (see apps.utils.exports)
+
+CSV has one row per variant (products without variants get one row with
+empty variant columns) and uses the import_catalog column names, so an
+export can be edited and fed back through `manage.py import_catalog`.
+NDJSON has one product per line with its variants nested.
+"""
+import json
+from django.db.models import Prefetch
+from .models import Product, ProductVariant
+
+
+PRODUCT_EXPORT_HEADER = [
+    'sku', 'name', 'slug', 'brand', 'category', 'parent_category',
+    'base_price', 'stock', 'is_active', 'is_featured', 'is_bestseller', 'is_new',
+    'effective_min_price', 'effective_total_stock', 'created_at', 'updated_at',
+    'variant_sku', 'variant_price', 'variant_stock', 'variant_is_active', 'attributes',
+]
+
+
+def product_export_queryset():
+    """All products (active or not) with what the rows need, in pk order."""
+    return Product.objects.select_related('category__parent').prefetch_related(
+        Prefetch('variants', queryset=ProductVariant.objects.order_by('ordering', 'sku'))
+    ).order_by('pk')
+
+
+def product_rows(product):
+    """CSV rows for one product."""
+    category = product.category
+    base = [
+        product.sku,
+        product.name,
+        product.slug,
+        product.brand,
+        category.slug if category else '',
+        category.parent.slug if category and category.parent else '',
+        product.base_price,
+        product.stock,
+        product.is_active,
+        product.is_featured,
+        product.is_bestseller,
+        product.is_new,
+        product.effective_min_price,
+        product.effective_total_stock,
+        product.created_at.isoformat(),
+        product.updated_at.isoformat(),
+    ]
+    variants = product.variants.all()
+    if not variants:
+        yield base + ['', '', '', '', '']
+    for variant in variants:
+        yield base + [
+            variant.sku,
+            variant.price,
+            variant.stock,
+            variant.is_active,
+            json.dumps(variant.attributes, separators=(',', ':')),
+        ]
+
+
+def product_record(product):
+    """NDJSON document for one product."""
+    category = product.category
+    return {
+        'id': product.pk,
+        'sku': product.sku,
+        'name': product.name,
+        'slug': product.slug,
+        'brand': product.brand,
+        'category': category.slug if category else None,
+        'parent_category': category.parent.slug if category and category.parent else None,
+        'base_price': product.base_price,
+        'stock': product.stock,
+        'is_active': product.is_active,
+        'is_featured': product.is_featured,
+        'is_bestseller': product.is_bestseller,
+        'is_new': product.is_new,
+        'effective_min_price': product.effective_min_price,
+        'effective_total_stock': product.effective_total_stock,
+        'created_at': product.created_at,
+        'updated_at': product.updated_at,
+        'variants': [
+            {
+                'sku': variant.sku,
+                'price': variant.price,
+                'stock': variant.stock,
+                'is_active': variant.is_active,
+                'attributes': variant.attributes,
+            }
+            for variant in product.variants.all()
+        ],
+    }
@@ -0,0 +1,689 @@
+"""
+Faceted catalog search
+The facet index keeps, for every facet value (brand=Apple, price=25-50,
+attr.size=XL, ...), a bitmap of the active products carrying it. Bitmaps
+are plain Python ints over dense product offsets (bit n = the n-th product
+id known to the index), so intersecting a result set with a facet value
+and counting is a couple of big-int operations rather than a GROUP BY per
+facet, and a bitmap is sized by the number of products, not by their ids.
+
+The index is stored in the Django cache (Redis in production) one key per
+facet value, versioned per facet, and updated incrementally when products
+or variants change: a write only rewrites the values it changed, and
+readers (memoized per process) only fetch the facets whose version moved.
+"""
+import hashlib
+import time
+import uuid
+from array import array
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+
+FACET_META_KEY = 'shop:facets:meta'
+FACET_KEY_PREFIX = 'shop:facets'
+# Superseded parts stay readable this long for readers holding the old meta
+FACET_STALE_TIMEOUT = 60
+FACET_LOCK_KEY = 'shop:facets:lock'
+FACET_LOCK_TIMEOUT = 30
+FACET_QUEUE_KEY = 'shop:facets:queue'
+FACET_QUEUE_TIMEOUT = 24 * 3600
+FACET_QUEUE_MAX = 1000
+# How long a reader missing the index waits for another worker's build
+FACET_BUILD_WAIT = 2
+ATTRIBUTE_PREFIX = 'attr.'
+# Search results narrow facet counts through their best-ranked matches only
+DEFAULT_FACET_SEARCH_LIMIT = 10000
+# Updates of up to this many products move their prices in place; larger
+# ones re-sort the price arrays in one pass
+PRICE_UPDATE_IN_PLACE = 64
+
+# Facets that map 1:1 onto a query parameter of the same name
+FLAG_FACETS = ('is_featured', 'is_bestseller', 'is_new')
+FACETS = ('category', 'brand', 'price', 'in_stock') + FLAG_FACETS
+
+DEFAULT_PRICE_BANDS = [0, 25, 50, 100, 250, 500, 1000]
+
+
+def get_price_bands():
+    """Return the ascending lower bounds of the price facet bands."""
+    return [Decimal(str(bound)) for bound in getattr(settings, 'SHOP_FACET_PRICE_BANDS', DEFAULT_PRICE_BANDS)]
+
+
+def price_band(price):
+    """Return the band label for a price, e.g. '25-50' or '1000+'."""
+    if price is None:
+        return None
+    bands = get_price_bands()
+    for lower, upper in zip(bands, bands[1:]):
+        if lower <= price < upper:
+            return f'{lower}-{upper}'
+    if price >= bands[-1]:
+        return f'{bands[-1]}+'
+    return None
+
+
+def price_band_range(label):
+    """Return (min, max) for a band label; max is None for the top band."""
+    try:
+        if label.endswith('+'):
+            return Decimal(label[:-1]), None
+        lower, upper = label.split('-', 1)
+        return Decimal(lower), Decimal(upper)
+    except (ArithmeticError, ValueError):
+        return None
+
+
+def to_bitmap(offsets):
+    """Build a bitmap from an iterable of offsets (one pass over a bytearray)."""
+    offsets = list(offsets)
+    if not offsets:
+        return 0
+    bits = bytearray((max(offsets) >> 3) + 1)
+    for offset in offsets:
+        bits[offset >> 3] |= 1 << (offset & 7)
+    return int.from_bytes(bits, 'little')
+
+
+class StaleOffsets(Exception):
+    """A product id below the highest one known turned up: offsets would shift."""
+
+
+class FacetIndex:
+    """
+    Bitmaps of active products per facet value.
+
+    `product_ids` lists, ascending, every product id the index knows (active
+    or not); a product's offset is its position there. New products get
+    the next offset. `price_values`/`price_offsets` list the active
+    products' effective prices in ascending order, for ?min_price/?max_price.
+    """
+
+    # Last queued update batch included (see "storage" below)
+    applied = 0
+
+    def __init__(self, facets=None, universe=0, product_ids=None, price_values=None, price_offsets=None):
+        self.facets = facets or {}
+        self.universe = universe
+        self.product_ids = product_ids if product_ids is not None else array('q')
+        self.price_values = price_values if price_values is not None else array('d')
+        self.price_offsets = price_offsets if price_offsets is not None else array('q')
+        # Cache versions of the stored parts this index was read from or written as
+        self.versions = {'facets': {}}
+        self.value_versions = {}
+
+    # ---- building -------------------------------------------------------
+
+    @staticmethod
+    def product_facet_values(product_ids=None, inactive=False):
+        """
+        Yield (product_id, [(facet, value), ...], price) for active
+        products, optionally limited to `product_ids`; with `inactive`,
+        inactive ones too (as (product_id, None, None)), in id order.
+        Uses two queries.
+        """
+        from .models import Product, VariantAttribute
+
+        products = Product.objects.order_by('pk') if inactive else Product.objects.filter(is_active=True).order_by()
+        variant_attributes = VariantAttribute.objects.filter(
+            variant__is_active=True, variant__product__is_active=True
+        ).order_by()
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+            variant_attributes = variant_attributes.filter(variant__product_id__in=product_ids)
+
+        attributes = {}
+        rows = variant_attributes.values_list('variant__product_id', 'key', 'value')
+        for product_id, key, value in rows.iterator(chunk_size=5000):
+            attributes.setdefault(product_id, set()).add((f'{ATTRIBUTE_PREFIX}{key}', value))
+
+        rows = products.values_list(
+            'pk', 'is_active', 'category_id', 'brand', 'effective_min_price', 'effective_total_stock',
+            *FLAG_FACETS,
+        )
+        for pk, is_active, category_id, brand, price, stock, *flags in rows.iterator(chunk_size=5000):
+            if not is_active:
+                yield pk, None, None
+                continue
+            pairs = [('in_stock', 'true' if stock > 0 else 'false')]
+            if category_id:
+                pairs.append(('category', str(category_id)))
+            if brand:
+                pairs.append(('brand', brand))
+            band = price_band(price)
+            if band:
+                pairs.append(('price', band))
+            pairs.extend((facet, 'true') for facet, flag in zip(FLAG_FACETS, flags) if flag)
+            pairs.extend(attributes.get(pk, ()))
+            yield pk, pairs, price
+
+    @classmethod
+    def build(cls):
+        """Build the full index from the database."""
+        index = cls()
+        members, prices = {}, []
+        for product_id, pairs, price in cls.product_facet_values(inactive=True):
+            # Inactive products get an offset too: reactivating one needs no new offset
+            offset = index.offset(product_id, create=True)
+            if pairs is None:
+                continue
+            members.setdefault(None, []).append(offset)
+            for pair in pairs:
+                members.setdefault(pair, []).append(offset)
+            if price is not None:
+                prices.append((float(price), offset))
+        index.universe = to_bitmap(members.pop(None, ()))
+        for (facet, value), offsets in members.items():
+            index.facets.setdefault(facet, {})[value] = to_bitmap(offsets)
+        prices.sort()
+        index.price_values = array('d', (value for value, _ in prices))
+        index.price_offsets = array('q', (offset for _, offset in prices))
+        return index
+
+    def offset(self, product_id, create=False):
+        """
+        The product's offset; None if the index does not know it, unless
+        `create`, which gives a new product the next offset (StaleOffsets
+        if its id is below the highest known one).
+        """
+        position = bisect_left(self.product_ids, product_id)
+        if position < len(self.product_ids) and self.product_ids[position] == product_id:
+            return position
+        if not create:
+            return None
+        if position != len(self.product_ids):
+            raise StaleOffsets(product_id)
+        self.product_ids = array('q', self.product_ids)     # Copied: readers may share the old one
+        self.product_ids.append(product_id)
+        return position
+
+    def update(self, product_ids):
+        """
+        Re-read the given products from the database. Parts shared with
+        other copies of the index are replaced, never changed in place.
+        Returns what changed: 'universe', 'offsets', 'prices' and
+        (facet, value) pairs.
+        """
+        last = len(self.product_ids)
+        rows = {pk: (pairs, price) for pk, pairs, price in self.product_facet_values(set(product_ids))}
+        offsets = {}
+        for pk in sorted(product_ids):
+            offset = self.offset(pk)
+            if offset is None and (pk in rows or (self.product_ids and pk > self.product_ids[-1])):
+                offset = self.offset(pk, create=True)
+            if offset is not None:
+                offsets[pk] = offset
+        changed = {'offsets'} if len(self.product_ids) != last else set()
+
+        members = {}
+        for pk, (pairs, _) in rows.items():
+            for pair in pairs:
+                members.setdefault(pair, []).append(offsets[pk])
+        keep = ~to_bitmap(offsets.values())
+
+        universe = (self.universe & keep) | to_bitmap(offsets[pk] for pk in rows)
+        if universe != self.universe:
+            self.universe = universe
+            changed.add('universe')
+
+        facets = {}
+        for facet, values in self.facets.items():
+            values = {
+                value: (bitmap & keep) | to_bitmap(members.pop((facet, value), ()))
+                for value, bitmap in values.items()
+            }
+            changed.update((facet, value) for value, bitmap in values.items() if bitmap != self.facets[facet][value])
+            facets[facet] = {value: bitmap for value, bitmap in values.items() if bitmap}
+        for (facet, value), new_offsets in members.items():
+            facets.setdefault(facet, {})[value] = to_bitmap(new_offsets)
+            changed.add((facet, value))
+        self.facets = {facet: values for facet, values in facets.items() if values}
+
+        if self._update_prices(offsets, rows):
+            changed.add('prices')
+        return changed
+
+    def _update_prices(self, offsets, rows):
+        """Move the updated products within the price arrays; returns whether they changed."""
+        wanted = {offsets[pk]: float(price) for pk, (_, price) in rows.items() if price is not None}
+        batch = set(offsets.values())
+        values, positions = self.price_values, self.price_offsets
+        if len(batch) > PRICE_UPDATE_IN_PLACE:
+            current = {offset: value for value, offset in zip(values, positions) if offset in batch}
+        else:
+            current = {}
+            for offset in batch:
+                if offset in positions:
+                    current[offset] = values[positions.index(offset)]
+        if current == wanted:
+            return False
+
+        if len(batch) > PRICE_UPDATE_IN_PLACE:
+            entries = [(value, offset) for value, offset in zip(values, positions) if offset not in batch]
+            entries.extend((value, offset) for offset, value in wanted.items())
+            entries.sort()
+            self.price_values = array('d', (value for value, _ in entries))
+            self.price_offsets = array('q', (offset for _, offset in entries))
+            return True
+        values, positions = array('d', values), array('q', positions)
+        for offset in current:
+            position = positions.index(offset)
+            del values[position]
+            del positions[position]
+        for offset, value in wanted.items():
+            position = bisect_right(values, value)
+            values.insert(position, value)
+            positions.insert(position, offset)
+        self.price_values, self.price_offsets = values, positions
+        return True
+
+    # ---- querying -------------------------------------------------------
+
+    def bitmap_of(self, product_ids):
+        """Bitmap of the given products (ids the index does not know are left out)."""
+        offsets = (self.offset(pk) for pk in product_ids)
+        return to_bitmap(offset for offset in offsets if offset is not None)
+
+    def price_range_bitmap(self, min_price=None, max_price=None):
+        """
+        Bitmap of the products whose effective price is within the bounds
+        (inclusive). Price bands wholly inside the bounds are taken as they
+        are; only the products priced between a bound and the nearest band
+        edge are looked up one by one.
+        """
+        values = self.price_values
+        low = 0 if min_price is None else bisect_left(values, float(min_price))
+        high = len(values) if max_price is None else bisect_right(values, float(max_price))
+        bitmap, covered = 0, []
+        for label, band in self.facets.get('price', {}).items():
+            lower, upper = price_band_range(label)
+            if (min_price is None or lower >= min_price) and (
+                max_price is None or (upper is not None and upper <= max_price)
+            ):
+                bitmap |= band
+                covered.append((lower, upper))
+        if not covered:
+            return to_bitmap(self.price_offsets[low:high])
+        start = bisect_left(values, float(min(lower for lower, _ in covered)))
+        uppers = [upper for _, upper in covered]
+        end = len(values) if None in uppers else bisect_left(values, float(max(uppers)))
+        return bitmap | to_bitmap(self.price_offsets[low:start]) | to_bitmap(self.price_offsets[end:high])
+
+    def selection_bitmap(self, facet, values):
+        """OR together the bitmaps of the selected values of one facet."""
+        bitmap = 0
+        for value in values:
+            bitmap |= self.facets.get(facet, {}).get(value, 0)
+        return bitmap
+
+    def counts(self, selections, base=None):
+        """
+        Return (total, facet counts) for the current selections.
+        Counts for a facet ignore that facet's own selection (so shoppers see
+        how many results each alternative value would give) but respect
+        every other selection and the optional `base` bitmap.
+        """
+        base = self.universe if base is None else base & self.universe
+        selected = {
+            facet: self.selection_bitmap(facet, values)
+            for facet, values in selections.items()
+        }
+        total = base
+        for bitmap in selected.values():
+            total &= bitmap
+
+        counts = {}
+        for facet, values in self.facets.items():
+            facet_base = base
+            for other, bitmap in selected.items():
+                if other != facet:
+                    facet_base &= bitmap
+            facet_counts = [
+                {'value': value, 'count': (bitmap & facet_base).bit_count()}
+                for value, bitmap in values.items()
+            ]
+            counts[facet] = sorted(
+                (entry for entry in facet_counts if entry['count'] or entry['value'] in selections.get(facet, ())),
+                key=lambda entry: (-entry['count'], entry['value']),
+            )
+        return total.bit_count(), counts
+
+
+def get_facet_search_limit():
+    """How many of the best search matches narrow the facet counts."""
+    return getattr(settings, 'SHOP_FACET_SEARCH_LIMIT', DEFAULT_FACET_SEARCH_LIMIT)
+
+
+def parse_selections(query_params):
+    """Extract facet selections ({facet: [values]}) from query parameters."""
+    selections = {}
+    for key in query_params:
+        if key in FACETS or key.startswith(ATTRIBUTE_PREFIX):
+            values = [value for value in query_params.getlist(key) if value != '']
+            if key == 'in_stock' or key in FLAG_FACETS:
+                values = ['true' for value in values if value.lower() in ['true', '1', 'yes']]
+            if values:
+                selections[key] = values
+    return selections
+
+
+def apply_selections(queryset, selections):
+    """Filter a Product queryset by facet selections (mirrors the index)."""
+    for facet, values in selections.items():
+        if facet == 'category':
+            queryset = queryset.filter(category_id__in=[value for value in values if value.isdigit()])
+        elif facet == 'brand':
+            queryset = queryset.filter(brand__in=values)
+        elif facet == 'price':
+            price_filter = Q()
+            for lower, upper in filter(None, map(price_band_range, values)):
+                band = Q(effective_min_price__gte=lower)
+                if upper is not None:
+                    band &= Q(effective_min_price__lt=upper)
+                price_filter |= band
+            queryset = queryset.filter(price_filter) if price_filter else queryset.none()
+        elif facet == 'in_stock':
+            queryset = queryset.filter(effective_total_stock__gt=0)
+        elif facet in FLAG_FACETS:
+            queryset = queryset.filter(**{facet: True})
+        elif facet.startswith(ATTRIBUTE_PREFIX):
+            # Each attribute facet is matched independently (like the index
+            # bitmaps), not necessarily by a single variant
+            key = facet[len(ATTRIBUTE_PREFIX):]
+            queryset = queryset.with_variant_attributes({key: values})
+    return queryset
+
+
+# ---- storage --------------------------------------------------------------
+#
+# FACET_META_KEY holds the version of every stored part: the universe, the
+# offsets, the price arrays and, per facet, a directory {value: version}
+# whose bitmaps are stored one key per value. A change writes new versions
+# of what it changed only, then the meta; superseded keys expire shortly
+# after (FACET_STALE_TIMEOUT) rather than under a reader using them.
+#
+# Writers never touch the stored index directly: product ids to refresh are
+# queued (a counter plus one cache entry per batch) and whoever holds the
+# lock applies everything queued so far, in one update and one store. The
+# index records the last batch it covers (`applied`), so a build from the
+# database and the updates committed while it ran are reconciled under the
+# same lock.
+
+PARTS = ('universe', 'offsets', 'prices')
+
+_memo = None
+
+
+def _part_key(name, version):
+    return f'{FACET_KEY_PREFIX}:{name}:{version}'
+
+
+def _bits_key(facet, value, version):
+    # Values are free text (brands, attribute values): hash them into the key
+    digest = hashlib.md5(f'{facet}\0{value}'.encode()).hexdigest()
+    return f'{FACET_KEY_PREFIX}:bits:{digest}:{version}'
+
+
+def _part(index, name):
+    if name == 'prices':
+        return index.price_values, index.price_offsets
+    return getattr(index, 'product_ids' if name == 'offsets' else name)
+
+
+def _meta(index):
+    return {'applied': index.applied, **index.versions}
+
+
+def get_facet_index():
+    """
+    Return the current facet index. It is memoized per process, and only
+    the parts whose version changed are fetched from the cache.
+    """
+    global _memo
+    meta = cache.get(FACET_META_KEY)
+    if meta is None:
+        return _build()
+    memo = _memo
+    if memo is not None and _meta(memo) | {'applied': meta['applied']} == meta:
+        return memo
+    index = _load(meta, memo)
+    if index is None:
+        # A part was evicted: start over from the database
+        invalidate_facet_index()
+        return _build()
+    _memo = index
+    return index
+
+
+def _load(meta, previous=None):
+    """
+    The index `meta` describes, sharing the parts of `previous` whose
+    version is unchanged. None if a part is missing from the cache.
+    """
+    previous = previous or FacetIndex()
+    index = FacetIndex(
+        facets={}, universe=previous.universe, product_ids=previous.product_ids,
+        price_values=previous.price_values, price_offsets=previous.price_offsets,
+    )
+    index.applied = meta['applied']
+    index.versions = {name: meta[name] for name in PARTS}
+    index.versions['facets'] = dict(meta['facets'])
+
+    parts = {_part_key(name, meta[name]): name for name in PARTS if meta[name] != previous.versions.get(name)}
+    directories = {
+        _part_key(f'dir:{facet}', version): facet
+        for facet, version in meta['facets'].items()
+        if version != previous.versions['facets'].get(facet)
+    }
+    found = cache.get_many([*parts, *directories])
+    if len(found) < len(parts) + len(directories):
+        return None
+    for key, name in parts.items():
+        if name == 'prices':
+            index.price_values, index.price_offsets = found[key]
+        else:
+            setattr(index, 'product_ids' if name == 'offsets' else name, found[key])
+
+    for facet in meta['facets']:
+        index.facets[facet] = previous.facets.get(facet, {})
+        index.value_versions[facet] = previous.value_versions.get(facet, {})
+    bits = {}
+    for key, facet in directories.items():
+        directory, old_directory = found[key], index.value_versions[facet]
+        index.facets[facet] = {
+            value: bitmap for value, bitmap in index.facets[facet].items()
+            if value in directory and old_directory.get(value) == directory[value]
+        }
+        index.value_versions[facet] = directory
+        bits.update(
+            (_bits_key(facet, value, version), (facet, value))
+            for value, version in directory.items() if value not in index.facets[facet]
+        )
+    found = cache.get_many(bits)
+    if len(found) < len(bits):
+        return None
+    for key, (facet, value) in bits.items():
+        index.facets[facet][value] = found[key]
+    return index
+
+
+def _build():
+    """
+    Build the index and store it, under the lock. When another worker
+    keeps the lock past FACET_BUILD_WAIT the index is built for this
+    request only.
+    """
+    global _memo
+    deadline = time.monotonic() + FACET_BUILD_WAIT
+    while not cache.add(FACET_LOCK_KEY, 1, timeout=FACET_LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            return FacetIndex.build()
+        time.sleep(0.05)
+        if cache.get(FACET_META_KEY) is not None:
+            return get_facet_index()
+    try:
+        meta = cache.get(FACET_META_KEY)
+        index = _load(meta) if meta is not None else None
+        if index is None:
+            # Batches queued before the build are covered by it
+            applied = cache.get(FACET_QUEUE_KEY, 0)
+            index = FacetIndex.build()
+            index.applied = applied
+            changed = set(PARTS) | {(facet, value) for facet, values in index.facets.items() for value in values}
+            changed |= _apply_queued(index) or set()
+            _store(index, changed)
+        _memo = index
+        return index
+    finally:
+        cache.delete(FACET_LOCK_KEY)
+
+
+def _store(index, changed):
+    """
+    Write the `changed` parts of the index ('universe', 'offsets',
+    'prices' and (facet, value) pairs) under a new version, then the meta
+    pointing at them. Call with the lock held.
+    """
+    version = uuid.uuid4().hex
+    entries, stale = {}, []
+    for name in PARTS:
+        if name in changed:
+            if name in index.versions:
+                stale.append(_part_key(name, index.versions[name]))
+            index.versions[name] = version
+            entries[_part_key(name, version)] = _part(index, name)
+
+    changed_values = {}
+    for item in changed:
+        if isinstance(item, tuple):
+            changed_values.setdefault(item[0], []).append(item[1])
+    for facet, values in changed_values.items():
+        directory = dict(index.value_versions.get(facet, {}))
+        for value in values:
+            if value in directory:
+                stale.append(_bits_key(facet, value, directory.pop(value)))
+            bitmap = index.facets.get(facet, {}).get(value)
+            if bitmap:
+                directory[value] = version
+                entries[_bits_key(facet, value, version)] = bitmap
+        if facet in index.versions['facets']:
+            stale.append(_part_key(f'dir:{facet}', index.versions['facets'].pop(facet)))
+        index.value_versions[facet] = directory
+        if directory:
+            index.versions['facets'][facet] = version
+            entries[_part_key(f'dir:{facet}', version)] = directory
+        else:
+            del index.value_versions[facet]
+
+    cache.set_many(entries, timeout=None)
+    cache.set(FACET_META_KEY, _meta(index), timeout=None)
+    for key in stale:
+        cache.touch(key, FACET_STALE_TIMEOUT)
+
+
+def _queued_key(number):
+    return f'{FACET_QUEUE_KEY}:{number}'
+
+
+def _apply_queued(index):
+    """
+    Apply the batches queued after index.applied, in order; stops at a
+    batch not written yet (its writer drains the queue itself once it
+    is). Returns what changed (see FacetIndex.update), or None when no
+    batch was applied. Call with the lock held.
+    """
+    last = cache.get(FACET_QUEUE_KEY, 0)
+    if last < index.applied or last - index.applied > FACET_QUEUE_MAX:
+        # The counter was evicted and restarted, or a writer died between
+        # numbering and writing its batch: start over from the database
+        invalidate_facet_index()
+        return None
+    product_ids = set()
+    first, applied = index.applied + 1, index.applied
+    for number in range(first, last + 1):
+        batch = cache.get(_queued_key(number))
+        if batch is None:
+            break
+        product_ids |= batch
+        applied = number
+    if applied == index.applied:
+        return None
+    try:
+        changed = index.update(product_ids)
+    except StaleOffsets:
+        invalidate_facet_index()
+        return None
+    index.applied = applied
+    cache.delete_many([_queued_key(number) for number in range(first, applied + 1)])
+    return changed
+
+
+def _drain():
+    """Apply the queue to the stored index unless another worker holds the lock (it will)."""
+    global _memo
+    while cache.add(FACET_LOCK_KEY, 1, timeout=FACET_LOCK_TIMEOUT):
+        try:
+            meta = cache.get(FACET_META_KEY)
+            if meta is None:
+                return  # Nothing cached yet; the next read builds a fresh index
+            index = _load(meta, _memo)
+            if index is None:
+                invalidate_facet_index()
+                return
+            changed = _apply_queued(index)
+            if changed is not None:
+                # Stored even if no bitmap changed: `applied` moved on
+                _store(index, changed)
+                _memo = index
+        finally:
+            cache.delete(FACET_LOCK_KEY)
+        # Batches queued while we held the lock were left to us
+        if cache.get(FACET_QUEUE_KEY, 0) <= index.applied:
+            return
+
+
+def invalidate_facet_index():
+    """Drop the stored index; the next read rebuilds it from the database."""
+    meta = cache.get(FACET_META_KEY)
+    cache.delete(FACET_META_KEY)
+    if meta is None:
+        return
+    # Let the parts it pointed at expire
+    stale = [_part_key(name, meta[name]) for name in PARTS]
+    directories = cache.get_many([_part_key(f'dir:{facet}', version) for facet, version in meta['facets'].items()])
+    stale.extend(directories)
+    for facet, version in meta['facets'].items():
+        directory = directories.get(_part_key(f'dir:{facet}', version), {})
+        stale.extend(_bits_key(facet, value, value_version) for value, value_version in directory.items())
+    for key in stale:
+        cache.touch(key, FACET_STALE_TIMEOUT)
+
+
+def update_facet_index(product_ids):
+    """
+    Queue the given products for a refresh in the shared index and apply
+    the queue if no other worker is applying it.
+    """
+    product_ids = {pk for pk in product_ids if pk is not None}
+    if not product_ids:
+        return
+    cache.add(FACET_QUEUE_KEY, 0, timeout=None)
+    try:
+        number = cache.incr(FACET_QUEUE_KEY)
+    except ValueError:
+        # The counter was evicted: queue positions restart, so the index
+        # cannot tell what it covers any more
+        invalidate_facet_index()
+        return
+    cache.set(_queued_key(number), product_ids, timeout=FACET_QUEUE_TIMEOUT)
+    _drain()
+
+
+def schedule_facet_update(product_ids):
+    """Refresh the given products in the facet index after commit."""
+    product_ids = set(product_ids)
+    transaction.on_commit(lambda: update_facet_index(product_ids))
@@ -0,0 +1,70 @@
+"""
+Shop API filter backends
+"""
+from rest_framework.filters import BaseFilterBackend, OrderingFilter, SearchFilter
+
+from .facets import ATTRIBUTE_PREFIX, parse_selections
+from .models import Product
+from .search import get_search_backend
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Full-text product search through the configured search backend.
+    Matches are annotated with `search_rank` for relevance ordering.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        return get_search_backend(queryset.db).search(queryset, query)
+
+
+class ProductOrderingFilter(OrderingFilter):
+    """
+    Ordering filter that sorts search results by relevance unless the
+    client asks for an explicit ordering (?ordering=relevance is accepted).
+    ?ordering=price sorts by the effective (cheapest variant) price.
+    """
+
+    relevance_value = 'relevance'
+    # Public ordering names mapped onto model fields
+    ordering_aliases = {'price': 'effective_min_price'}
+
+    def remove_invalid_fields(self, queryset, fields, view, request):
+        fields = [self.translate_alias(term) for term in fields]
+        return super().remove_invalid_fields(queryset, fields, view, request)
+
+    def translate_alias(self, term):
+        prefix = '-' if term.startswith('-') else ''
+        return prefix + self.ordering_aliases.get(term.lstrip('-'), term.lstrip('-'))
+
+    def get_ordering(self, request, queryset, view):
+        params = request.query_params.get(self.ordering_param)
+        if 'search_rank' in queryset.query.annotations and params in (None, '', self.relevance_value):
+            return ['-search_rank'] + list(self.get_default_ordering(view) or [])
+        return super().get_ordering(request, queryset, view)
+
+
+class VariantAttributeFilter(BaseFilterBackend):
+    """
+    ?attr.<key>=<value> filtering on variant attributes via the indexed
+    VariantAttribute table. Different keys are AND'ed, repeated values of
+    one key are OR'ed; on products, a single variant must match them all.
+    """
+
+    def get_selections(self, request):
+        return {
+            facet[len(ATTRIBUTE_PREFIX):]: values
+            for facet, values in parse_selections(request.query_params).items()
+            if facet.startswith(ATTRIBUTE_PREFIX)
+        }
+
+    def filter_queryset(self, request, queryset, view):
+        selections = self.get_selections(request)
+        if not selections:
+            return queryset
+        if queryset.model is Product:
+            return queryset.with_variant_attributes(selections)
+        return queryset.with_attributes(selections)
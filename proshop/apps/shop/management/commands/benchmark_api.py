@@ -0,0 +1,328 @@
+"""
+Management command to benchmark the main API endpoints in-process
+Drives the real URL routing, middleware and views through Django's test
+client against the configured database (build a dataset first with
+`generate_load_data`), with Stripe stubbed out. Cart and checkout writes go
+to a dedicated benchmark account; it refuses to run without DEBUG unless
+given --i-know. Reports p50/p95/p99
+latency, throughput and SQL queries per request for each scenario, and can
+store the results as JSON and diff them against a previous run.
+Usage: python manage.py benchmark_api [--requests 200] [--output results.json]
+       [--compare baseline.json] [--scenario product_list --scenario checkout]
+       [--i-know]
+"""
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+from types import SimpleNamespace
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from apps.cart.models import Cart, CartItem, StockReservation
+from apps.shop.models import Product, ProductVariant
+
+
+SEARCH_TERMS = ['pro', 'classic', 'black', 'smart', 'shirt', 'eco', 'audio', 'lite']
+BENCHMARK_EMAIL = 'benchmark@benchmark.invalid'
+
+
+class Scenario:
+    """
+    One benchmarked endpoint. prepare() runs untimed before every request
+    and returns (method, path, data); `client` is 'anonymous', 'customer'
+    (the benchmark account, for writes) or 'shopper' (read-only requests as
+    the busiest real customer).
+    """
+
+    def __init__(self, name, prepare, client='anonymous'):
+        self.name = name
+        self.prepare = prepare
+        self.client = client
+
+
+class Command(BaseCommand):
+    help = 'Benchmark catalog, cart, checkout and order API endpoints (latency, throughput, queries)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Timed requests per scenario'
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=10,
+            help='Untimed requests per scenario before measuring'
+        )
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            help='Only run the named scenario (repeatable)'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed for request parameters'
+        )
+        parser.add_argument(
+            '--output',
+            help='Write results as JSON to this file'
+        )
+        parser.add_argument(
+            '--compare',
+            help='Previous JSON results to diff against'
+        )
+        parser.add_argument(
+            '--fail-threshold',
+            type=float,
+            help='With --compare: exit with an error if any p95 regresses by more than this percentage'
+        )
+        parser.add_argument(
+            '--i-know',
+            action='store_true',
+            help='Run without DEBUG (adds stock holds and a benchmark account to this database)'
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['i_know']:
+            raise CommandError(
+                'Refusing to benchmark a non-DEBUG database: it writes carts and stock holds '
+                '(pass --i-know to run anyway)'
+            )
+        self.random = random.Random(options['seed'])
+        self.load_dataset()
+        scenarios = self.get_scenarios()
+        if options['scenario']:
+            unknown = set(options['scenario']) - {scenario.name for scenario in scenarios}
+            if unknown:
+                raise CommandError(f'Unknown scenario(s): {", ".join(sorted(unknown))}')
+            scenarios = [scenario for scenario in scenarios if scenario.name in options['scenario']]
+
+        # Allows the 'testserver' host and keeps outgoing mail in memory
+        try:
+            setup_test_environment()
+            own_environment = True
+        except RuntimeError:
+            own_environment = False  # Already running under the test runner
+        try:
+            self.clients = {'anonymous': Client(), 'customer': Client(), 'shopper': Client()}
+            self.clients['customer'].force_login(self.customer)
+            self.clients['shopper'].force_login(self.shopper)
+            stripe_session = SimpleNamespace(id='cs_benchmark', url='https://checkout.stripe.test/cs_benchmark')
+            with mock.patch('stripe.checkout.Session.create', return_value=stripe_session):
+                results = {}
+                self.stdout.write(
+                    f"{'scenario':<22} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} "
+                    f"{'queries':>8} {'errors':>7}"
+                )
+                for scenario in scenarios:
+                    results[scenario.name] = self.run_scenario(scenario, options['requests'], options['warmup'])
+                    self.write_result(scenario.name, results[scenario.name])
+        finally:
+            for client in self.clients.values():
+                client.logout()
+            StockReservation.objects.release(cart=self.cart)
+            CartItem.objects.filter(cart=self.cart).delete()
+            if own_environment:
+                teardown_test_environment()
+
+        report = {
+            'meta': self.get_metadata(options),
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(report, handle, indent=2, sort_keys=True)
+            self.stdout.write(f'Results written to {options["output"]}')
+        if options['compare']:
+            self.compare(report, options['compare'], options['fail_threshold'])
+
+        self.stdout.write(self.style.SUCCESS(f'[OK] Benchmarked {len(results)} scenarios'))
+
+    # ---- dataset and scenarios ------------------------------------------
+
+    def load_dataset(self):
+        """Pick the ids the scenarios draw from."""
+        self.product_ids = list(Product.objects.filter(is_active=True).values_list('pk', flat=True)[:50000])
+        self.variant_ids = list(
+            ProductVariant.objects.filter(is_active=True, product__is_active=True, stock__gte=10)
+            .values_list('pk', flat=True)[:50000]
+        )
+        if not self.product_ids or not self.variant_ids:
+            raise CommandError('No catalog to benchmark - run `manage.py generate_load_data` first')
+
+        # The busiest customer, so the order list has realistic depth
+        self.shopper = (
+            get_user_model().objects.annotate(order_total=Count('orders'))
+            .filter(is_active=True, is_staff=False).exclude(email=BENCHMARK_EMAIL)
+            .order_by('-order_total', 'pk').first()
+        )
+        if self.shopper is None:
+            raise CommandError('No customer accounts - run `manage.py generate_load_data` first')
+        # Carts and stock holds are only ever written for this account
+        self.customer = get_user_model().objects.filter(email=BENCHMARK_EMAIL).first()
+        if self.customer is None:
+            self.customer = get_user_model().objects.create_user(email=BENCHMARK_EMAIL)
+        self.cart = Cart.objects.get_or_create_for_user(self.customer)
+
+    def get_scenarios(self):
+        rng = self.random
+        return [
+            Scenario('product_list', lambda: ('get', '/api/products/', {})),
+            Scenario('product_list_filtered', lambda: ('get', '/api/products/', {
+                'min_price': rng.choice([10, 25, 50]),
+                'max_price': rng.choice([100, 200, 500]),
+                'ordering': rng.choice(['price', '-price', '-created_at', 'name']),
+                'in_stock': 'true',
+            })),
+            Scenario('product_detail', lambda: ('get', f'/api/products/{rng.choice(self.product_ids)}/', {})),
+            Scenario('product_search', lambda: ('get', '/api/products/', {'search': rng.choice(SEARCH_TERMS)})),
+            Scenario('product_facets', lambda: ('get', '/api/products/facets/', {'in_stock': 'true'})),
+            Scenario('cart_add', self.prepare_cart_add, client='customer'),
+            Scenario('cart_update', self.prepare_cart_update, client='customer'),
+            Scenario('cart_view', self.prepare_cart_view, client='customer'),
+            Scenario('checkout', self.prepare_checkout, client='customer'),
+            Scenario('order_list', lambda: ('get', '/orders/api/', {}), client='shopper'),
+        ]
+
+    def fill_cart(self, size=3):
+        """Keep the benchmark cart at `size` items (untimed setup)."""
+        item_ids = list(self.cart.items.order_by('pk').values_list('pk', flat=True))
+        if len(item_ids) > size:
+            CartItem.objects.filter(pk__in=item_ids[size:]).delete()
+        missing = max(size - len(item_ids), 0)
+        for variant in ProductVariant.objects.filter(pk__in=self.random.sample(self.variant_ids, missing)):
+            CartItem.objects.get_or_create(
+                cart=self.cart, variant=variant, defaults={'quantity': 1, 'price_at_add': variant.price}
+            )
+
+    def prepare_cart_add(self):
+        CartItem.objects.filter(cart=self.cart).delete()
+        self.fill_cart(size=2)
+        return 'post', '/api/cart/add/', {'variant_id': self.random.choice(self.variant_ids), 'quantity': 1}
+
+    def prepare_cart_view(self):
+        self.fill_cart()
+        return 'get', '/api/cart/', {}
+
+    def prepare_checkout(self):
+        self.fill_cart()
+        return 'post', '/api/payment/checkout/', {}
+
+    def prepare_cart_update(self):
+        self.fill_cart()
+        item = self.cart.items.order_by('?').first()
+        return 'patch', f'/api/cart/items/{item.pk}/', {'quantity': self.random.randint(1, 5)}
+
+    # ---- measuring ------------------------------------------------------
+
+    def request(self, scenario):
+        method, path, data = scenario.prepare()
+        client = self.clients[scenario.client]
+        if method == 'get':
+            return lambda: client.get(path, data)
+        return lambda: getattr(client, method)(path, data, content_type='application/json')
+
+    def run_scenario(self, scenario, count, warmup):
+        for _ in range(warmup):
+            self.request(scenario)()
+
+        latencies, queries, errors, busy = [], [], 0, 0.0
+        for _ in range(count):
+            send = self.request(scenario)
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = send()
+                elapsed = time.perf_counter() - started
+            busy += elapsed
+            latencies.append(elapsed * 1000)
+            queries.append(len(captured))
+            if response.status_code >= 400:
+                errors += 1
+
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+        return {
+            'requests': count,
+            'errors': errors,
+            'p50_ms': round(cuts[49], 3),
+            'p95_ms': round(cuts[94], 3),
+            'p99_ms': round(cuts[98], 3),
+            'mean_ms': round(statistics.fmean(latencies), 3),
+            'max_ms': round(max(latencies), 3),
+            # Sequential requests: throughput of one worker, setup excluded
+            'throughput_rps': round(count / busy, 1) if busy else 0.0,
+            'queries_mean': round(statistics.fmean(queries), 2),
+            'queries_max': max(queries),
+        }
+
+    def write_result(self, name, result):
+        self.stdout.write(
+            f"{name:<22} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+            f"{result['throughput_rps']:>8.1f} {result['queries_mean']:>8.1f} {result['errors']:>7}"
+        )
+
+    # ---- reporting ------------------------------------------------------
+
+    def get_metadata(self, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, timeout=5, cwd=settings.BASE_DIR
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            commit = None
+        return {
+            'commit': commit,
+            'timestamp': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'cache': settings.CACHES['default']['BACKEND'],
+            'python': platform.python_version(),
+            'products': Product.objects.count(),
+            'variants': ProductVariant.objects.count(),
+            'requests': options['requests'],
+            'seed': options['seed'],
+        }
+
+    def compare(self, report, path, threshold):
+        """Print per-scenario deltas against a previous run."""
+        try:
+            with open(path) as handle:
+                baseline = json.load(handle)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'Cannot read baseline {path}: {exc}')
+
+        self.stdout.write(f"\nCompared with {path} (commit {baseline['meta'].get('commit')}):")
+        self.stdout.write(f"{'scenario':<22} {'p50':>9} {'p95':>9} {'p99':>9} {'queries':>9}")
+        regressions = []
+        for name, result in report['results'].items():
+            before = baseline['results'].get(name)
+            if before is None:
+                self.stdout.write(f'{name:<22} (new)')
+                continue
+            deltas = [
+                self.change(before[key], result[key])
+                for key in ('p50_ms', 'p95_ms', 'p99_ms', 'queries_mean')
+            ]
+            self.stdout.write(f'{name:<22} ' + ' '.join(f'{delta:>+8.1f}%' for delta in deltas))
+            if threshold is not None and deltas[1] > threshold:
+                regressions.append(f'{name} p95 {deltas[1]:+.1f}%')
+        if regressions:
+            raise CommandError(f'Regressions above {threshold}%: {"; ".join(regressions)}')
+
+    @staticmethod
+    def change(before, after):
+        if not before:
+            return 0.0 if not after else 100.0
+        return (after - before) / before * 100
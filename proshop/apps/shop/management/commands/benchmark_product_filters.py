@@ -0,0 +1,146 @@
+"""
+Management command to benchmark product list price/stock filtering
+Compares the legacy variant JOIN + DISTINCT querysets with the current
+ProductViewSet querysets (denormalized effective price/stock columns) on a
+synthetic catalog. All seeded rows are rolled back afterwards.
+Usage: python manage.py benchmark_product_filters [--products 100000]
+"""
+import random
+import statistics
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from apps.shop.models import Category, Product, ProductVariant
+from apps.shop.views import ProductViewSet
+
+
+SCENARIOS = [
+    ('price range', {'min_price': '50', 'max_price': '150'}),
+    ('in stock', {'in_stock': 'true'}),
+    ('price range + in stock', {'min_price': '50', 'max_price': '150', 'in_stock': 'true'}),
+    ('ordering=price', {'ordering': 'price'}),
+    ('price range, ordering=price', {'min_price': '50', 'max_price': '150', 'ordering': 'price'}),
+]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark legacy vs denormalized product price/stock filtering'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products',
+            type=int,
+            default=100000,
+            help='Number of synthetic products to create'
+        )
+        parser.add_argument(
+            '--variants',
+            type=int,
+            default=2,
+            help='Variants per product (every other product gets none)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Timed runs per query (the median is reported)'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed for the synthetic catalog'
+        )
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        with transaction.atomic():
+            started = time.monotonic()
+            self.seed_catalog(options['products'], options['variants'])
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            self.stdout.write(f'Seeded catalog in {time.monotonic() - started:.1f}s')
+
+            self.stdout.write(f"{'scenario':<30} {'legacy ms':>10} {'current ms':>11} {'speedup':>8}")
+            for name, params in SCENARIOS:
+                legacy = self.timed(self.legacy_queryset(params), options['repeat'])
+                current = self.timed(self.current_queryset(params), options['repeat'])
+                self.stdout.write(
+                    f'{name:<30} {legacy:>10.1f} {current:>11.1f} {legacy / max(current, 0.001):>7.1f}x'
+                )
+
+            # Never keep the synthetic catalog
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('[OK] Benchmark complete (synthetic data rolled back)'))
+
+    def seed_catalog(self, count, variants_per_product, batch_size=5000):
+        """Bulk insert products and variants with random prices and stock."""
+        category = Category.objects.create(name='Benchmark', slug='benchmark-catalog')
+        for start in range(0, count, batch_size):
+            products = []
+            for i in range(start, min(start + batch_size, count)):
+                price = Decimal(random.randint(100, 50000)) / 100
+                stock = random.choice([0, 0, 5, 20, 100])
+                products.append(Product(
+                    name=f'Benchmark product {i}',
+                    slug=f'benchmark-product-{i}',
+                    sku=f'BENCH-{i}',
+                    description='Synthetic benchmark product',
+                    category=category,
+                    base_price=price,
+                    stock=stock,
+                    effective_min_price=price,
+                    effective_total_stock=stock,
+                ))
+            products = Product.objects.bulk_create(products)
+
+            variants = [
+                ProductVariant(
+                    product=product,
+                    sku=f'{product.sku}-V{v}',
+                    price=Decimal(random.randint(100, 50000)) / 100,
+                    stock=random.choice([0, 3, 10]),
+                    attributes={'size': random.choice(['S', 'M', 'L', 'XL'])},
+                )
+                for product in products[::2]
+                for v in range(variants_per_product)
+            ]
+            # Also refreshes the parents' effective price/stock
+            ProductVariant.objects.bulk_create(variants)
+
+    def legacy_queryset(self, params):
+        """The pre-denormalization ProductViewSet.get_queryset filters."""
+        queryset = Product.objects.filter(is_active=True)
+        if 'min_price' in params:
+            min_price = float(params['min_price'])
+            queryset = queryset.filter(Q(base_price__gte=min_price) | Q(variants__price__gte=min_price))
+        if 'max_price' in params:
+            max_price = float(params['max_price'])
+            queryset = queryset.filter(Q(base_price__lte=max_price) | Q(variants__price__lte=max_price))
+        if 'in_stock' in params:
+            queryset = queryset.filter(Q(stock__gt=0) | Q(variants__stock__gt=0))
+        ordering = 'base_price' if params.get('ordering') == 'price' else '-created_at'
+        return queryset.distinct().order_by(ordering, 'pk')
+
+    def current_queryset(self, params):
+        """The queryset ProductViewSet builds for a list request."""
+        request = Request(APIRequestFactory().get('/api/products/', params))
+        view = ProductViewSet(request=request, action='list', format_kwarg=None, kwargs={})
+        queryset = view.filter_queryset(view.get_queryset())
+        # Same pk tie-breaker as the legacy query (keyset pagination adds one too)
+        return queryset.order_by(*queryset.query.order_by, 'pk')
+
+    def timed(self, queryset, repeat):
+        """Median milliseconds for the first page plus the total count."""
+        runs = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(queryset.all()[:20])
+            queryset.all().count()
+            runs.append((time.perf_counter() - started) * 1000)
+        return statistics.median(runs)
@@ -0,0 +1,441 @@
+"""
+Management command to generate a large synthetic dataset for load and
+performance testing
+Usage: python manage.py generate_load_data [--products 10000] [--variants-per-product 3]
+       [--users 1000] [--orders 5000] [--reviews 20000] [--seed 42] [--clear]
+
+Data is reproducible for a given --seed and shaped like a real shop: a
+category tree per department, variants built from attribute combinations,
+Zipf-skewed brand and product popularity (driving order items, reviews and
+the bestseller flag), lognormal prices, out-of-stock items and image rows.
+
+Everything is written with bulk_create in batches. Generated rows are tagged
+(SKU/order prefix LOAD-, users @load.example, category slugs load-) so they
+can be removed again with --clear.
+"""
+import itertools
+import random
+import time
+from array import array
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from apps.orders.models import Order, OrderItem
+from apps.reviews.models import Review
+from apps.shop.cache import PRODUCT_BULK_TAG, PRODUCT_COLLECTIONS, PRODUCT_LIST_TAG, bump_catalog_version, invalidate_tags, refresh_collections
+from apps.shop.facets import invalidate_facet_index
+from apps.shop.models import Category, Product, ProductImage, ProductVariant
+from apps.shop.search import get_search_backend
+
+
+PREFIX = 'LOAD'
+USER_DOMAIN = 'load.example'
+
+# Department -> (subcategory words, variant attribute axes)
+DEPARTMENTS = {
+    'Electronics': (
+        ['Phones', 'Laptops', 'Audio', 'Cameras', 'Wearables', 'Accessories'],
+        {'color': ['Black', 'Silver', 'White', 'Blue'], 'storage': ['64GB', '128GB', '256GB', '512GB']},
+    ),
+    'Clothing': (
+        ['Shirts', 'Jeans', 'Jackets', 'Dresses', 'Shoes', 'Hats'],
+        {'size': ['XS', 'S', 'M', 'L', 'XL', 'XXL'], 'color': ['Black', 'White', 'Red', 'Navy', 'Green']},
+    ),
+    'Home': (
+        ['Kitchen', 'Bedding', 'Lighting', 'Decor', 'Storage'],
+        {'color': ['White', 'Grey', 'Oak', 'Walnut'], 'size': ['Small', 'Medium', 'Large']},
+    ),
+    'Sports': (
+        ['Running', 'Cycling', 'Fitness', 'Camping', 'Swimming'],
+        {'size': ['S', 'M', 'L', 'XL'], 'color': ['Black', 'Orange', 'Blue', 'Lime']},
+    ),
+    'Beauty': (
+        ['Skincare', 'Makeup', 'Haircare', 'Fragrance'],
+        {'volume': ['30ml', '50ml', '100ml', '200ml'], 'shade': ['Light', 'Medium', 'Dark']},
+    ),
+    'Books': (
+        ['Fiction', 'Science', 'History', 'Children', 'Cooking'],
+        {'format': ['Paperback', 'Hardcover', 'Ebook', 'Audiobook'], 'language': ['EN', 'DE', 'FR']},
+    ),
+}
+ADJECTIVES = ['Classic', 'Pro', 'Ultra', 'Eco', 'Smart', 'Compact', 'Deluxe', 'Essential', 'Prime', 'Lite']
+BRAND_ROOTS = ['Nord', 'Vibe', 'Astra', 'Kite', 'Orbit', 'Pulse', 'Terra', 'Nova', 'Echo', 'Zen']
+BRAND_SUFFIXES = ['', 'co', 'works', 'lab', 'ware', 'ly']
+REVIEW_TITLES = {
+    1: 'Disappointed', 2: 'Not great', 3: 'Does the job', 4: 'Really good', 5: 'Love it',
+}
+ORDER_STATUSES = (
+    [('delivered', 'paid')] * 55 + [('shipped', 'paid')] * 10 + [('processing', 'paid')] * 8
+    + [('confirmed', 'paid')] * 5 + [('pending', 'unpaid')] * 12 + [('cancelled', 'unpaid')] * 6
+    + [('returned', 'refunded')] * 2 + [('pending', 'failed')] * 2
+)
+CITIES = [
+    ('Berlin', 'BE', 'Germany'), ('Paris', 'IDF', 'France'), ('Austin', 'TX', 'United States'),
+    ('Toronto', 'ON', 'Canada'), ('Madrid', 'MD', 'Spain'), ('Osaka', 'OS', 'Japan'),
+]
+
+
+def zipf_cum_weights(count, exponent=1.1):
+    """Cumulative weights for random.choices(): item i has weight 1/(i+1)^s."""
+    return list(itertools.accumulate(1.0 / (rank + 1) ** exponent for rank in range(count)))
+
+
+class Command(BaseCommand):
+    help = 'Generate a large, reproducible synthetic shop dataset with bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000, help='Number of products')
+        parser.add_argument(
+            '--variants-per-product',
+            type=int,
+            default=3,
+            help='Variants per product (attribute combinations)'
+        )
+        parser.add_argument('--images-per-product', type=int, default=2, help='Image rows per product')
+        parser.add_argument('--users', type=int, default=1000, help='Number of customers')
+        parser.add_argument('--orders', type=int, default=5000, help='Number of orders')
+        parser.add_argument('--reviews', type=int, default=20000, help='Number of reviews')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Products (or users/orders/reviews) inserted per transaction'
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete previously generated data first'
+        )
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.using = options['database']
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+
+        if options['clear']:
+            self.stage('Clearing previous data', self.clear)
+        elif Category.objects.using(self.using).filter(slug__startswith='load-').exists():
+            raise CommandError('Generated data already exists; rerun with --clear to replace it')
+
+        self.stage('Categories', self.generate_categories)
+        self.stage('Products, variants and images', self.generate_products,
+                   options['products'], options['variants_per_product'], options['images_per_product'])
+        self.stage('Users', self.generate_users, options['users'])
+        if self.user_ids and self.variant_ids:
+            self.stage('Orders', self.generate_orders, options['orders'])
+            self.stage('Reviews', self.generate_reviews, options['reviews'])
+        self.stage('Indexes and caches', self.finish)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'[OK] Generated {len(self.product_ids)} products, {len(self.variant_ids)} variants, '
+            f'{len(self.user_ids)} users in {time.monotonic() - started:.1f}s'
+        ))
+
+    def stage(self, label, method, *args):
+        """Run one generation step and report its duration and throughput."""
+        started = time.monotonic()
+        rows = method(*args) or 0
+        elapsed = time.monotonic() - started
+        rate = f' ({rows / max(elapsed, 1e-6):.0f} rows/s)' if rows else ''
+        self.stdout.write(f'  * {label}: {rows} rows in {elapsed:.1f}s{rate}')
+
+    def batches(self, total):
+        """Yield (start, stop) ranges of at most batch_size."""
+        for start in range(0, total, self.batch_size):
+            yield start, min(start + self.batch_size, total)
+
+    # ---- generation -----------------------------------------------------
+
+    def clear(self):
+        """Delete generated rows (orders first: order items protect products)."""
+        deleted = 0
+        for queryset in (
+            Order.objects.using(self.using).filter(order_number__startswith=f'{PREFIX}-'),
+            get_user_model().objects.using(self.using).filter(email__endswith=f'@{USER_DOMAIN}'),
+            Product.objects.using(self.using).filter(sku__startswith=f'{PREFIX}-'),
+            Category.objects.using(self.using).filter(slug__startswith='load-'),
+        ):
+            deleted += queryset.delete()[0]
+        return deleted
+
+    def generate_categories(self):
+        """One root per department, its subcategories, and 2-3 leaves each."""
+        roots = Category.objects.using(self.using).bulk_create([
+            Category(name=f'{name} (load)', slug=f'load-{name.lower()}', ordering=i)
+            for i, name in enumerate(DEPARTMENTS)
+        ])
+        children = []
+        for root, (words, _) in zip(roots, DEPARTMENTS.values()):
+            children.extend(
+                Category(name=word, slug=f'{root.slug}-{word.lower()}', parent=root, ordering=i)
+                for i, word in enumerate(words)
+            )
+        children = Category.objects.using(self.using).bulk_create(children)
+        leaves = Category.objects.using(self.using).bulk_create([
+            Category(name=f'{child.name} {kind}', slug=f'{child.slug}-{kind.lower()}', parent=child)
+            for child in children
+            for kind in ['Basics', 'Premium', 'Outlet'][:self.random.randint(2, 3)]
+        ])
+        Category.objects.db_manager(self.using).rebuild_paths()
+
+        # Products land in leaves and take their department's attribute axes
+        parents = {child.pk: child.parent_id for child in children}
+        axes = {root.pk: DEPARTMENTS[name][1] for root, name in zip(roots, DEPARTMENTS)}
+        self.leaf_axes = {leaf.pk: axes[parents[leaf.parent_id]] for leaf in leaves}
+        self.leaves = list(self.leaf_axes)
+        return len(roots) + len(children) + len(leaves)
+
+    def generate_products(self, count, variants_per_product, images_per_product):
+        """Products in batches, each with its variants and images, one transaction per batch."""
+        rng = self.random
+        brands = [f'{root}{suffix}'.title() for root in BRAND_ROOTS for suffix in BRAND_SUFFIXES]
+        brand_weights = zipf_cum_weights(len(brands))
+        new_after = count - max(1, count // 20)
+        bestseller_ranks = max(1, count // 100)
+
+        # Popularity rank -> product position, so popularity isn't tied to age
+        self.popularity = list(range(count))
+        rng.shuffle(self.popularity)
+        bestsellers = set(self.popularity[:bestseller_ranks])
+
+        # Compact per-variant arrays for order generation
+        self.product_ids = array('q')
+        self.variant_ids = array('q')
+        self.variant_product_ids = array('q')
+        self.variant_offsets = array('q')   # first variant index of each product
+        self.variant_cents = array('q')
+        rows = 0
+
+        for start, stop in self.batches(count):
+            products = []
+            for i in range(start, stop):
+                category_id = rng.choice(self.leaves)
+                axes = self.leaf_axes[category_id]
+                brand = rng.choices(brands, cum_weights=brand_weights)[0]
+                noun = rng.choice(list(axes))
+                name = f'{brand} {rng.choice(ADJECTIVES)} {noun.title()} {i}'
+                price = Decimal(round(rng.lognormvariate(3.6, 0.9), 2)).quantize(Decimal('0.01')) + 1
+                stock = 0 if rng.random() < 0.15 else min(int(rng.paretovariate(1.2) * 5), 1000)
+                products.append(Product(
+                    name=name,
+                    slug=f'load-{i}',
+                    sku=f'{PREFIX}-{i:07d}',
+                    category_id=category_id,
+                    brand=brand,
+                    description=f'{name}. Synthetic product generated for load testing.',
+                    short_description=f'{brand} {noun}',
+                    base_price=price,
+                    cost_price=(price * Decimal('0.6')).quantize(Decimal('0.01')),
+                    stock=stock,
+                    effective_min_price=price,
+                    effective_total_stock=stock,
+                    is_active=rng.random() > 0.03,
+                    is_featured=rng.random() < 0.02,
+                    is_bestseller=i in bestsellers,
+                    is_new=i >= new_after,
+                    meta_title=name[:60],
+                ))
+
+            with transaction.atomic(using=self.using):
+                products = Product.objects.using(self.using).bulk_create(products)
+                variants, images = [], []
+                for product in products:
+                    axes = self.leaf_axes[product.category_id]
+                    combinations = list(itertools.product(*axes.values()))
+                    rng.shuffle(combinations)
+                    for v, values in enumerate(combinations[:variants_per_product]):
+                        delta = Decimal(rng.choice([-10, 0, 0, 5, 10, 20])) / 100
+                        variants.append(ProductVariant(
+                            product=product,
+                            sku=f'{product.sku}-{v}',
+                            price=(product.base_price * (1 + delta)).quantize(Decimal('0.01')),
+                            stock=0 if rng.random() < 0.2 else rng.randint(1, 50),
+                            attributes=dict(zip(axes, values)),
+                            is_default=v == 0,
+                            ordering=v,
+                        ))
+                    images.extend(
+                        ProductImage(
+                            product=product,
+                            image=f'products/load/{product.sku}-{n}.jpg',
+                            alt_text=product.name[:200],
+                            is_primary=n == 0,
+                            ordering=n,
+                        )
+                        for n in range(images_per_product)
+                    )
+                # Also syncs the attribute index and the parents' summary columns
+                variants = ProductVariant.objects.using(self.using).bulk_create(variants)
+                ProductImage.objects.using(self.using).bulk_create(images)
+
+            position = 0
+            for product in products:
+                self.product_ids.append(product.pk)
+                self.variant_offsets.append(len(self.variant_ids))
+                while position < len(variants) and variants[position].product_id == product.pk:
+                    self.variant_ids.append(variants[position].pk)
+                    self.variant_product_ids.append(product.pk)
+                    self.variant_cents.append(int(variants[position].price * 100))
+                    position += 1
+            rows += len(products) + len(variants) + len(images)
+            self.stdout.write(f'    {stop}/{count} products')
+        self.variant_offsets.append(len(self.variant_ids))
+        return rows
+
+    def generate_users(self, count):
+        """Customers sharing one precomputed password hash ('loadtest123')."""
+        password = make_password('loadtest123')
+        user_model = get_user_model()
+        self.user_ids = array('q')
+        for start, stop in self.batches(count):
+            users = user_model.objects.db_manager(self.using).bulk_create([
+                user_model(
+                    email=f'user{i}@{USER_DOMAIN}',
+                    username=f'loaduser{i}',
+                    first_name='Load',
+                    last_name=f'User {i}',
+                    password=password,
+                    city=CITIES[i % len(CITIES)][0],
+                    country=CITIES[i % len(CITIES)][2],
+                )
+                for i in range(start, stop)
+            ])
+            self.user_ids.extend(user.pk for user in users)
+        return count
+
+    def pick_variant(self, product_weights):
+        """A variant index of a product drawn by popularity (None if it has none)."""
+        rank = self.random.choices(range(len(self.popularity)), cum_weights=product_weights)[0]
+        position = self.popularity[rank]
+        first, last = self.variant_offsets[position], self.variant_offsets[position + 1]
+        if first == last:
+            return None
+        return self.random.randrange(first, last)
+
+    def generate_orders(self, count):
+        """Orders over the last year with 1-5 popularity-weighted items each."""
+        rng = self.random
+        product_weights = zipf_cum_weights(len(self.popularity))
+        customer_weights = zipf_cum_weights(len(self.user_ids), exponent=0.8)
+        now = timezone.now()
+        rows = 0
+        for start, stop in self.batches(count):
+            orders, lines = [], []
+            for i in range(start, stop):
+                items = {}
+                for _ in range(rng.choices([1, 2, 3, 4, 5], weights=[40, 30, 15, 10, 5])[0]):
+                    index = self.pick_variant(product_weights)
+                    if index is not None:
+                        items[index] = items.get(index, 0) + rng.choices([1, 2, 3], weights=[80, 15, 5])[0]
+                if not items:
+                    continue
+                subtotal = sum(Decimal(self.variant_cents[index] * qty) / 100 for index, qty in items.items())
+                shipping = Decimal('0.00') if subtotal >= 50 else Decimal('5.99')
+                tax = (subtotal * Decimal('0.08')).quantize(Decimal('0.01'))
+                status, payment_status = rng.choice(ORDER_STATUSES)
+                city, state, country = rng.choice(CITIES)
+                address = {
+                    f'{kind}_{field}': value
+                    for kind in ('shipping', 'billing')
+                    for field, value in (
+                        ('address', f'{rng.randint(1, 999)} Load Street'),
+                        ('city', city), ('state', state),
+                        ('postal_code', f'{rng.randint(10000, 99999)}'), ('country', country),
+                    )
+                }
+                orders.append(Order(
+                    user_id=self.user_ids[rng.choices(range(len(self.user_ids)), cum_weights=customer_weights)[0]],
+                    order_number=f'{PREFIX}-{i:08d}',
+                    status=status,
+                    payment_status=payment_status,
+                    subtotal=subtotal,
+                    shipping_cost=shipping,
+                    tax=tax,
+                    total=subtotal + shipping + tax,
+                    **address,
+                ))
+                lines.append(items)
+
+            with transaction.atomic(using=self.using):
+                orders = Order.objects.using(self.using).bulk_create(orders)
+                # auto_now_add overwrote created_at; spread orders over a year
+                for order in orders:
+                    order.created_at = now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+                Order.objects.using(self.using).bulk_update(orders, ['created_at'], batch_size=500)
+                OrderItem.objects.using(self.using).bulk_create([
+                    OrderItem(
+                        order=order,
+                        product_id=self.variant_product_ids[index],
+                        variant_id=self.variant_ids[index],
+                        quantity=quantity,
+                        price=Decimal(self.variant_cents[index]) / 100,
+                    )
+                    for order, items in zip(orders, lines)
+                    for index, quantity in items.items()
+                ])
+            rows += len(orders) + sum(len(items) for items in lines)
+        return rows
+
+    def generate_reviews(self, count):
+        """Popularity-weighted reviews (ratings skew positive), then product ratings."""
+        rng = self.random
+        product_weights = zipf_cum_weights(len(self.popularity))
+        seen = set()
+        # Reviews need distinct (product, user) pairs
+        count = min(count, len(self.product_ids) * len(self.user_ids))
+        rows = 0
+        while rows < count:
+            reviews = []
+            while len(reviews) < min(self.batch_size, count - rows):
+                rank = rng.choices(range(len(self.popularity)), cum_weights=product_weights)[0]
+                product_id = self.product_ids[self.popularity[rank]]
+                user_id = rng.choice(self.user_ids)
+                if (product_id, user_id) in seen:
+                    continue
+                seen.add((product_id, user_id))
+                rating = rng.choices([1, 2, 3, 4, 5], weights=[5, 7, 13, 30, 45])[0]
+                reviews.append(Review(
+                    product_id=product_id,
+                    user_id=user_id,
+                    title=REVIEW_TITLES[rating],
+                    content=f'{REVIEW_TITLES[rating]}. Synthetic review generated for load testing.',
+                    rating=rating,
+                    helpful_count=min(int(rng.paretovariate(1.5)) - 1, 500),
+                    verified_purchase=rng.random() < 0.7,
+                ))
+            Review.objects.using(self.using).bulk_create(reviews)
+            rows += len(reviews)
+
+        # Denormalized rating/review_count in one UPDATE; the base update()
+        # skips catalog invalidation, which finish() does once for everything
+        reviews = Review.objects.filter(product=models.OuterRef('pk')).order_by().values('product')
+        models.QuerySet.update(
+            Product.objects.using(self.using).filter(
+                sku__startswith=f'{PREFIX}-',
+                pk__in=Review.objects.values('product_id'),
+            ),
+            rating=Coalesce(models.Subquery(
+                reviews.annotate(value=models.Avg('rating')).values('value')[:1]
+            ), Decimal('0')),
+            review_count=Coalesce(models.Subquery(
+                reviews.annotate(value=models.Count('pk')).values('value')[:1]
+            ), 0),
+        )
+        return rows
+
+    def finish(self):
+        """Rebuild the search index and drop catalog caches built before the load."""
+        with transaction.atomic(using=self.using):
+            get_search_backend(self.using).rebuild(using=self.using)
+        invalidate_facet_index()
+        refresh_collections(PRODUCT_COLLECTIONS)
+        invalidate_tags([PRODUCT_LIST_TAG, PRODUCT_BULK_TAG])
+        bump_catalog_version()
@@ -0,0 +1,349 @@
+"""
+Management command to bulk import a catalog feed (CSV or JSON Lines)
+Usage: python manage.py import_catalog feed.csv [--batch-size 1000] [--resume]
+
+One row per product, or per variant (repeat the product columns):
+    sku, name, description, short_description, brand, base_price, stock,
+    is_active, is_featured, is_bestseller, is_new,
+    category, category_name, parent_category,
+    variant_sku, variant_price, variant_stock, attributes
+
+Products and variants are upserted by SKU, categories matched by slug.
+Only the columns present in the feed are updated on existing rows, so a
+price/stock-only feed is a valid partial update. In CSV, `attributes` is a
+JSON object string.
+
+Rows are processed in batches, each in its own transaction; after every
+committed batch the position is written to a checkpoint file so a failed
+import can continue with --resume.
+"""
+import csv
+import itertools
+import json
+import os
+import time
+from decimal import Decimal, InvalidOperation
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, transaction
+from django.utils.text import slugify
+from apps.shop.cache import PRODUCT_COLLECTIONS, invalidate_catalog_on_commit, refresh_collections_on_commit
+from apps.shop.facets import schedule_facet_update
+from apps.shop.models import Category, Product, ProductVariant, VariantAttribute
+from apps.shop.search import get_search_backend
+
+
+# Feed column -> Product field, for columns updated on existing products
+PRODUCT_COLUMNS = {
+    'name': 'name',
+    'description': 'description',
+    'short_description': 'short_description',
+    'brand': 'brand',
+    'base_price': 'base_price',
+    'stock': 'stock',
+    'is_active': 'is_active',
+    'is_featured': 'is_featured',
+    'is_bestseller': 'is_bestseller',
+    'is_new': 'is_new',
+    'category': 'category',
+}
+VARIANT_COLUMNS = {
+    'variant_price': 'price',
+    'variant_stock': 'stock',
+    'attributes': 'attributes',
+}
+BOOLEAN_COLUMNS = {'is_active', 'is_featured', 'is_bestseller', 'is_new'}
+
+
+class RowError(ValueError):
+    """A feed row that cannot be imported."""
+
+
+class Command(BaseCommand):
+    help = 'Stream a CSV/JSONL catalog feed into categories, products and variants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL feed file')
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'jsonl'],
+            help='Feed format (default: from the file extension)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows per transaction'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Checkpoint file (default: <path>.checkpoint)'
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Skip the rows committed by a previous, interrupted run'
+        )
+
+    def handle(self, *args, **options):
+        path = os.path.abspath(options['path'])
+        if not os.path.exists(path):
+            raise CommandError(f'Feed not found: {path}')
+        feed_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+        batch_size = options['batch_size']
+
+        skip = self.read_checkpoint(checkpoint, path) if options['resume'] else 0
+        if skip:
+            self.stdout.write(f'Resuming after row {skip}')
+
+        started = time.monotonic()
+        categories = self.import_categories(self.read_rows(path, feed_format))
+        self.stdout.write(f'Categories: {len(categories)} resolved')
+
+        done, products, variants = skip, 0, 0
+        rows = itertools.islice(self.read_rows(path, feed_format), skip, None)
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            batch_started = time.monotonic()
+            try:
+                with transaction.atomic():
+                    counts = self.import_batch(batch, categories)
+            except RowError as exc:
+                raise CommandError(f'{exc} - fix the feed and rerun with --resume')
+            except DatabaseError as exc:
+                raise CommandError(
+                    f'Batch starting at row {done + 1} failed ({exc}) - rows up to {done} '
+                    f'are committed, rerun with --resume'
+                )
+            done += len(batch)
+            products += counts[0]
+            variants += counts[1]
+            self.write_checkpoint(checkpoint, path, done)
+
+            elapsed = time.monotonic() - batch_started
+            self.stdout.write(f'  * {done} rows ({len(batch) / max(elapsed, 1e-6):.0f} rows/s)')
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        elapsed = time.monotonic() - started
+        imported = done - skip
+        self.stdout.write(self.style.SUCCESS(
+            f'[OK] Imported {imported} rows ({products} products, {variants} variants) '
+            f'in {elapsed:.2f}s ({imported / max(elapsed, 1e-6):.0f} rows/s)'
+        ))
+
+    # ---- reading --------------------------------------------------------
+
+    def read_rows(self, path, feed_format):
+        """Yield (line number, row dict) lazily from the feed."""
+        with open(path, newline='', encoding='utf-8') as feed:
+            if feed_format == 'csv':
+                reader = csv.DictReader(feed)
+                for row in reader:
+                    yield reader.line_num, row
+                return
+            for line_no, line in enumerate(feed, start=1):
+                if line.strip():
+                    try:
+                        yield line_no, json.loads(line)
+                    except ValueError as exc:
+                        raise CommandError(f'Line {line_no}: invalid JSON ({exc})')
+
+    def read_checkpoint(self, checkpoint, path):
+        try:
+            with open(checkpoint) as handle:
+                state = json.load(handle)
+        except FileNotFoundError:
+            return 0
+        if state.get('source') != path:
+            raise CommandError(f'Checkpoint {checkpoint} belongs to {state.get("source")}')
+        return state['rows']
+
+    def write_checkpoint(self, checkpoint, path, rows):
+        temporary = f'{checkpoint}.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump({'source': path, 'rows': rows}, handle)
+        os.replace(temporary, checkpoint)
+
+    # ---- categories -----------------------------------------------------
+
+    def import_categories(self, rows):
+        """
+        Create missing categories and link parents in one pass over the
+        feed. Returns {slug: category id}.
+        """
+        feed = {}  # slug -> [name, parent slug]
+        for _, row in rows:
+            slug = (row.get('category') or '').strip()
+            parent = (row.get('parent_category') or '').strip()
+            if parent:
+                feed.setdefault(parent, [None, None])
+            if slug:
+                entry = feed.setdefault(slug, [None, None])
+                entry[0] = (row.get('category_name') or '').strip() or entry[0]
+                entry[1] = parent or entry[1]
+        if not feed:
+            return {}
+
+        with transaction.atomic():
+            existing = {}
+            for pk, slug in Category.objects.filter(slug__in=feed).order_by('pk').values_list('pk', 'slug'):
+                existing.setdefault(slug, pk)
+            created = Category.objects.bulk_create([
+                Category(name=name or slug.replace('-', ' ').title(), slug=slug)
+                for slug, (name, _) in feed.items() if slug not in existing
+            ])
+            for category in created:
+                existing[category.slug] = category.pk
+
+            parents = dict(Category.objects.values_list('pk', 'parent_id'))
+            updated = []
+            for slug, (_, parent_slug) in feed.items():
+                if not parent_slug:
+                    continue
+                pk, parent_id = existing[slug], existing[parent_slug]
+                if parents.get(pk) == parent_id:
+                    continue
+                ancestor = parent_id
+                while ancestor is not None:
+                    if ancestor == pk:
+                        raise CommandError(f'Category {slug!r} cannot be placed under {parent_slug!r} (cycle)')
+                    ancestor = parents.get(ancestor)
+                parents[pk] = parent_id
+                updated.append(Category(pk=pk, parent_id=parent_id))
+            Category.objects.bulk_update(updated, ['parent'], batch_size=500)
+            if created or updated:
+                Category.objects.rebuild_paths()
+                invalidate_catalog_on_commit(category_ids=[category.pk for category in updated + created])
+        return existing
+
+    # ---- products and variants ------------------------------------------
+
+    def import_batch(self, batch, categories):
+        """Upsert one batch of rows; returns (products, variants) written."""
+        products, variants, variant_products = {}, {}, {}
+        product_columns, variant_columns = set(), set()
+        for line_no, row in batch:
+            try:
+                product = self.build_product(row, categories, product_columns)
+                products[product.sku] = product
+                if (row.get('variant_sku') or '').strip():
+                    variant = self.build_variant(row, variant_columns)
+                    variants[variant.sku] = variant
+                    variant_products[variant.sku] = product.sku
+            except (KeyError, ValueError, InvalidOperation) as exc:
+                raise RowError(f'Row {line_no or "?"} ({row.get("sku", "no sku")}): {exc}')
+
+        Product.objects.bulk_create(
+            products.values(),
+            update_conflicts=True,
+            unique_fields=['sku'],
+            update_fields=sorted(product_columns | {'updated_at'}),
+        )
+        product_ids = dict(Product.objects.filter(sku__in=products).values_list('sku', 'pk'))
+
+        if variants:
+            for sku, variant in variants.items():
+                variant.product_id = product_ids[variant_products[sku]]
+            self.price_variants([variant for variant in variants.values() if variant.price is None])
+            ProductVariant.objects.bulk_create(
+                variants.values(),
+                update_conflicts=True,
+                unique_fields=['sku'],
+                update_fields=sorted(variant_columns | {'product', 'updated_at'}),
+            )
+            # Upserted rows come back without pks, so sync from the database
+            VariantAttribute.objects.sync(ProductVariant.objects.filter(sku__in=variants))
+
+        # bulk_create bypasses save()/signals: refresh derived data ourselves
+        ids = list(product_ids.values())
+        Product.objects.filter(pk__in=ids).refresh_summaries()
+        get_search_backend(Product.objects.db).index_products(ids, using=Product.objects.db)
+        schedule_facet_update(ids)
+        invalidate_catalog_on_commit(product_ids=ids)
+        refresh_collections_on_commit(PRODUCT_COLLECTIONS)
+        return len(products), len(variants)
+
+    def build_product(self, row, categories, columns):
+        sku = row['sku'].strip()
+        if not sku:
+            raise ValueError('missing sku')
+        name = (row.get('name') or '').strip() or sku
+        product = Product(
+            sku=sku,
+            name=name,
+            slug=(row.get('slug') or '').strip() or self.product_slug(name, sku),
+        )
+        for column, field in PRODUCT_COLUMNS.items():
+            value = row.get(column)
+            if value is None or value == '':
+                continue
+            columns.add(field)
+            if column == 'category':
+                product.category_id = categories[value.strip()]
+            elif column == 'base_price':
+                product.base_price = Decimal(str(value))
+            elif column == 'stock':
+                product.stock = int(value)
+            elif column in BOOLEAN_COLUMNS:
+                setattr(product, field, self.parse_bool(value))
+            else:
+                setattr(product, field, str(value).strip())
+        product.effective_min_price = product.base_price
+        product.effective_total_stock = product.stock
+        return product
+
+    @staticmethod
+    def product_slug(name, sku):
+        # Truncate the name, never the (unique) SKU, so slugs stay unique
+        max_length = Product._meta.get_field('slug').max_length
+        sku_part = slugify(sku)[:max_length]
+        name_part = slugify(name)[:max_length - len(sku_part) - 1].rstrip('-')
+        return f'{name_part}-{sku_part}' if name_part else sku_part
+
+    def build_variant(self, row, columns):
+        # price stays None without a variant_price column (see price_variants)
+        variant = ProductVariant(sku=row['variant_sku'].strip(), price=None)
+        for column, field in VARIANT_COLUMNS.items():
+            value = row.get(column)
+            if value is None or value == '':
+                continue
+            columns.add(field)
+            if column == 'variant_price':
+                variant.price = Decimal(str(value))
+            elif column == 'variant_stock':
+                variant.stock = int(value)
+            else:
+                attributes = json.loads(value) if isinstance(value, str) else value
+                if not isinstance(attributes, dict):
+                    raise ValueError('attributes must be an object')
+                variant.attributes = attributes
+        return variant
+
+    @staticmethod
+    def price_variants(variants):
+        """
+        Price variants whose rows have no variant_price: existing variants
+        keep their price (the column may still be upserted for the batch),
+        new ones start at their product's base price.
+        """
+        if not variants:
+            return
+        current = dict(
+            ProductVariant.objects.filter(sku__in=[variant.sku for variant in variants])
+            .values_list('sku', 'price')
+        )
+        base_prices = dict(
+            Product.objects.filter(pk__in={variant.product_id for variant in variants})
+            .values_list('pk', 'base_price')
+        )
+        for variant in variants:
+            variant.price = current.get(variant.sku, base_prices[variant.product_id])
+
+    @staticmethod
+    def parse_bool(value):
+        if isinstance(value, bool):
+            return value
+        return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
@@ -0,0 +1,39 @@
+"""
+Management command to rebuild denormalized product summary columns
+Usage: python manage.py rebuild_product_summaries [--batch-size 1000]
+"""
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.shop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Recompute effective price, stock and primary image for all products'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of products to update per transaction'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        product_ids = list(
+            Product.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        started = time.monotonic()
+
+        self.stdout.write(f'Rebuilding summaries for {len(product_ids)} products...')
+        for start in range(0, len(product_ids), batch_size):
+            batch = product_ids[start:start + batch_size]
+            with transaction.atomic():
+                Product.objects.filter(pk__in=batch).refresh_summaries()
+            self.stdout.write(f'  * {start + len(batch)}/{len(product_ids)}')
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'[OK] Rebuilt {len(product_ids)} product summaries in {elapsed:.2f}s'
+        ))
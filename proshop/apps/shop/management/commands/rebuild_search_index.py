@@ -0,0 +1,31 @@
+"""
+Management command to rebuild the product full-text search index
+Usage: python manage.py rebuild_search_index
+"""
+import time
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+from apps.shop.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='Database alias to rebuild the index for'
+        )
+
+    def handle(self, *args, **options):
+        using = options['database']
+        backend = get_search_backend(using)
+        started = time.monotonic()
+
+        self.stdout.write(f'Rebuilding search index with {backend.__class__.__name__}...')
+        with transaction.atomic(using=using):
+            backend.rebuild(using=using)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'[OK] Search index rebuilt in {elapsed:.2f}s'))
@@ -0,0 +1,81 @@
+# Generated by Django 4.2.10 on 2026-10-17 09:12
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def populate_summaries(apps, schema_editor):
+    Product = apps.get_model("shop", "Product")
+    ProductVariant = apps.get_model("shop", "ProductVariant")
+    ProductImage = apps.get_model("shop", "ProductImage")
+
+    variants = (
+        ProductVariant.objects.filter(product=models.OuterRef("pk"))
+        .order_by()
+        .values("product")
+    )
+    images = (
+        ProductImage.objects.filter(product=models.OuterRef("pk"))
+        .order_by("-is_primary", "ordering", "pk")
+        .values("pk")[:1]
+    )
+    Product.objects.update(
+        effective_min_price=Coalesce(
+            models.Subquery(
+                variants.annotate(value=models.Min("price")).values("value")
+            ),
+            models.F("base_price"),
+        ),
+        effective_total_stock=Coalesce(
+            models.Subquery(
+                variants.annotate(value=models.Sum("stock")).values("value")
+            ),
+            models.F("stock"),
+        ),
+        primary_image=models.Subquery(images),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="effective_min_price",
+            field=models.DecimalField(
+                blank=True,
+                decimal_places=2,
+                editable=False,
+                help_text="Minimum variant price, or base price if no variants",
+                max_digits=10,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="effective_total_stock",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                help_text="Sum of variant stock, or product stock if no variants",
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="primary_image",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                help_text="Primary image shown in listings",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="shop.productimage",
+            ),
+        ),
+        migrations.RunPython(populate_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.10 on 2026-10-17 11:23
+
+from django.db import migrations, models
+
+
+def build_paths(apps, schema_editor):
+    Category = apps.get_model("shop", "Category")
+    nodes = list(Category.objects.values_list("pk", "parent_id"))
+    children = {}
+    for pk, parent_id in nodes:
+        children.setdefault(parent_id, []).append(pk)
+
+    known = {pk for pk, _ in nodes}
+    queue = [(pk, "", 0) for pk, parent_id in nodes if parent_id not in known]
+    updated = []
+    while queue:
+        pk, parent_path, depth = queue.pop()
+        path = f"{parent_path}{pk:08d}/"
+        updated.append(Category(pk=pk, path=path, depth=depth))
+        queue.extend((child, path, depth + 1) for child in children.get(pk, []))
+    Category.objects.bulk_update(updated, ["path", "depth"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0002_product_summary_columns"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="depth",
+            field=models.PositiveSmallIntegerField(
+                default=0,
+                editable=False,
+                help_text="Depth in the category tree (0 for top-level)",
+            ),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="path",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                help_text="Materialized path of ancestor ids (maintained automatically)",
+                max_length=255,
+            ),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 4.2.10 on 2026-10-17 14:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import json
+
+
+def index_attributes(apps, schema_editor):
+    ProductVariant = apps.get_model("shop", "ProductVariant")
+    VariantAttribute = apps.get_model("shop", "VariantAttribute")
+    rows = []
+    for variant_id, attributes in ProductVariant.objects.values_list(
+        "pk", "attributes"
+    ).iterator(chunk_size=2000):
+        for key, value in (attributes or {}).items():
+            value = value if isinstance(value, str) else json.dumps(value)
+            rows.append(
+                VariantAttribute(
+                    variant_id=variant_id, key=str(key)[:100], value=value[:255]
+                )
+            )
+        if len(rows) >= 2000:
+            VariantAttribute.objects.bulk_create(rows)
+            rows = []
+    VariantAttribute.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0004_product_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VariantAttribute",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "key",
+                    models.CharField(
+                        help_text="Attribute name (e.g., size)", max_length=100
+                    ),
+                ),
+                (
+                    "value",
+                    models.CharField(
+                        help_text="Attribute value as text (e.g., XL)", max_length=255
+                    ),
+                ),
+                (
+                    "variant",
+                    models.ForeignKey(
+                        help_text="Variant the attribute belongs to",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="attribute_values",
+                        to="shop.productvariant",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Variant Attribute",
+                "verbose_name_plural": "Variant Attributes",
+                "indexes": [
+                    models.Index(
+                        fields=["key", "value"], name="shop_varian_key_725eae_idx"
+                    )
+                ],
+                "unique_together": {("variant", "key")},
+            },
+        ),
+        migrations.RunPython(index_attributes, migrations.RunPython.noop),
+    ]
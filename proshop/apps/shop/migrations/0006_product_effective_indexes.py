@@ -0,0 +1,26 @@
+# Generated by Django 4.2.10 on 2026-10-17 00:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0005_variant_attribute_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["is_active", "effective_min_price"],
+                name="shop_produc_is_acti_ff3825_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["is_active", "effective_total_stock"],
+                name="shop_produc_is_acti_488c26_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.10 on 2026-10-17 01:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0006_product_effective_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="productvariant",
+            name="reserved",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                help_text="Units held by checkouts in progress",
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.10 on 2026-10-17 02:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0007_variant_reserved"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="product",
+            name="effective_total_stock",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                help_text="Sum of variant stock not held by checkouts, or product stock if no variants",
+            ),
+        ),
+    ]
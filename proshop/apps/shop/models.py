@@ -2,10 +2,15 @@
 Shop application models - Products, Categories, Variants, Images
 Professional e-commerce models with best practices for 2025-2026.
 """
-from django.db import models
+import copy
+import json
+from django.db import models, transaction
 from django.utils.text import slugify
+from django.utils import timezone
 from django.core.validators import MinValueValidator
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models.functions import Coalesce, Concat, Greatest, Substr
 
 
 # ===========================
@@ -25,6 +30,162 @@ class TimestampedModel(models.Model):
         ordering = ['-created_at']
 
 
+class TrackedFieldsMixin:
+    """
+    Remembers the values of `tracked_fields` (attnames) as loaded from the
+    database or last saved, so save() and signals can tell which of them
+    changed.
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_tracked_fields()
+        return instance
+
+    def remember_tracked_fields(self):
+        """Take the current values as the saved ones."""
+        self._tracked_values = {
+            name: copy.deepcopy(self.__dict__[name])
+            for name in self.tracked_fields
+            if name in self.__dict__
+        }
+
+    def changed_fields(self):
+        """Tracked fields changed since; None if never loaded nor saved (unknown)."""
+        tracked = self.__dict__.get('_tracked_values')
+        if tracked is None:
+            return None
+        return {name for name, value in tracked.items() if self.__dict__.get(name) != value}
+
+
+# ===========================
+# CATEGORY MODEL - CUSTOM QUERYSET & MANAGER
+# ===========================
+
+class CategoryQuerySet(models.QuerySet):
+    """Custom QuerySet for Category with tree helpers."""
+
+    def update(self, **kwargs):
+        """
+        Rebuild materialized paths when categories are bulk-reparented and
+        invalidate catalog caches (bulk updates bypass signals).
+        """
+        from .cache import invalidate_catalog_on_commit
+
+        category_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        if 'parent' in kwargs or 'parent_id' in kwargs:
+            Category.objects.rebuild_paths()
+        invalidate_catalog_on_commit(category_ids=category_ids)
+        return rows
+
+    def descendants_of(self, category, include_self=True):
+        """Get all categories below `category` in the tree."""
+        queryset = self.filter(path__startswith=category.path)
+        if not include_self:
+            queryset = queryset.exclude(pk=category.pk)
+        return queryset
+
+    def with_product_counts(self):
+        """
+        Annotate `subtree_product_count`: active products in each category
+        and all of its descendants, computed in the same query.
+        """
+        products = Product.objects.filter(
+            is_active=True,
+            category__path__startswith=models.OuterRef('path'),
+        ).order_by().annotate(
+            total=models.Func(models.F('pk'), function='COUNT')
+        ).values('total')
+        return self.annotate(
+            subtree_product_count=Coalesce(
+                models.Subquery(products, output_field=models.IntegerField()), 0
+            )
+        )
+
+
+class CategoryManager(models.Manager):
+    """Custom manager for Category with tree maintenance."""
+
+    def get_queryset(self):
+        return CategoryQuerySet(self.model, using=self._db)
+
+    def with_product_counts(self):
+        """Annotate subtree product counts."""
+        return self.get_queryset().with_product_counts()
+
+    def build_tree(self):
+        """
+        Return active categories as nested dicts (root first, children in
+        display order) with subtree product counts, using a single query.
+        """
+        categories = self.get_queryset().filter(is_active=True).with_product_counts().order_by(
+            'depth', 'ordering', 'name'
+        ).values('id', 'parent_id', 'name', 'slug', 'icon', 'subtree_product_count')
+
+        nodes = {}
+        roots = []
+        for category in categories:
+            node = {
+                'id': category['id'],
+                'name': category['name'],
+                'slug': category['slug'],
+                'icon': category['icon'],
+                'product_count': category['subtree_product_count'],
+                'children': [],
+            }
+            nodes[category['id']] = node
+            if category['parent_id'] is None:
+                roots.append(node)
+            elif category['parent_id'] in nodes:
+                nodes[category['parent_id']]['children'].append(node)
+            # Children of inactive categories are hidden with their parent
+        return roots
+
+    def rebuild_paths(self):
+        """Recompute path and depth for every category from parent links."""
+        nodes = list(self.get_queryset().order_by().values_list('pk', 'parent_id', 'path', 'depth'))
+        children = {}
+        for pk, parent_id, _, _ in nodes:
+            children.setdefault(parent_id, []).append(pk)
+
+        known = {pk for pk, _, _, _ in nodes}
+        computed = {}
+        # Roots, plus any node whose parent no longer exists
+        queue = [(pk, '', 0) for pk, parent_id, _, _ in nodes if parent_id not in known]
+        while queue:
+            pk, parent_path, depth = queue.pop()
+            path = Category.build_path(parent_path, pk)
+            computed[pk] = (path, depth)
+            queue.extend((child, path, depth + 1) for child in children.get(pk, []))
+
+        changed = [
+            Category(pk=pk, path=computed[pk][0], depth=computed[pk][1])
+            for pk, _, path, depth in nodes
+            if pk in computed and computed[pk] != (path, depth)
+        ]
+        self.get_queryset().bulk_update(changed, ['path', 'depth'], batch_size=500)
+        return len(changed)
+
+    def attach_ancestors(self, categories):
+        """
+        Load the ancestors of `categories` in one query and link the parent
+        chains in memory, so str() (which walks up to the root) needs no
+        further queries.
+        """
+        categories = [category for category in categories if category is not None]
+        ancestor_ids = {pk for category in categories for pk in category.get_ancestor_ids()}
+        ancestors = self.get_queryset().in_bulk(ancestor_ids) if ancestor_ids else {}
+        parent_field = Category._meta.get_field('parent')
+        for category in [*categories, *ancestors.values()]:
+            if category.parent_id in ancestors:
+                parent_field.set_cached_value(category, ancestors[category.parent_id])
+            elif category.parent_id is None:
+                parent_field.set_cached_value(category, None)
+
+
 # ===========================
 # CATEGORY MODEL
 # ===========================
@@ -32,8 +193,15 @@ class TimestampedModel(models.Model):
 class Category(TimestampedModel):
     """
     Product category with support for hierarchical structure (parent-child).
-    Uses self-referencing ForeignKey for flexibility and simplicity.
+    Uses self-referencing ForeignKey for flexibility and simplicity, plus a
+    materialized path so subtree queries are a single indexed prefix match.
     """
+    # Zero-padded id segments keep paths sortable and unambiguous
+    PATH_DIGITS = 8
+    PATH_SEPARATOR = '/'
+
+    objects = CategoryManager()
+
     name = models.CharField(
         max_length=200,
         db_index=True,
@@ -62,6 +230,18 @@ class Category(TimestampedModel):
         related_name='children',
         help_text="Parent category (leave empty for top-level categories)"
     )
+    path = models.CharField(
+        max_length=255,
+        blank=True,
+        db_index=True,
+        editable=False,
+        help_text="Materialized path of ancestor ids (maintained automatically)"
+    )
+    depth = models.PositiveSmallIntegerField(
+        default=0,
+        editable=False,
+        help_text="Depth in the category tree (0 for top-level)"
+    )
     is_active = models.BooleanField(
         default=True,
         db_index=True,
@@ -87,43 +267,225 @@ class Category(TimestampedModel):
             return f"{self.parent} → {self.name}"
         return self.name
 
+    @classmethod
+    def build_path(cls, parent_path, pk):
+        """Return the materialized path for node `pk` under `parent_path`."""
+        return f"{parent_path}{pk:0{cls.PATH_DIGITS}d}{cls.PATH_SEPARATOR}"
+
+    def clean(self):
+        """Prevent a category from being moved below itself."""
+        super().clean()
+        if self.path and self._parent_path().startswith(self.path):
+            raise ValidationError({'parent': 'A category cannot be nested under itself.'})
+
     def save(self, *args, **kwargs):
-        """Auto-generate slug from name if not provided."""
+        """Auto-generate slug from name and maintain the materialized path."""
         if not self.slug:
             self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+        parent_path = self._parent_path()
+        if self.path and parent_path.startswith(self.path):
+            raise ValueError("A category cannot be nested under itself.")
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._sync_path(parent_path)
+
+    def _parent_path(self):
+        """Return the parent's current path straight from the database."""
+        if not self.parent_id:
+            return ''
+        return Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).first() or ''
+
+    def _sync_path(self, parent_path):
+        """Store this node's path/depth and rebase its subtree if it moved."""
+        old_path, old_depth = self.path, self.depth
+        new_path = self.build_path(parent_path, self.pk)
+        new_depth = parent_path.count(self.PATH_SEPARATOR)
+        if (new_path, new_depth) == (old_path, old_depth):
+            return
+
+        Category.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+        if old_path:
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(models.Value(new_path), Substr('path', len(old_path) + 1)),
+                depth=models.F('depth') + (new_depth - old_depth),
+            )
+        self.path, self.depth = new_path, new_depth
 
     def get_absolute_url(self):
         """Return category URL."""
         return f"/shop/category/{self.slug}/"
 
+    def get_ancestor_ids(self):
+        """Return ancestor ids from the root down (excluding this category)."""
+        segments = [segment for segment in self.path.split(self.PATH_SEPARATOR) if segment]
+        return [int(segment) for segment in segments[:-1]]
+
+    def get_breadcrumbs(self):
+        """Return ancestors plus this category, root first, in one query."""
+        ids = self.get_ancestor_ids() + [self.pk]
+        return list(Category.objects.filter(pk__in=ids).order_by('depth'))
+
+    def get_descendants(self, include_self=True):
+        """Return this category's subtree."""
+        return Category.objects.descendants_of(self, include_self=include_self)
+
+    def get_descendant_products(self):
+        """Return active products in this category and all descendants."""
+        return Product.objects.filter(
+            is_active=True,
+            category__path__startswith=self.path,
+        )
+
     @property
     def product_count(self):
         """Get total products in this category and subcategories."""
-        count = self.products.filter(is_active=True).count()
-        for child in self.children.all():
-            count += child.product_count
-        return count
+        if hasattr(self, 'subtree_product_count'):
+            return self.subtree_product_count
+        return self.get_descendant_products().count()
 
 
 # ===========================
 # PRODUCT MODEL - CUSTOM QUERYSET & MANAGER
 # ===========================
 
+# A variant's stock not held by checkouts (ProductVariant.available_stock)
+AVAILABLE_STOCK = Greatest(
+    models.F('stock') - models.F('reserved'), models.Value(0), output_field=models.IntegerField()
+)
+
+
 class ProductQuerySet(models.QuerySet):
     """Custom QuerySet for Product with common filters."""
 
+    # Fields that feed the denormalized price/stock summary columns
+    SUMMARY_SOURCE_FIELDS = {'base_price', 'stock'}
+    # Fields indexed by the full-text search backend
+    SEARCH_FIELDS = {'name', 'brand', 'sku', 'description'}
+    # Fields that decide membership in the precomputed product collections
+    COLLECTION_FIELDS = {
+        'is_active': ('featured', 'bestsellers', 'new'),
+        'is_featured': ('featured',),
+        'is_bestseller': ('bestsellers',),
+        'is_new': ('new',),
+        'created_at': ('featured', 'bestsellers', 'new'),
+    }
+    # Fields that feed the facet index (besides the summary columns)
+    FACET_FIELDS = {
+        'category', 'category_id', 'brand', 'is_active',
+        'is_featured', 'is_bestseller', 'is_new',
+    }
+    # Bulk updates writing more products than this are not tracked per id
+    BULK_UPDATE_THRESHOLD = 100
+
     def active(self):
         """Get only active products."""
         return self.filter(is_active=True)
 
     def featured(self):
         """Get only featured products."""
-        return self.filter(is_featured=True, is_active=True)
+        return self.collection('featured')
 
     def bestsellers(self):
         """Get only bestseller products."""
-        return self.filter(is_bestseller=True, is_active=True)
+        return self.collection('bestsellers')
+
+    def collection(self, name):
+        """
+        Active products of a collection ('featured', 'bestsellers', 'new'),
+        newest first - the same rows and order as the precomputed id list
+        (see get_collection_ids), read through the indexed flag columns.
+        """
+        from .cache import COLLECTION_ORDERING, PRODUCT_COLLECTIONS
+
+        return self.filter(is_active=True, **{PRODUCT_COLLECTIONS[name]: True}).order_by(*COLLECTION_ORDERING)
+
+    def update(self, **kwargs):
+        """
+        Keep summary columns and the search index in sync when their source
+        fields are bulk-updated, and invalidate catalog caches (bulk updates
+        bypass signals).
+
+        Past BULK_UPDATE_THRESHOLD products no id list is collected: the
+        written rows are stamped with one updated_at and refreshed through
+        that filter, the response cache drops its list and bulk tags
+        instead of one tag per product, and the facet index is rebuilt.
+        """
+        from .cache import invalidate_catalog_on_commit, refresh_collections_on_commit
+        from .facets import invalidate_facet_index, schedule_facet_update
+        from .search import get_search_backend
+
+        refresh_summaries = bool(self.SUMMARY_SOURCE_FIELDS.intersection(kwargs))
+        reindex = bool(self.SEARCH_FIELDS.intersection(kwargs))
+        refacet = refresh_summaries or bool(self.FACET_FIELDS.intersection(kwargs))
+        fields = set(kwargs)
+
+        product_ids = list(self.values_list('pk', flat=True)[:self.BULK_UPDATE_THRESHOLD + 1])
+        bulk = len(product_ids) > self.BULK_UPDATE_THRESHOLD
+        if bulk:
+            # The update may change the columns this queryset filters on,
+            # so it is not re-evaluated afterwards
+            stamp = kwargs['updated_at'] = timezone.now()
+            written = Product.objects.using(self.db).filter(updated_at=stamp)
+        else:
+            written = Product.objects.using(self.db).filter(pk__in=product_ids)
+        rows = super().update(**kwargs)
+        if bulk:
+            invalidate_catalog_on_commit(all_products=True, fields=fields)
+        else:
+            invalidate_catalog_on_commit(product_ids=product_ids, fields=fields)
+        # e.g. ProductAdmin's mark_featured / mark_bestseller actions
+        refresh_collections_on_commit(
+            name for field in fields for name in self.COLLECTION_FIELDS.get(field, ())
+        )
+        if refresh_summaries:
+            written.refresh_summaries()
+        if reindex:
+            get_search_backend(self.db).index_products(written if bulk else product_ids, using=self.db)
+        if refacet:
+            if bulk:
+                transaction.on_commit(invalidate_facet_index)
+            else:
+                schedule_facet_update(product_ids)
+        return rows
+
+    def refresh_summaries(self):
+        """
+        Recompute effective_min_price, effective_total_stock (stock not
+        held by checkouts) and primary_image for every product in this
+        queryset in one UPDATE.
+        """
+        variants = ProductVariant.objects.filter(
+            product=models.OuterRef('pk')
+        ).order_by().values('product')
+        images = ProductImage.objects.filter(
+            product=models.OuterRef('pk')
+        ).order_by('-is_primary', 'ordering', 'pk').values('pk')[:1]
+
+        # Call the base update() directly - these columns never feed back into
+        # themselves, so there is nothing further to refresh.
+        return models.QuerySet.update(
+            self.order_by(),
+            effective_min_price=Coalesce(
+                models.Subquery(variants.annotate(value=models.Min('price')).values('value')),
+                models.F('base_price'),
+            ),
+            effective_total_stock=Coalesce(
+                models.Subquery(variants.annotate(value=models.Sum(AVAILABLE_STOCK)).values('value')),
+                models.F('stock'),
+            ),
+            primary_image=models.Subquery(images),
+        )
+
+    def with_variant_attributes(self, selections):
+        """
+        Products with at least one active variant matching every
+        {key: [values]} selection (values within a key are OR'ed).
+        """
+        variants = ProductVariant.objects.filter(
+            product=models.OuterRef('pk'),
+            is_active=True
+        ).with_attributes(selections)
+        return self.filter(models.Exists(variants))
 
 
 class ProductManager(models.Manager):
@@ -145,12 +507,20 @@ class ProductManager(models.Manager):
         """Get only bestseller products."""
         return self.get_queryset().bestsellers()
 
+    def collection(self, name):
+        """Get the products of a collection, newest first."""
+        return self.get_queryset().collection(name)
+
+    def refresh_summaries(self):
+        """Recompute denormalized price/stock/image columns for all products."""
+        return self.get_queryset().refresh_summaries()
+
 
 # ===========================
 # PRODUCT MODEL
 # ===========================
 
-class Product(TimestampedModel):
+class Product(TrackedFieldsMixin, TimestampedModel):
     """
     Main product model supporting variants (size, color, etc.).
     If product has variants, price and stock come from variants.
@@ -158,6 +528,12 @@ class Product(TimestampedModel):
     """
     # Use custom manager
     objects = ProductManager()
+
+    # Fields whose changes decide summary refreshes and cache invalidation
+    tracked_fields = (
+        'base_price', 'stock', 'is_active', 'category_id', 'brand', 'is_featured', 'is_bestseller',
+        'is_new', 'name', 'description', 'sku', 'created_at', 'rating',
+    )
     
     name = models.CharField(
         max_length=255,
@@ -271,6 +647,30 @@ class Product(TimestampedModel):
         help_text="Number of reviews"
     )
 
+    # Denormalized summary (maintained from variant and image writes)
+    effective_min_price = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Minimum variant price, or base price if no variants"
+    )
+    effective_total_stock = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Sum of variant stock not held by checkouts, or product stock if no variants"
+    )
+    primary_image = models.ForeignKey(
+        'ProductImage',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='+',
+        help_text="Primary image shown in listings"
+    )
+
     class Meta:
         verbose_name = 'Product'
         verbose_name_plural = 'Products'
@@ -280,6 +680,8 @@ class Product(TimestampedModel):
             models.Index(fields=['is_featured', 'is_active']),
             models.Index(fields=['brand', 'is_active']),
             models.Index(fields=['-created_at']),
+            models.Index(fields=['is_active', 'effective_min_price']),
+            models.Index(fields=['is_active', 'effective_total_stock']),
         ]
 
     def __str__(self):
@@ -288,21 +690,55 @@ class Product(TimestampedModel):
         return f"{self.name} ({sku})"
 
     def save(self, *args, **kwargs):
-        """Auto-generate slug from name if not provided."""
+        """Auto-generate slug and keep the summary columns in sync."""
         if not self.slug:
             self.slug = slugify(self.name)
+        is_new = self.pk is None
+        if is_new:
+            # A brand new product has no variants or images yet
+            self.effective_min_price = self.base_price
+            self.effective_total_stock = self.stock
         super().save(*args, **kwargs)
 
+        # Only base_price/stock feed the summary (variants and images
+        # resync it themselves); skip it when neither changed
+        update_fields = kwargs.get('update_fields')
+        changed = self.changed_fields() if update_fields is None else set(update_fields)
+        if not is_new and (changed is None or ProductQuerySet.SUMMARY_SOURCE_FIELDS & changed):
+            self.refresh_summary()
+        self.remember_tracked_fields()
+
+    def refresh_summary(self):
+        """Recompute this product's summary columns and reload them."""
+        Product.objects.filter(pk=self.pk).refresh_summaries()
+        self.refresh_from_db(fields=SUMMARY_FIELDS)
+
     def get_absolute_url(self):
         """Return product URL."""
         return f"/shop/product/{self.slug}/"
 
+    def _get_prefetched(self, relation):
+        """
+        Return the prefetched rows for a relation, or None if it was not
+        prefetched (e.g. via prefetch_related('variants', 'images')).
+        """
+        cache = getattr(self, '_prefetched_objects_cache', {})
+        if relation in cache:
+            return list(cache[relation])
+        return None
+
     def get_price(self):
         """
         Get product price.
         If variants exist, return minimum variant price.
         Otherwise, return base price.
         """
+        variants = self._get_prefetched('variants')
+        if variants is not None:
+            if variants:
+                return min(variant.price for variant in variants) or self.base_price
+            return self.base_price
+
         if self.variants.exists():
             min_price = self.variants.aggregate(
                 min_price=models.Min('price')
@@ -313,12 +749,18 @@ class Product(TimestampedModel):
     def get_available_stock(self):
         """
         Get available stock.
-        If variants exist, sum all variant stocks.
+        If variants exist, sum the variant stock not held by checkouts.
         Otherwise, return product stock.
         """
+        variants = self._get_prefetched('variants')
+        if variants is not None:
+            if variants:
+                return sum(variant.available_stock for variant in variants)
+            return self.stock
+
         if self.variants.exists():
             total_stock = self.variants.aggregate(
-                total=models.Sum('stock')
+                total=models.Sum(AVAILABLE_STOCK)
             )['total'] or 0
             return total_stock
         return self.stock
@@ -329,18 +771,176 @@ class Product(TimestampedModel):
 
     def get_primary_image(self):
         """Get primary/featured product image."""
+        images = self._get_prefetched('images')
+        if images is not None:
+            primary = next((image for image in images if image.is_primary), None)
+            return primary or (images[0] if images else None)
+
         return self.images.filter(is_primary=True).first() or self.images.first()
 
 
+SUMMARY_FIELDS = ['effective_min_price', 'effective_total_stock', 'primary_image']
+
+
 # ===========================
 # PRODUCT VARIANT MODEL
 # ===========================
 
-class ProductVariant(TimestampedModel):
+class ProductChildQuerySet(models.QuerySet):
+    """
+    QuerySet for product children (variants, images) that resyncs the
+    parent product - summary columns, facet index, catalog cache version -
+    after bulk writes, which bypass signals.
+    """
+
+    # Fields whose change affects the parent product
+    sync_fields = set()
+
+    def _sync_products(self, product_ids, refresh=True, fields=None):
+        from .cache import invalidate_catalog_on_commit
+        from .facets import schedule_facet_update
+
+        product_ids = {pk for pk in product_ids if pk is not None}
+        if not product_ids:
+            return
+        # Children are part of the product payloads, so always invalidate
+        invalidate_catalog_on_commit(product_ids=product_ids, fields=fields)
+        if refresh:
+            Product.objects.filter(pk__in=product_ids).refresh_summaries()
+            schedule_facet_update(product_ids)
+
+    def update(self, **kwargs):
+        """Resync parent products when relevant fields change."""
+        refresh = bool(self.sync_fields.intersection(kwargs))
+        product_ids = set(self.values_list('product_id', flat=True))
+        rows = super().update(**kwargs)
+        if 'product' in kwargs or 'product_id' in kwargs:
+            product_ids.update(self.values_list('product_id', flat=True))
+        self._sync_products(product_ids, refresh=refresh, fields=set(kwargs))
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Resync parent products after bulk inserts."""
+        objs = super().bulk_create(objs, *args, **kwargs)
+        self._sync_products(obj.product_id for obj in objs)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        """Resync parent products after bulk updates."""
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        self._sync_products(
+            (obj.product_id for obj in objs),
+            refresh=bool(self.sync_fields.intersection(fields)),
+            fields=set(fields),
+        )
+        return rows
+
+
+def per_variant(quantities):
+    """A `CASE id WHEN ... THEN quantity ELSE 0 END` expression for bulk stock updates."""
+    return models.Case(
+        *[models.When(pk=variant_id, then=models.Value(quantity)) for variant_id, quantity in quantities.items()],
+        default=models.Value(0),
+        output_field=models.PositiveIntegerField(),
+    )
+
+
+class ProductVariantQuerySet(ProductChildQuerySet):
+    """Custom QuerySet for ProductVariant."""
+
+    # reserved: checkout holds count against the product's available stock
+    sync_fields = {'price', 'stock', 'reserved', 'product', 'product_id', 'attributes', 'is_active'}
+
+    def with_attributes(self, selections):
+        """
+        Variants matching every {key: [values]} selection, through the
+        indexed VariantAttribute table (values within a key are OR'ed).
+        """
+        queryset = self
+        for key, values in selections.items():
+            # One join per key; (variant, key) is unique so rows never multiply
+            queryset = queryset.filter(
+                attribute_values__key=key,
+                attribute_values__value__in=[str(value) for value in values]
+            )
+        return queryset
+
+    def commit_stock(self, quantities, held=None):
+        """
+        Take sold {variant_id: quantity} off stock, and the `held` ones
+        (checkout holds being consumed) off reserved, in one UPDATE. The
+        rows are locked in id order first, so concurrent commits cannot
+        deadlock; a variant whose stock cannot cover its quantity is left
+        as it is (never below zero) and reported. Returns the shortfalls as
+        [{'sku', 'requested', 'available'}].
+        """
+        held = held or {}
+        with transaction.atomic():
+            variants = list(
+                self.select_for_update().filter(pk__in=set(quantities) | set(held))
+                .order_by('pk').only('pk', 'sku', 'stock')
+            )
+            shortfalls = [
+                {'sku': variant.sku, 'requested': quantities[variant.pk], 'available': variant.stock}
+                for variant in variants
+                if quantities.get(variant.pk, 0) > variant.stock
+            ]
+            sold = {
+                variant.pk: quantities[variant.pk]
+                for variant in variants
+                if 0 < quantities.get(variant.pk, 0) <= variant.stock
+            }
+            changes = {}
+            if sold:
+                changes['stock'] = models.F('stock') - per_variant(sold)
+            if held:
+                changes['reserved'] = Greatest(models.F('reserved') - per_variant(held), models.Value(0))
+            if changes:
+                # The rows are locked and checked: the condition is a guard
+                self.filter(
+                    pk__in=[variant.pk for variant in variants], stock__gte=per_variant(sold)
+                ).update(**changes)
+        return shortfalls
+
+    def update(self, **kwargs):
+        """Rebuild the attribute index when attributes are bulk-updated."""
+        if 'attributes' not in kwargs:
+            return super().update(**kwargs)
+        variant_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        VariantAttribute.objects.sync(ProductVariant.objects.filter(pk__in=variant_ids))
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Index attributes of bulk-inserted variants."""
+        objs = super().bulk_create(objs, *args, **kwargs)
+        VariantAttribute.objects.sync(objs)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        """Rebuild the attribute index when attributes are bulk-updated."""
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        if 'attributes' in fields:
+            VariantAttribute.objects.sync(objs)
+        return rows
+
+
+class ProductImageQuerySet(ProductChildQuerySet):
+    """Custom QuerySet for ProductImage."""
+
+    sync_fields = {'is_primary', 'ordering', 'product', 'product_id'}
+
+
+class ProductVariant(TrackedFieldsMixin, TimestampedModel):
     """
     Product variant for different sizes, colors, configurations, etc.
     Each variant has its own SKU, price, and stock.
     """
+    objects = ProductVariantQuerySet.as_manager()
+
+    # Fields whose changes decide attribute reindexing and cache invalidation
+    tracked_fields = ('attributes', 'price', 'stock', 'is_active', 'product_id')
+
     product = models.ForeignKey(
         Product,
         on_delete=models.CASCADE,
@@ -371,6 +971,13 @@ class ProductVariant(TimestampedModel):
         default=0,
         help_text="Available stock for this variant"
     )
+    # Sum of the active StockReservation holds (apps.cart); only ever
+    # changed with conditional UPDATEs, never through save()
+    reserved = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Units held by checkouts in progress"
+    )
     
     # Attributes as JSON (e.g., {"size": "XL", "color": "Red"})
     attributes = models.JSONField(
@@ -410,14 +1017,32 @@ class ProductVariant(TimestampedModel):
         return f"{self.product.name} - {attrs}" if attrs else f"{self.product.name} ({self.sku})"
 
     def save(self, *args, **kwargs):
-        """Ensure only one default variant per product."""
+        """
+        Ensure only one default variant per product. Updates never write
+        `reserved`: the value loaded may be stale by now.
+        """
         if self.is_default:
             ProductVariant.objects.filter(product=self.product, is_default=True).exclude(pk=self.pk).update(is_default=False)
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            # Unchanged attributes are left out too, so the attribute index
+            # is not rebuilt (signals.sync_variant_attributes)
+            changed = self.changed_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'reserved'
+                and not (field.name == 'attributes' and changed is not None and 'attributes' not in changed)
+            ]
         super().save(*args, **kwargs)
+        self.remember_tracked_fields()
 
     def is_in_stock(self):
-        """Check if variant has available stock."""
-        return self.stock > 0
+        """Check if variant has stock not held by checkouts."""
+        return self.available_stock > 0
+
+    @property
+    def available_stock(self):
+        """Stock not held by checkouts in progress."""
+        return max(self.stock - self.reserved, 0)
 
     @property
     def markup_percentage(self):
@@ -427,6 +1052,91 @@ class ProductVariant(TimestampedModel):
         return 0
 
 
+# ===========================
+# VARIANT ATTRIBUTE INDEX
+# ===========================
+
+class VariantAttributeManager(models.Manager):
+    """Manager that keeps the attribute index in sync with variants."""
+
+    # Variants handled per DELETE/INSERT round trip
+    SYNC_BATCH_SIZE = 500
+
+    def sync(self, variants):
+        """
+        Replace the index rows of the given variants (instances or a
+        queryset) with rows built from their current `attributes`.
+        """
+        if isinstance(variants, models.QuerySet):
+            variants = variants.only('pk', 'attributes').iterator(chunk_size=self.SYNC_BATCH_SIZE)
+        batch = []
+        for variant in variants:
+            if variant.pk is None:
+                continue
+            batch.append(variant)
+            if len(batch) >= self.SYNC_BATCH_SIZE:
+                self._sync_batch(batch)
+                batch = []
+        if batch:
+            self._sync_batch(batch)
+
+    def _sync_batch(self, variants):
+        with transaction.atomic(using=self.db):
+            self.filter(variant__in=[variant.pk for variant in variants]).delete()
+            self.bulk_create([
+                VariantAttribute(
+                    variant_id=variant.pk,
+                    key=str(key)[:100],
+                    value=VariantAttribute.normalize(value)
+                )
+                for variant in variants
+                for key, value in (variant.attributes or {}).items()
+            ])
+
+
+class VariantAttribute(models.Model):
+    """
+    Normalized copy of ProductVariant.attributes (one row per key) so that
+    attribute filters are indexed lookups instead of per-row JSON parsing.
+    Maintained automatically - never edit directly.
+    """
+    objects = VariantAttributeManager()
+
+    variant = models.ForeignKey(
+        ProductVariant,
+        on_delete=models.CASCADE,
+        related_name='attribute_values',
+        help_text="Variant the attribute belongs to"
+    )
+    key = models.CharField(
+        max_length=100,
+        help_text="Attribute name (e.g., size)"
+    )
+    value = models.CharField(
+        max_length=255,
+        help_text="Attribute value as text (e.g., XL)"
+    )
+
+    class Meta:
+        verbose_name = 'Variant Attribute'
+        verbose_name_plural = 'Variant Attributes'
+        unique_together = [['variant', 'key']]
+        indexes = [
+            models.Index(fields=['key', 'value']),
+        ]
+
+    def __str__(self):
+        """Return attribute as key=value."""
+        return f"{self.key}={self.value}"
+
+    @staticmethod
+    def normalize(value):
+        """Text form of a JSON attribute value: strings as-is, others as JSON."""
+        if isinstance(value, str):
+            return value[:255]
+        return json.dumps(value)[:255]
+
+
 # ===========================
 # PRODUCT IMAGE MODEL
 # ===========================
@@ -436,6 +1146,8 @@ class ProductImage(TimestampedModel):
     Product images with support for variant-specific images.
     Can attach images to product (all variants) or specific variant.
     """
+    objects = ProductImageQuerySet.as_manager()
+
     product = models.ForeignKey(
         Product,
         on_delete=models.CASCADE,
@@ -0,0 +1,191 @@
+"""
+Product full-text search backends
+- PostgresSearchBackend: weighted tsvector generated column + GIN index
+- SQLiteSearchBackend: FTS5 virtual table (development/tests)
+- SimpleSearchBackend: icontains fallback for other databases
+
+Every backend filters a Product queryset and annotates `search_rank`
+(higher is more relevant). Weighting is name > brand/sku > description.
+"""
+import re
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections
+from django.db.models import BooleanField, Case, FloatField, Q, QuerySet, Value, When
+from django.db.models.expressions import RawSQL
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+SEARCH_CONFIG = 'english'
+FTS_TABLE = 'shop_product_fts'
+
+
+def tokenize(query):
+    """Split a raw search string into safe word tokens."""
+    return re.findall(r'\w+', query.lower())
+
+
+class BaseSearchBackend:
+    """Interface for product search backends."""
+
+    def search(self, queryset, query):
+        """Return `queryset` filtered to matches and annotated with search_rank."""
+        raise NotImplementedError
+
+    def index_products(self, product_ids, using='default'):
+        """
+        Refresh the search index for the given products - ids or a Product
+        queryset, for bulk writes (if needed).
+        """
+
+    def remove_products(self, product_ids, using='default'):
+        """Drop the given products from the search index (if needed)."""
+
+    def rebuild(self, using='default'):
+        """Rebuild the whole search index (if needed)."""
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    """Portable fallback using icontains scans (no index)."""
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+        for token in tokens:
+            queryset = queryset.filter(
+                Q(name__icontains=token) |
+                Q(brand__icontains=token) |
+                Q(sku__icontains=token) |
+                Q(description__icontains=token)
+            )
+        first = tokens[0]
+        return queryset.annotate(
+            search_rank=Case(
+                When(name__icontains=first, then=Value(3.0)),
+                When(Q(brand__icontains=first) | Q(sku__icontains=first), then=Value(2.0)),
+                default=Value(1.0),
+                output_field=FloatField(),
+            )
+        )
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Uses the `search_vector` generated column created by migration 0004.
+    PostgreSQL keeps it current on every write, so no indexing hooks needed.
+    """
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+        # Prefix match on every token, e.g. "iphone 15" -> "iphone:* & 15:*"
+        tsquery = ' & '.join(f'{token}:*' for token in tokens)
+        params = [SEARCH_CONFIG, tsquery]
+        return queryset.filter(
+            RawSQL(
+                '"shop_product"."search_vector" @@ to_tsquery(%s::regconfig, %s)',
+                params,
+                output_field=BooleanField(),
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                'ts_rank_cd("shop_product"."search_vector", to_tsquery(%s::regconfig, %s))',
+                params,
+                output_field=FloatField(),
+            )
+        )
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    Uses the FTS5 table created by migration 0004, maintained from Product
+    saves/deletes (see signals) and bulk paths via index_products().
+    """
+
+    # bm25 column weights: name, brand, sku, description
+    weights = (10.0, 5.0, 5.0, 1.0)
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        weights = ', '.join(str(weight) for weight in self.weights)
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+        ).annotate(
+            search_rank=RawSQL(
+                f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s AND rowid = "shop_product"."id"',
+                [match],
+                output_field=FloatField(),
+            )
+        )
+
+    def index_products(self, product_ids, using='default'):
+        if isinstance(product_ids, QuerySet):
+            # Selected by a subquery, not one bound variable per id
+            placeholders, params = product_ids.order_by().values('pk').query.get_compiler(using).as_sql()
+        else:
+            params = list(product_ids)
+            if not params:
+                return
+            placeholders = ', '.join(['%s'] * len(params))
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', params)
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, brand, sku, description) '
+                f'SELECT id, name, brand, sku, description FROM shop_product '
+                f'WHERE id IN ({placeholders})',
+                params,
+            )
+
+    def remove_products(self, product_ids, using='default'):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', product_ids)
+
+    def rebuild(self, using='default'):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, brand, sku, description) '
+                f'SELECT id, name, brand, sku, description FROM shop_product'
+            )
+
+
+VENDOR_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+_backends = {}
+
+
+def get_search_backend(using='default'):
+    """
+    Return the search backend for a database alias.
+    settings.PRODUCT_SEARCH_BACKEND (dotted path) overrides vendor detection.
+    """
+    if using not in _backends:
+        backend_path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+        if backend_path:
+            backend_class = import_string(backend_path)
+        else:
+            vendor = connections[using].vendor
+            backend_class = VENDOR_BACKENDS.get(vendor, SimpleSearchBackend)
+        _backends[using] = backend_class()
+    return _backends[using]
+
+
+@receiver(setting_changed)
+def reset_search_backends(setting, **kwargs):
+    """Forget cached backends when the backend setting changes (tests)."""
+    if setting == 'PRODUCT_SEARCH_BACKEND':
+        _backends.clear()
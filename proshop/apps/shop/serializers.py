@@ -2,6 +2,7 @@
 Shop API Serializers
 Professional product serializers with nested relationships and optimization.
 """
+from django.db import models
 from rest_framework import serializers
 from apps.shop.models import Category, Product, ProductVariant, ProductImage
 
@@ -62,13 +63,16 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = [
             'id', 'name', 'slug', 'description', 'icon',
-            'parent', 'is_active', 'ordering', 'product_count',
+            'parent', 'depth', 'is_active', 'ordering', 'product_count',
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'product_count']
+        read_only_fields = ['id', 'depth', 'created_at', 'updated_at', 'product_count']
     
     def get_product_count(self, obj):
-        """Return the count of active products in this category."""
+        """
+        Return the count of active products in this category and its
+        subcategories (uses the with_product_counts() annotation if present).
+        """
         return obj.product_count
 
 
@@ -76,6 +80,18 @@ class CategorySerializer(serializers.ModelSerializer):
 # PRODUCT LIST SERIALIZER
 # ===========================
 
+class ProductListListSerializer(serializers.ListSerializer):
+    """Resolves the category labels of a whole page in one query."""
+
+    def to_representation(self, data):
+        """Attach category ancestors before serializing each product."""
+        products = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        Category.objects.attach_ancestors(
+            product.category for product in products if product.category_id
+        )
+        return super().to_representation(products)
+
+
 class ProductListSerializer(serializers.ModelSerializer):
     """Lightweight serializer for product listing."""
     
@@ -95,10 +111,12 @@ class ProductListSerializer(serializers.ModelSerializer):
             'primary_image', 'created_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
+        # `category` renders the full "Parent → Child" path
+        list_serializer_class = ProductListListSerializer
     
     def get_primary_image(self, obj):
         """Return primary product image URL."""
-        image = obj.get_primary_image()
+        image = obj.primary_image
         if image and image.image:
             request = self.context.get('request')
             if request:
@@ -108,16 +126,16 @@ class ProductListSerializer(serializers.ModelSerializer):
     
     def get_price(self, obj):
         """Return product price (min variant or base)."""
-        price = obj.get_price()
+        price = obj.effective_min_price
         return str(price) if price else None
     
     def get_available_stock(self, obj):
         """Return available stock."""
-        return obj.get_available_stock()
+        return obj.effective_total_stock
     
     def get_is_available(self, obj):
         """Return stock availability."""
-        return obj.is_in_stock()
+        return obj.effective_total_stock > 0
     
     def get_rating_display(self, obj):
         """Return rating with review count."""
@@ -0,0 +1,127 @@
+"""
+Shop signals - keep denormalized Product summary columns, the Category
+materialized paths, the search and facet indexes and the catalog cache
+version in sync
+"""
+from django.db.models import F
+from django.db.models.functions import Substr
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .cache import (
+    collections_changed_by,
+    invalidate_catalog_on_commit,
+    refresh_collections_on_commit,
+)
+from .facets import schedule_facet_update
+from .models import Category, Product, ProductVariant, ProductImage, VariantAttribute
+from .search import get_search_backend
+
+
+def _deleted_with_product(origin):
+    """Return True if the delete cascaded from a Product (nothing to refresh)."""
+    if isinstance(origin, Product):
+        return True
+    return getattr(origin, 'model', None) is Product
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_save, sender=ProductImage)
+def refresh_product_summary_on_save(sender, instance, **kwargs):
+    """Recompute price/stock/primary image after a variant or image changes."""
+    Product.objects.filter(pk=instance.product_id).refresh_summaries()
+    if sender is ProductVariant:
+        schedule_facet_update([instance.product_id])
+
+
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_delete, sender=ProductImage)
+def refresh_product_summary_on_delete(sender, instance, origin=None, **kwargs):
+    """Recompute price/stock/primary image after a variant or image is removed."""
+    if _deleted_with_product(origin):
+        return
+    Product.objects.filter(pk=instance.product_id).refresh_summaries()
+    if sender is ProductVariant:
+        schedule_facet_update([instance.product_id])
+
+
+@receiver(post_save, sender=ProductVariant)
+def sync_variant_attributes(sender, instance, update_fields=None, **kwargs):
+    """Rebuild the variant's rows in the attribute index."""
+    if update_fields is None or 'attributes' in update_fields:
+        VariantAttribute.objects.sync([instance])
+
+
+@receiver(post_delete, sender=Category)
+def reroot_orphaned_subcategories(sender, instance, **kwargs):
+    """
+    Children of a deleted category become top-level (parent is SET_NULL),
+    so strip the deleted node's path prefix from its whole subtree.
+    """
+    if not instance.path:
+        return
+    Category.objects.filter(path__startswith=instance.path).update(
+        path=Substr('path', len(instance.path) + 1),
+        depth=F('depth') - (instance.depth + 1),
+    )
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_catalog_cache(sender, instance, created=False, **kwargs):
+    """
+    Any catalog write invalidates versioned caches, HTTP validators and the
+    cached responses tagged with the affected product or category.
+    """
+    if sender is Category:
+        invalidate_catalog_on_commit(category_ids=[instance.pk])
+        return
+    # Saves report the fields they changed (None: unknown, e.g. inserts and deletes)
+    saved = kwargs['signal'] is post_save and not created
+    if sender is Product:
+        fields = instance.changed_fields() if saved else None
+        invalidate_catalog_on_commit(product_ids=[instance.pk], fields=fields)
+    elif sender is ProductVariant:
+        fields = instance.changed_fields() if saved else None
+        # A variant moved to another product leaves its old product too
+        old_product_id = getattr(instance, '_tracked_values', {}).get('product_id', instance.product_id)
+        invalidate_catalog_on_commit(product_ids={instance.product_id, old_product_id}, fields=fields)
+    else:
+        # Images only change how products are displayed
+        invalidate_catalog_on_commit(product_ids=[instance.product_id], fields=set())
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_collections_on_save(sender, instance, **kwargs):
+    """Refresh featured/bestsellers/new id lists the product joined or left."""
+    refresh_collections_on_commit(collections_changed_by(instance))
+
+
+@receiver(post_delete, sender=Product)
+def refresh_product_collections_on_delete(sender, instance, **kwargs):
+    """Drop a deleted product from the collections listing it."""
+    refresh_collections_on_commit(collections_changed_by(instance, deleted=True))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def refresh_product_facets(sender, instance, **kwargs):
+    """Re-read the product into the facet index (drops it if deleted/inactive)."""
+    schedule_facet_update([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, using, **kwargs):
+    """Refresh the product's full-text search entry."""
+    get_search_backend(using).index_products([instance.pk], using=using)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_search(sender, instance, using, **kwargs):
+    """Drop the product's full-text search entry."""
+    get_search_backend(using).remove_products([instance.pk], using=using)
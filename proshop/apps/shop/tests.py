@@ -1,5 +1,35 @@
-from django.test import TestCase
-from .models import Category, Product
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.db import connection
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from apps.utils.query_budgets import EXEMPT, QUERY_BUDGETS, QueryBudgetTestMixin, unlisted_routes
+from apps.cart.models import Cart, CartItem, StockReservation
+from apps.orders.models import Order
+from apps.reviews.models import Review
+from apps.utils import metrics
+from apps.utils.cache import fetch, get_cache_stats, reset_cache_stats
+from apps.utils.metrics import (
+    ARCHIVE_FILENAME, CACHE_EVENTS, CHECKOUT_SESSIONS, _worker_stem, collect, render_prometheus, snapshot,
+)
+from apps.utils.pagination import KeysetPagination
+from .cache import TAG_VERSION_KEY, get_catalog_version, get_collection_ids, product_tag
+from .models import Category, Product, ProductQuerySet, ProductVariant, ProductImage
+from .facets import FACET_LOCK_KEY, FACET_META_KEY, FacetIndex, get_facet_index
+from .management.commands.benchmark_api import BENCHMARK_EMAIL
 
 
 class ProductTestCase(TestCase):
@@ -18,3 +48,1250 @@ class ProductTestCase(TestCase):
     def test_product_creation(self):
         self.assertEqual(self.product.name, 'Test Product')
         self.assertEqual(self.product.price, 99.99)
+
+
+class ProductSummaryTestCase(TestCase):
+    """Denormalized price/stock/image columns stay in sync with children."""
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            name='Summary Product',
+            description='Test Description',
+            sku='SUM001',
+            base_price=Decimal('50.00'),
+            stock=7,
+        )
+
+    def test_new_product_uses_base_values(self):
+        self.assertEqual(self.product.effective_min_price, Decimal('50.00'))
+        self.assertEqual(self.product.effective_total_stock, 7)
+        self.assertIsNone(self.product.primary_image)
+
+    def test_product_save_refreshes_summary(self):
+        self.product.stock = 9
+        self.product.save()
+        self.assertEqual(self.product.effective_total_stock, 9)
+
+    def test_unrelated_save_skips_summary(self):
+        product = Product.objects.get(pk=self.product.pk)
+        product.name = 'Renamed'
+        with CaptureQueriesContext(connection) as captured:
+            product.save()
+        self.assertFalse([query for query in captured.captured_queries if 'MIN(' in query['sql']])
+
+        product.base_price = Decimal('45.00')
+        product.save()
+        self.assertEqual(product.effective_min_price, Decimal('45.00'))
+
+    def test_variant_writes_refresh_summary(self):
+        variant = ProductVariant.objects.create(
+            product=self.product, sku='SUM001-A', price=Decimal('30.00'), stock=2
+        )
+        ProductVariant.objects.create(
+            product=self.product, sku='SUM001-B', price=Decimal('40.00'), stock=3
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.effective_min_price, Decimal('30.00'))
+        self.assertEqual(self.product.effective_total_stock, 5)
+
+        variant.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.effective_min_price, Decimal('40.00'))
+        self.assertEqual(self.product.effective_total_stock, 3)
+
+    def test_bulk_variant_update_refreshes_summary(self):
+        ProductVariant.objects.bulk_create([
+            ProductVariant(product=self.product, sku='SUM001-A', price=Decimal('30.00'), stock=2),
+            ProductVariant(product=self.product, sku='SUM001-B', price=Decimal('40.00'), stock=3),
+        ])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.effective_total_stock, 5)
+
+        ProductVariant.objects.filter(product=self.product).update(stock=0)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.effective_total_stock, 0)
+
+    @mock.patch.object(ProductQuerySet, 'BULK_UPDATE_THRESHOLD', 0)
+    def test_bulk_product_update_refreshes_summary_without_ids(self):
+        with CaptureQueriesContext(connection) as captured:
+            # Filtered on the written column: the refresh must still find the rows
+            Product.objects.filter(base_price=Decimal('50.00')).update(base_price=Decimal('60.00'))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.effective_min_price, Decimal('60.00'))
+        self.assertFalse([query for query in captured.captured_queries if ' IN (' in query['sql']])
+
+    def test_primary_image_prefers_flagged_image(self):
+        first = ProductImage.objects.create(product=self.product, image='products/a.jpg', ordering=0)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_image, first)
+
+        flagged = ProductImage.objects.create(
+            product=self.product, image='products/b.jpg', ordering=1, is_primary=True
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_image, flagged)
+
+        flagged.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_image, first)
+
+
+class ProductQueryCountTestCase(TestCase):
+    """Catalog endpoints must not issue per-product queries."""
+
+    def _create_products(self, count, offset=0):
+        for index in range(offset, offset + count):
+            product = Product.objects.create(
+                name=f'Product {index}',
+                description='Test Description',
+                sku=f'QC{index:04d}',
+                base_price=Decimal('10.00'),
+            )
+            for suffix in ('A', 'B'):
+                ProductVariant.objects.create(
+                    product=product,
+                    sku=f'QC{index:04d}-{suffix}',
+                    price=Decimal('12.00'),
+                    stock=3,
+                )
+            ProductImage.objects.create(product=product, image=f'products/qc{index}.jpg')
+
+    def _count_list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.json()['count']
+
+    def test_product_list_query_count_is_constant(self):
+        self._create_products(2)
+        small_queries, small_count = self._count_list_queries()
+
+        self._create_products(10, offset=2)
+        large_queries, large_count = self._count_list_queries()
+
+        self.assertEqual((small_count, large_count), (2, 12))
+        self.assertEqual(small_queries, large_queries)
+
+    def test_helpers_use_prefetch_cache(self):
+        self._create_products(3)
+        products = list(Product.objects.prefetch_related('variants', 'images'))
+
+        with self.assertNumQueries(0):
+            for product in products:
+                self.assertEqual(product.get_price(), Decimal('12.00'))
+                self.assertEqual(product.get_available_stock(), 6)
+                self.assertTrue(product.is_in_stock())
+                self.assertIsNotNone(product.get_primary_image())
+
+
+class CategoryTreeTestCase(TestCase):
+    """Materialized path maintenance and subtree queries."""
+
+    def setUp(self):
+        self.root = Category.objects.create(name='Electronics')
+        self.phones = Category.objects.create(name='Phones', parent=self.root)
+        self.android = Category.objects.create(name='Android', parent=self.phones)
+        self.other = Category.objects.create(name='Other')
+        for index, category in enumerate([self.root, self.phones, self.android, self.android]):
+            Product.objects.create(
+                name=f'Tree Product {index}',
+                description='Test Description',
+                sku=f'TREE{index}',
+                category=category,
+            )
+
+    def _reload(self, *categories):
+        for category in categories:
+            category.refresh_from_db()
+
+    def test_paths_follow_parents(self):
+        self.assertEqual(self.root.depth, 0)
+        self.assertEqual(self.android.depth, 2)
+        self.assertTrue(self.android.path.startswith(self.phones.path))
+        self.assertEqual(
+            [crumb.name for crumb in self.android.get_breadcrumbs()],
+            ['Electronics', 'Phones', 'Android'],
+        )
+
+    def test_reparent_moves_subtree(self):
+        self.phones.parent = self.other
+        self.phones.save()
+        self._reload(self.android)
+        self.assertTrue(self.android.path.startswith(self.other.path))
+        self.assertEqual(self.android.depth, 2)
+
+        with self.assertRaises(ValueError):
+            self.phones.parent = self.android
+            self.phones.save()
+
+    def test_delete_reroots_children(self):
+        self.root.delete()
+        self._reload(self.phones, self.android)
+        self.assertEqual(self.phones.depth, 0)
+        self.assertEqual(self.phones.path, Category.build_path('', self.phones.pk))
+        self.assertTrue(self.android.path.startswith(self.phones.path))
+
+    def test_subtree_counts_in_one_query(self):
+        with self.assertNumQueries(1):
+            counts = {
+                category.name: category.product_count
+                for category in Category.objects.with_product_counts()
+            }
+        self.assertEqual(counts, {'Electronics': 4, 'Phones': 3, 'Android': 2, 'Other': 0})
+        self.assertEqual(self.phones.get_descendant_products().count(), 3)
+
+    def test_category_list_query_count_is_constant(self):
+        with CaptureQueriesContext(connection) as small:
+            self.client.get('/api/categories/')
+        for index in range(5):
+            Category.objects.create(name=f'Extra {index}', parent=self.android)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get('/api/categories/')
+        self.assertEqual(response.json()['count'], 9)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shop-tests',
+    }
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CategoryTreeEndpointTestCase(TestCase):
+    """Versioned cache for /api/categories/tree/."""
+
+    def setUp(self):
+        cache.clear()
+        self.root = Category.objects.create(name='Electronics')
+        self.phones = Category.objects.create(name='Phones', parent=self.root)
+        Product.objects.create(
+            name='Phone', description='Test Description', sku='TREE-PHONE', category=self.phones
+        )
+
+    def test_tree_is_nested_with_counts(self):
+        response = self.client.get('/api/categories/tree/')
+        self.assertEqual(response.status_code, 200)
+        [root] = response.json()
+        self.assertEqual(root['name'], 'Electronics')
+        self.assertEqual(root['product_count'], 1)
+        self.assertEqual(root['children'][0]['name'], 'Phones')
+
+    def test_warm_requests_skip_database(self):
+        self.client.get('/api/categories/tree/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/categories/tree/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_writes_bump_version(self):
+        self.client.get('/api/categories/tree/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Laptops', parent=self.root)
+        [root] = self.client.get('/api/categories/tree/').json()
+        self.assertEqual([child['name'] for child in root['children']], ['Laptops', 'Phones'])
+
+
+class ProductSearchTestCase(TestCase):
+    """Ranked full-text search through the configured backend."""
+
+    def setUp(self):
+        self.by_name = Product.objects.create(
+            name='Galaxy Phone', description='An android handset', sku='SRCH1', brand='Samsung'
+        )
+        self.by_description = Product.objects.create(
+            name='Phone Case', description='Fits the Galaxy range', sku='SRCH2', brand='Generic'
+        )
+        Product.objects.create(
+            name='Laptop', description='Portable computer', sku='SRCH3', brand='Dell'
+        )
+
+    def _search(self, query, **params):
+        response = self.client.get('/api/products/', {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [product['name'] for product in response.json()['results']]
+
+    def test_results_are_ranked_by_field_weight(self):
+        self.assertEqual(self._search('galaxy'), ['Galaxy Phone', 'Phone Case'])
+
+    def test_prefix_and_multi_term_matching(self):
+        self.assertEqual(self._search('galax andr'), ['Galaxy Phone'])
+        self.assertEqual(self._search('!!!'), [])
+
+    def test_explicit_ordering_overrides_relevance(self):
+        self.assertEqual(self._search('galaxy', ordering='name'), ['Galaxy Phone', 'Phone Case'])
+        self.assertEqual(self._search('galaxy', ordering='-name'), ['Phone Case', 'Galaxy Phone'])
+
+    def test_index_follows_product_writes(self):
+        self.by_description.description = 'Fits most handsets'
+        self.by_description.save()
+        Product.objects.filter(pk=self.by_name.pk).update(name='Nebula Phone')
+        self.assertEqual(self._search('galaxy'), [])
+        self.assertEqual(self._search('nebula'), ['Nebula Phone'])
+
+        self.by_name.delete()
+        self.assertEqual(self._search('nebula'), [])
+
+    @mock.patch.object(ProductQuerySet, 'BULK_UPDATE_THRESHOLD', 1)
+    def test_bulk_update_reindexes_written_rows(self):
+        Product.objects.filter(name__contains='Phone').update(name='Nebula')
+        self.assertEqual(self._search('nebula'), ['Nebula', 'Nebula'])
+        self.assertEqual(self._search('phone'), [])
+        self.assertEqual(self._search('laptop'), ['Laptop'])
+
+    @override_settings(PRODUCT_SEARCH_BACKEND='apps.shop.search.SimpleSearchBackend')
+    def test_simple_backend_fallback(self):
+        self.assertEqual(self._search('galaxy'), ['Galaxy Phone', 'Phone Case'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductFacetTestCase(TestCase):
+    """Facet counts served from the cached bitmap index."""
+
+    def setUp(self):
+        cache.clear()
+        self.phones = Category.objects.create(name='Phones')
+        self.laptops = Category.objects.create(name='Laptops')
+        self.galaxy = Product.objects.create(
+            name='Galaxy', description='Phone', sku='FCT1', brand='Samsung',
+            category=self.phones, base_price=Decimal('30.00'), stock=5
+        )
+        self.iphone = Product.objects.create(
+            name='iPhone', description='Phone', sku='FCT2', brand='Apple',
+            category=self.phones, base_price=Decimal('700.00'), stock=0
+        )
+        self.macbook = Product.objects.create(
+            name='MacBook', description='Laptop', sku='FCT3', brand='Apple',
+            category=self.laptops, base_price=Decimal('1500.00'), stock=2
+        )
+        ProductVariant.objects.create(
+            product=self.galaxy, sku='FCT1-XL', price=Decimal('30.00'), stock=5,
+            attributes={'color': 'black'}
+        )
+
+    def facet(self, data, name):
+        return {entry['value']: entry['count'] for entry in data['facets'][name]}
+
+    def test_counts_and_results(self):
+        data = self.client.get('/api/products/facets/').json()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(self.facet(data, 'brand'), {'Apple': 2, 'Samsung': 1})
+        self.assertEqual(self.facet(data, 'price'), {'25-50': 1, '500-1000': 1, '1000+': 1})
+        self.assertEqual(self.facet(data, 'attr.color'), {'black': 1})
+
+    def test_selected_facet_keeps_its_alternatives(self):
+        data = self.client.get('/api/products/facets/', {'brand': 'Apple'}).json()
+        self.assertEqual({item['sku'] for item in data['results']}, {'FCT2', 'FCT3'})
+        # Brand counts ignore the brand selection, other facets respect it
+        self.assertEqual(self.facet(data, 'brand'), {'Apple': 2, 'Samsung': 1})
+        self.assertEqual(self.facet(data, 'category'), {str(self.phones.pk): 1, str(self.laptops.pk): 1})
+
+    def test_repeated_values_or_and_facets_and(self):
+        data = self.client.get(
+            '/api/products/facets/',
+            {'brand': ['Apple', 'Samsung'], 'category': self.phones.pk, 'in_stock': 'true'},
+        ).json()
+        self.assertEqual([item['sku'] for item in data['results']], ['FCT1'])
+
+    def test_search_narrows_counts(self):
+        data = self.client.get('/api/products/facets/', {'search': 'laptop'}).json()
+        self.assertEqual(self.facet(data, 'brand'), {'Apple': 1})
+
+    def test_writes_update_index(self):
+        self.client.get('/api/products/facets/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.iphone.pk).update(brand='Google')
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.filter(product=self.galaxy).update(attributes={'color': 'blue'})
+        data = self.client.get('/api/products/facets/').json()
+        self.assertEqual(self.facet(data, 'brand'), {'Apple': 1, 'Google': 1, 'Samsung': 1})
+        self.assertEqual(self.facet(data, 'attr.color'), {'blue': 1})
+
+    @mock.patch.object(ProductQuerySet, 'BULK_UPDATE_THRESHOLD', 1)
+    def test_bulk_writes_rebuild_index(self):
+        self.client.get('/api/products/facets/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(brand='Apple').update(brand='Google')
+        data = self.client.get('/api/products/facets/').json()
+        self.assertEqual(self.facet(data, 'brand'), {'Google': 2, 'Samsung': 1})
+
+    def test_contended_updates_are_queued(self):
+        self.client.get('/api/products/facets/')
+        cache.add(FACET_LOCK_KEY, 1)    # Another worker is applying updates
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.iphone.pk).update(brand='Google')
+        self.assertIsNotNone(cache.get(FACET_META_KEY))
+        cache.delete(FACET_LOCK_KEY)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.galaxy.pk).update(brand='Nokia')
+        data = self.client.get('/api/products/facets/').json()
+        self.assertEqual(self.facet(data, 'brand'), {'Apple': 1, 'Google': 1, 'Nokia': 1})
+
+    def test_update_during_build_is_kept(self):
+        build = FacetIndex.build.__func__
+
+        def build_then_update(cls):
+            index = build(cls)
+            with self.captureOnCommitCallbacks(execute=True):
+                Product.objects.filter(pk=self.iphone.pk).update(brand='Google')
+            return index
+
+        with mock.patch.object(FacetIndex, 'build', classmethod(build_then_update)):
+            self.client.get('/api/products/facets/')
+        data = self.client.get('/api/products/facets/').json()
+        self.assertEqual(self.facet(data, 'brand'), {'Apple': 1, 'Google': 1, 'Samsung': 1})
+
+    def test_price_bounds_narrow_counts(self):
+        data = self.client.get('/api/products/facets/', {'min_price': '30', 'max_price': '700'}).json()
+        self.assertEqual(self.facet(data, 'brand'), {'Apple': 1, 'Samsung': 1})
+        data = self.client.get('/api/products/facets/', {'min_price': '20'}).json()
+        self.assertEqual(self.facet(data, 'price'), {'25-50': 1, '500-1000': 1, '1000+': 1})
+        data = self.client.get('/api/products/facets/', {'max_price': '29.99'}).json()
+        self.assertEqual(data['count'], 0)
+
+    def test_writes_that_keep_facet_values_store_nothing(self):
+        self.client.get('/api/products/facets/')
+        meta = cache.get(FACET_META_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.filter(product=self.galaxy).update(stock=4)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.galaxy.pk).update(brand='Nokia')
+        new_meta = cache.get(FACET_META_KEY)
+        self.assertEqual(meta['universe'], new_meta['universe'])
+        self.assertEqual(
+            {facet for facet in meta['facets'] if meta['facets'][facet] != new_meta['facets'].get(facet)}, {'brand'}
+        )
+
+    def test_offsets_are_dense(self):
+        Product.objects.create(
+            pk=10 ** 6, name='ThinkPad', description='Laptop', sku='FCT5', brand='Lenovo',
+            category=self.laptops, base_price=Decimal('900.00'), stock=1
+        )
+        cache.clear()
+        index = get_facet_index()
+        self.assertLess(index.universe.bit_length(), 8)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                name='Pixel', description='Phone', sku='FCT4', brand='Google', category=self.phones,
+                base_price=Decimal('400.00'), stock=1
+            )
+        data = self.client.get('/api/products/facets/').json()
+        self.assertEqual(self.facet(data, 'brand'), {'Apple': 2, 'Google': 1, 'Lenovo': 1, 'Samsung': 1})
+        self.assertLess(get_facet_index().universe.bit_length(), 8)
+
+    def test_deactivated_products_leave_index(self):
+        self.client.get('/api/products/facets/')
+        self.macbook.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.macbook.save()
+        data = self.client.get('/api/products/facets/').json()
+        self.assertEqual(self.facet(data, 'brand'), {'Apple': 1, 'Samsung': 1})
+
+
+class VariantAttributeFilterTestCase(TestCase):
+    """?attr.<key>= filtering through the VariantAttribute index."""
+
+    def setUp(self):
+        self.shirt = Product.objects.create(name='Shirt', description='Cotton', sku='ATTR1')
+        self.hoodie = Product.objects.create(name='Hoodie', description='Fleece', sku='ATTR2')
+        self.red_xl = ProductVariant.objects.create(
+            product=self.shirt, sku='ATTR1-RXL', price=Decimal('20.00'),
+            attributes={'size': 'XL', 'color': 'Red'}
+        )
+        ProductVariant.objects.create(
+            product=self.hoodie, sku='ATTR2-RM', price=Decimal('40.00'),
+            attributes={'size': 'M', 'color': 'Red'}
+        )
+        ProductVariant.objects.create(
+            product=self.hoodie, sku='ATTR2-BXL', price=Decimal('40.00'),
+            attributes={'size': 'XL', 'color': 'Blue', 'hooded': True}
+        )
+
+    def skus(self, url, params):
+        return sorted(item['sku'] for item in self.client.get(url, params).json()['results'])
+
+    def test_index_follows_variant_attributes(self):
+        self.assertEqual(
+            set(self.red_xl.attribute_values.values_list('key', 'value')),
+            {('size', 'XL'), ('color', 'Red')},
+        )
+        self.red_xl.attributes = {'size': 'L'}
+        self.red_xl.save()
+        self.assertEqual(list(self.red_xl.attribute_values.values_list('key', 'value')), [('size', 'L')])
+
+    def test_stock_save_keeps_attribute_rows(self):
+        variant = ProductVariant.objects.get(pk=self.red_xl.pk)
+        rows = set(variant.attribute_values.values_list('pk', flat=True))
+        variant.stock = 3
+        variant.save()
+        self.assertEqual(set(variant.attribute_values.values_list('pk', flat=True)), rows)
+
+        variant.attributes['size'] = 'S'    # Changed in place
+        variant.save()
+        self.assertEqual(dict(variant.attribute_values.values_list('key', 'value')), {'size': 'S', 'color': 'Red'})
+        ProductVariant.objects.filter(pk=self.red_xl.pk).update(attributes={'size': 'S'})
+        self.assertEqual(list(self.red_xl.attribute_values.values_list('value', flat=True)), ['S'])
+
+    def test_product_needs_single_variant_matching_all(self):
+        params = {'attr.size': 'XL', 'attr.color': 'Red'}
+        self.assertEqual(self.skus('/api/products/', params), ['ATTR1'])
+
+    def test_repeated_values_are_ored(self):
+        params = {'attr.color': ['Red', 'Blue'], 'attr.size': 'XL'}
+        self.assertEqual(self.skus('/api/products/', params), ['ATTR1', 'ATTR2'])
+
+    def test_variant_endpoint_and_non_string_values(self):
+        self.assertEqual(self.skus('/api/variants/', {'attr.size': 'XL'}), ['ATTR1-RXL', 'ATTR2-BXL'])
+        self.assertEqual(self.skus('/api/variants/', {'attr.hooded': 'true'}), ['ATTR2-BXL'])
+
+
+class KeysetPaginationTestCase(TestCase):
+    """Cursor pagination over product listings."""
+
+    def setUp(self):
+        for i, price in enumerate(['10.00', '20.00', '20.00', '20.00', '30.00']):
+            Product.objects.create(
+                name=f'Item {i}', description='Test', sku=f'PAGE{i}', base_price=Decimal(price)
+            )
+
+    def walk(self, url, params, link='next'):
+        pages = []
+        response = self.client.get(url, params).json()
+        pages.append(response)
+        while response[link]:
+            response = self.client.get(response[link]).json()
+            pages.append(response)
+        return pages
+
+    def test_cursor_walk_with_ties_is_stable(self):
+        pages = self.walk('/api/products/', {'ordering': 'base_price', 'page_size': 2})
+        skus = [item['sku'] for page in pages for item in page['results']]
+        self.assertEqual(skus, ['PAGE0', 'PAGE1', 'PAGE2', 'PAGE3', 'PAGE4'])
+        self.assertEqual([page['count'] for page in pages], [5, 5, 5])
+
+    def test_previous_links_walk_back(self):
+        last = self.walk('/api/products/', {'ordering': '-base_price', 'page_size': 2})[-1]
+        pages = [last] + self.walk(last['previous'], {}, link='previous')
+        skus = [item['sku'] for page in reversed(pages) for item in page['results']]
+        self.assertEqual(skus, ['PAGE4', 'PAGE3', 'PAGE2', 'PAGE1', 'PAGE0'])
+
+    def test_count_opt_out_and_legacy_pages(self):
+        data = self.client.get('/api/products/', {'count': 'false'}).json()
+        self.assertNotIn('count', data)
+        data = self.client.get('/api/products/', {'page': 2, 'page_size': 2}).json()
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(len(data['results']), 2)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/products/', {'cursor': 'bogus'}).status_code, 404)
+
+    def walk_nullable(self, url, link='next', ordering='-effective_min_price'):
+        """
+        Follow `link` through Products in `ordering`; returns the pages as
+        (skus, previous link).
+        """
+        queryset = Product.objects.order_by(ordering)
+        pages = []
+        while url:
+            paginator = KeysetPagination()
+            page = paginator.paginate_queryset(queryset, Request(APIRequestFactory().get(url)))
+            pages.append(([product.sku for product in page], paginator.get_previous_link()))
+            url = paginator.get_next_link() if link == 'next' else paginator.get_previous_link()
+        return pages
+
+    def test_nulls_sort_last(self):
+        Product.objects.filter(sku__in=['PAGE1', 'PAGE3']).update(effective_min_price=None)
+        pages = self.walk_nullable('/api/products/?page_size=2')
+        self.assertEqual(sum((skus for skus, _ in pages), []), ['PAGE4', 'PAGE2', 'PAGE0', 'PAGE3', 'PAGE1'])
+
+    def test_previous_links_over_nulls(self):
+        # Ascending keys are where the database default (NULLs first on
+        # some backends) would disagree with the cursor conditions
+        Product.objects.filter(sku__in=['PAGE1', 'PAGE3', 'PAGE4']).update(effective_min_price=None)
+        pages = self.walk_nullable('/api/products/?page_size=2', ordering='effective_min_price')
+        self.assertEqual([skus for skus, _ in pages], [['PAGE0', 'PAGE2'], ['PAGE1', 'PAGE3'], ['PAGE4']])
+        back = self.walk_nullable(pages[-1][1], link='previous', ordering='effective_min_price')
+        self.assertEqual([skus for skus, _ in back], [['PAGE1', 'PAGE3'], ['PAGE0', 'PAGE2']])
+
+
+class ProductPriceFilterTestCase(TestCase):
+    """Price/stock filters and price ordering use the effective columns."""
+
+    def setUp(self):
+        self.cheap_variant = Product.objects.create(
+            name='Cheap variant', description='Test', sku='EFF1', base_price=Decimal('100.00'), stock=0
+        )
+        ProductVariant.objects.create(
+            product=self.cheap_variant, sku='EFF1-A', price=Decimal('15.00'), stock=3
+        )
+        ProductVariant.objects.create(
+            product=self.cheap_variant, sku='EFF1-B', price=Decimal('120.00'), stock=0
+        )
+        Product.objects.create(
+            name='Plain', description='Test', sku='EFF2', base_price=Decimal('50.00'), stock=0
+        )
+
+    def skus(self, params):
+        return [item['sku'] for item in self.client.get('/api/products/', params).json()['results']]
+
+    def test_ordering_price_uses_cheapest_variant(self):
+        self.assertEqual(self.skus({'ordering': 'price'}), ['EFF1', 'EFF2'])
+        self.assertEqual(self.skus({'ordering': '-price'}), ['EFF2', 'EFF1'])
+
+    def test_price_range_and_stock(self):
+        self.assertEqual(self.skus({'max_price': '20'}), ['EFF1'])
+        self.assertEqual(self.skus({'min_price': '40'}), ['EFF2'])
+        self.assertEqual(self.skus({'in_stock': 'true'}), ['EFF1'])
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_list_query_has_no_join_or_distinct(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/products/', {'min_price': '10', 'in_stock': 'true', 'ordering': 'price'})
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('DISTINCT', sql)
+        self.assertNotIn('shop_productvariant', sql)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogConditionalGetTestCase(TestCase):
+    """ETag / Last-Modified on catalog endpoints."""
+
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name='Lamp', description='Test', sku='ETAG1')
+        self.variant = ProductVariant.objects.create(
+            product=self.product, sku='ETAG1-A', price=Decimal('10.00')
+        )
+
+    def assertRevalidates(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        return etag
+
+    def test_catalog_endpoints_return_304(self):
+        for url in [
+            '/api/products/',
+            f'/api/products/{self.product.pk}/',
+            f'/api/products/{self.product.pk}/variants/',
+            f'/api/products/{self.product.pk}/images/',
+            '/api/categories/',
+            '/api/categories/tree/',
+        ]:
+            with self.subTest(url=url):
+                self.assertRevalidates(url)
+
+    def test_variant_write_changes_etag(self):
+        url = f'/api/products/{self.product.pk}/'
+        etag = self.assertRevalidates(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.filter(pk=self.variant.pk).update(price=Decimal('12.00'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_stock_write_keeps_category_validators(self):
+        product_url = f'/api/products/{self.product.pk}/'
+        product_etag = self.assertRevalidates(product_url)
+        tree_etag = self.assertRevalidates('/api/categories/tree/')
+        catalog_version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.filter(pk=self.variant.pk).update(reserved=0, stock=3)
+        self.assertEqual(get_catalog_version(), catalog_version)
+        self.assertEqual(self.client.get(product_url, HTTP_IF_NONE_MATCH=product_etag).status_code, 200)
+        self.assertEqual(self.client.get('/api/categories/tree/', HTTP_IF_NONE_MATCH=tree_etag).status_code, 304)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_database_fallback_without_cache(self):
+        etag = self.client.get('/api/products/')['ETag']
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Product.objects.create(name='Desk', description='Test', sku='ETAG2')
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductResponseCacheTestCase(TestCase):
+    """Tagged response cache for anonymous product endpoints."""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Audio')
+        self.speaker = Product.objects.create(
+            name='Speaker', description='Test', sku='RC1', category=self.category
+        )
+        self.headset = Product.objects.create(name='Headset', description='Test', sku='RC2')
+
+    def assertCached(self, url, params=None, hit=True):
+        response = self.client.get(url, params or {})
+        self.assertEqual(response['X-Cache'], 'HIT' if hit else 'MISS')
+        return response
+
+    def test_repeat_requests_are_served_from_cache(self):
+        self.assertCached('/api/products/', hit=False)
+        with self.assertNumQueries(0):
+            self.assertCached('/api/products/')
+        # Defaults and parameter order are normalized away
+        self.assertCached('/api/products/', {'ordering': '-created_at', 'count': 'true'})
+
+    def test_product_write_invalidates_only_its_tags(self):
+        speaker_url = f'/api/products/{self.speaker.pk}/'
+        headset_url = f'/api/products/{self.headset.pk}/'
+        for url in ['/api/products/', speaker_url, headset_url]:
+            self.assertCached(url, hit=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.create(product=self.speaker, sku='RC1-A', price=Decimal('5.00'))
+        self.assertCached('/api/products/', hit=False)
+        response = self.assertCached(speaker_url, hit=False)
+        self.assertEqual(len(response.json()['variants']), 1)
+        self.assertCached(headset_url)
+
+    def test_stock_write_keeps_unrelated_lists(self):
+        category_list = {'category': self.category.pk}
+        for params in [None, category_list, {'in_stock': 'true'}]:
+            self.assertCached('/api/products/', params, hit=False)
+        self.headset.stock = 5
+        with self.captureOnCommitCallbacks(execute=True):
+            self.headset.save()
+        self.assertCached('/api/products/', category_list)
+        self.assertCached('/api/products/', hit=False)
+        response = self.assertCached('/api/products/', {'in_stock': 'true'}, hit=False)
+        self.assertEqual([item['sku'] for item in response.json()['results']], ['RC2'])
+
+    @mock.patch.object(ProductQuerySet, 'BULK_UPDATE_THRESHOLD', 1)
+    def test_bulk_write_invalidates_through_bulk_tag(self):
+        speaker_url = f'/api/products/{self.speaker.pk}/'
+        for url in ['/api/products/', speaker_url]:
+            self.assertCached(url, hit=False)
+        speaker_version = cache.get(TAG_VERSION_KEY.format(tag=product_tag(self.speaker.pk)))
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.update(brand='Acme')
+        # No tag per written product
+        self.assertEqual(cache.get(TAG_VERSION_KEY.format(tag=product_tag(self.speaker.pk))), speaker_version)
+        self.assertCached('/api/products/', hit=False)
+        response = self.assertCached(speaker_url, hit=False)
+        self.assertEqual(response.json()['brand'], 'Acme')
+
+    def test_category_write_invalidates_embedding_responses(self):
+        self.assertCached('/api/products/', hit=False)
+        self.category.name = 'Hi-Fi'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        response = self.assertCached('/api/products/', hit=False)
+        self.assertIn('Hi-Fi', [item['category'] for item in response.json()['results']])
+
+    def test_authenticated_requests_bypass_cache(self):
+        user = get_user_model().objects.create_user(email='shopper@example.com', password='secret123')
+        self.client.force_login(user)
+        self.client.get('/api/products/')
+        self.assertFalse(self.client.get('/api/products/').has_header('X-Cache'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CacheStampedeTestCase(TestCase):
+    """Single-flight, stale-while-revalidate and early expiry in fetch()."""
+
+    def setUp(self):
+        cache.clear()
+        reset_cache_stats()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_outdated_entry_served_stale_while_locked(self):
+        self.assertEqual(fetch('hot', self.compute, 60, version=1, name='t'), 1)
+        self.assertEqual(fetch('hot', self.compute, 60, version=1, name='t'), 1)
+        cache.add('hot:lock', 'other-worker', 10)
+        self.assertEqual(fetch('hot', self.compute, 60, version=2, name='t'), 1)
+        cache.delete('hot:lock')
+        self.assertEqual(fetch('hot', self.compute, 60, version=2, name='t'), 2)
+        self.assertEqual(get_cache_stats(), {'t.miss': 2, 't.hit': 1, 't.stale': 1})
+
+    def test_early_expiration_recomputes_before_expiry(self):
+        fetch('hot', self.compute, 60, name='t')
+        entry = cache.get('hot')
+        entry['delta'] = 1000  # Very expensive value: refresh early...
+        cache.set('hot', entry, 60)
+        # ...unless the draw is close to 0, so pin it
+        with mock.patch('apps.utils.cache.random.random', return_value=0.5):
+            self.assertEqual(fetch('hot', self.compute, 60, name='t'), 2)
+
+    def test_waits_for_lock_holder_on_cold_miss(self):
+        cache.add('cold:lock', 'other-worker', 10)
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(fetch('cold', self.compute, 60, name='t')))
+        waiter.start()
+        cache.set('cold', {'value': 'theirs', 'version': None, 'expires': 0, 'delta': 0}, 60)
+        waiter.join(5)
+        self.assertEqual(results, ['theirs'])
+        self.assertEqual(self.calls, 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductCollectionTestCase(TestCase):
+    """Featured/bestsellers/new served from precomputed id lists."""
+
+    def setUp(self):
+        cache.clear()
+        self.products = [
+            Product.objects.create(
+                name=f'Collection {i}', description='Test', sku=f'COL{i}', is_featured=True
+            )
+            for i in range(3)
+        ]
+
+    def featured_skus(self):
+        return [item['sku'] for item in self.client.get('/api/products/featured/').json()['results']]
+
+    def test_newest_first_and_hydrated_by_id(self):
+        self.assertEqual(self.featured_skus(), ['COL2', 'COL1', 'COL0'])
+        self.assertEqual(
+            list(Product.objects.featured().values_list('sku', flat=True)), ['COL2', 'COL1', 'COL0']
+        )
+
+    def test_queryset_matches_id_list(self):
+        Product.objects.filter(pk=self.products[1].pk).update(is_active=False)
+        featured = Product.objects.featured()
+        self.assertEqual(list(featured.values_list('pk', flat=True)), get_collection_ids('featured'))
+        self.assertEqual(list(Product.objects.all().featured()), list(featured))
+        # Filtered on the flag columns, not on a bind variable per id
+        self.assertNotIn(' IN (', str(featured.query))
+
+    def test_admin_bulk_action_refreshes_list(self):
+        admin = get_user_model().objects.create_superuser(email='admin@example.com', password='secret123')
+        self.featured_skus()
+        self.client.force_login(admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/admin/shop/product/', {
+                'action': 'unmark_featured',
+                '_selected_action': [self.products[1].pk],
+            })
+        self.client.logout()
+        self.assertEqual(self.featured_skus(), ['COL2', 'COL0'])
+
+    def test_save_refreshes_only_when_membership_changes(self):
+        self.featured_skus()
+        product = self.products[0]
+        product.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(self.featured_skus(), ['COL2', 'COL1'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Late', description='Test', sku='COL9', is_featured=True)
+        self.assertEqual(self.featured_skus(), ['COL9', 'COL2', 'COL1'])
+
+
+class CatalogImportTestCase(TestCase):
+    """import_catalog upserts by SKU in batches and resumes from checkpoints."""
+
+    HEADER = 'sku,name,base_price,stock,category,parent_category,variant_sku,variant_price,attributes\n'
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_feed(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as feed:
+            feed.write(content)
+        return path
+
+    def run_import(self, path, **options):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_catalog', path, stdout=StringIO(), **options)
+
+    def test_creates_catalog_and_category_tree(self):
+        path = self.write_feed('feed.csv', self.HEADER + (
+            'IMP1,Shirt,20.00,3,shirts,clothing,IMP1-S,18.00,"{""size"": ""S""}"\n'
+            'IMP1,Shirt,20.00,3,shirts,clothing,IMP1-M,22.00,"{""size"": ""M""}"\n'
+            'IMP2,Scarf,15.00,0,clothing,,,,\n'
+        ))
+        self.run_import(path, batch_size=2)
+
+        shirts = Category.objects.get(slug='shirts')
+        self.assertEqual(shirts.parent.slug, 'clothing')
+        self.assertEqual(shirts.depth, 1)
+        product = Product.objects.get(sku='IMP1')
+        self.assertEqual(product.category, shirts)
+        self.assertEqual(product.effective_min_price, Decimal('18.00'))
+        self.assertEqual(product.variants.count(), 2)
+        self.assertEqual(
+            list(Product.objects.all().with_variant_attributes({'size': ['M']}).values_list('sku', flat=True)),
+            ['IMP1']
+        )
+
+    def test_partial_feed_updates_only_given_columns(self):
+        Product.objects.create(
+            name='Existing', description='Keep me', sku='IMP9', base_price=Decimal('10.00'), stock=1
+        )
+        path = self.write_feed('prices.jsonl', '{"sku": "IMP9", "base_price": "12.50"}\n')
+        self.run_import(path)
+
+        product = Product.objects.get(sku='IMP9')
+        self.assertEqual(product.base_price, Decimal('12.50'))
+        self.assertEqual(product.effective_min_price, Decimal('12.50'))
+        self.assertEqual((product.name, product.description, product.stock), ('Existing', 'Keep me', 1))
+
+    def test_unpriced_variants_and_long_names(self):
+        long_name = 'Very Long Product Name ' * 20
+        path = self.write_feed('feed.jsonl', ''.join(
+            f'{{"sku": "{sku}", "name": "{long_name}", "base_price": "20.00", "variant_sku": "{sku}-V"}}\n'
+            for sku in ('LONG1', 'LONG2')
+        ))
+        self.run_import(path)
+        products = Product.objects.filter(sku__startswith='LONG').order_by('sku')
+        self.assertEqual([product.slug.rsplit('-', 1)[1] for product in products], ['long1', 'long2'])
+        self.assertEqual(
+            list(ProductVariant.objects.order_by('sku').values_list('price', flat=True)),
+            [Decimal('20.00'), Decimal('20.00')]
+        )
+
+        # Existing variants keep their price when a batch upserts the column
+        ProductVariant.objects.filter(sku='LONG1-V').update(price=Decimal('25.00'))
+        self.write_feed('feed.jsonl', (
+            '{"sku": "LONG1", "variant_sku": "LONG1-V"}\n'
+            '{"sku": "LONG2", "variant_sku": "LONG2-V", "variant_price": "19.00"}\n'
+        ))
+        self.run_import(path)
+        self.assertEqual(
+            list(ProductVariant.objects.order_by('sku').values_list('price', flat=True)),
+            [Decimal('25.00'), Decimal('19.00')]
+        )
+
+    def test_failed_batch_resumes_from_checkpoint(self):
+        rows = [f'IMP{i},Item {i},10.00,1,,,,,\n' for i in range(4)]
+        path = self.write_feed('feed.csv', self.HEADER + ''.join(rows[:2]) + 'IMP2,Broken,abc,1,,,,,\n')
+        with self.assertRaisesMessage(CommandError, '--resume'):
+            self.run_import(path, batch_size=2)
+        self.assertEqual(Product.objects.filter(sku__startswith='IMP').count(), 2)
+
+        self.write_feed('feed.csv', self.HEADER + ''.join(rows))
+        with CaptureQueriesContext(connection) as queries:
+            self.run_import(path, batch_size=2, resume=True)
+        self.assertFalse(any("'IMP0'" in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(Product.objects.filter(sku__startswith='IMP').count(), 4)
+
+
+class ProductExportTestCase(TestCase):
+    """Staff-only streaming catalog export that round-trips through import_catalog."""
+
+    def setUp(self):
+        self.admin = get_user_model().objects.create_superuser(email='admin@example.com', password='secret123')
+        parent = Category.objects.create(name='Clothing', slug='clothing')
+        category = Category.objects.create(name='Shirts', slug='shirts', parent=parent)
+        self.product = Product.objects.create(
+            name='Shirt', description='Test', sku='EXP1', category=category, base_price=Decimal('20.00')
+        )
+        ProductVariant.objects.create(product=self.product, sku='EXP1-S', price=Decimal('18.00'), attributes={'size': 'S'})
+        ProductVariant.objects.create(product=self.product, sku='EXP1-M', price=Decimal('22.00'), attributes={'size': 'M'})
+        Product.objects.create(name='Hidden', description='Test', sku='EXP2', is_active=False)
+
+    def export(self, **params):
+        self.client.force_login(self.admin)
+        response = self.client.get('/api/products/export/', params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_anonymous_is_rejected(self):
+        self.assertIn(self.client.get('/api/products/export/').status_code, (401, 403))
+
+    def test_csv_rows_per_variant_and_reimport(self):
+        content = self.export()
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(
+            [(row['sku'], row['variant_sku'], row['parent_category']) for row in rows],
+            [('EXP1', 'EXP1-M', 'clothing'), ('EXP1', 'EXP1-S', 'clothing'), ('EXP2', '', '')]
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'products.csv')
+            with open(path, 'w') as feed:
+                feed.write(content.replace('18.00', '17.00'))
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('import_catalog', path, stdout=io.StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.effective_min_price, Decimal('17.00'))
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_ndjson_filtered_in_constant_queries(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/api/products/export/', {'format': 'ndjson', 'is_active': 'true'})
+        with self.assertNumQueries(2):
+            records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([record['sku'] for record in records], ['EXP1'])
+        self.assertEqual([variant['sku'] for variant in records[0]['variants']], ['EXP1-M', 'EXP1-S'])
+
+
+
+class GenerateLoadDataTestCase(TestCase):
+    """generate_load_data builds a seeded, reproducible dataset."""
+
+    def generate(self, *args):
+        call_command(
+            'generate_load_data', '--products', '30', '--variants-per-product', '2', '--users', '5',
+            '--orders', '12', '--reviews', '15', '--seed', '7', *args, stdout=StringIO()
+        )
+        return list(Product.objects.order_by('sku').values_list('sku', 'base_price', 'brand', 'category__slug'))
+
+    def test_dataset_shape(self):
+        self.generate()
+        self.assertEqual(Product.objects.count(), 30)
+        self.assertEqual(ProductVariant.objects.count(), 60)
+        self.assertEqual(ProductImage.objects.count(), 60)
+        self.assertFalse(Product.objects.filter(category__depth__lt=2).exists())
+        self.assertEqual(Review.objects.count(), 15)
+        self.assertTrue(0 < Order.objects.count() <= 12)
+        for order in Order.objects.prefetch_related('items'):
+            self.assertEqual(order.subtotal, sum(item.get_total_price() for item in order.items.all()))
+        # Summary columns and the attribute index are maintained by the bulk inserts
+        product = Product.objects.filter(variants__isnull=False).first()
+        self.assertEqual(product.effective_min_price, min(v.price for v in product.variants.all()))
+        self.assertTrue(product.variants.first().attribute_values.exists())
+
+    def test_same_seed_same_data(self):
+        first = self.generate()
+        with self.assertRaisesMessage(CommandError, '--clear'):
+            self.generate()
+        self.assertEqual(self.generate('--clear'), first)
+
+
+class BenchmarkApiTestCase(TestCase):
+    """benchmark_api drives the endpoints and writes comparable JSON results."""
+
+    def test_runs_scenarios_and_compares(self):
+        call_command(
+            'generate_load_data', '--products', '20', '--users', '3', '--orders', '10', '--reviews', '5',
+            stdout=StringIO()
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            options = {'requests': 3, 'warmup': 1, 'stdout': StringIO(), 'i_know': True}
+            scenarios = ['--scenario', 'product_list', '--scenario', 'product_detail',
+                         '--scenario', 'cart_add', '--scenario', 'checkout', '--scenario', 'order_list']
+            call_command('benchmark_api', *scenarios, output=path, **options)
+            with open(path) as handle:
+                report = json.load(handle)
+
+            out = StringIO()
+            call_command('benchmark_api', *scenarios, compare=path, **dict(options, stdout=out))
+
+        self.assertEqual(
+            set(report['results']), {'product_list', 'product_detail', 'cart_add', 'checkout', 'order_list'}
+        )
+        for result in report['results'].values():
+            self.assertEqual(result['errors'], 0)
+            self.assertGreater(result['queries_mean'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertIn('Compared with', out.getvalue())
+
+    def test_writes_only_to_its_own_account(self):
+        call_command(
+            'generate_load_data', '--products', '10', '--users', '2', '--orders', '4', '--reviews', '0',
+            stdout=StringIO()
+        )
+        with self.assertRaisesMessage(CommandError, '--i-know'):
+            call_command('benchmark_api', requests=1, warmup=0, stdout=StringIO())
+
+        variant = ProductVariant.objects.filter(stock__gte=10).first()
+        for user in get_user_model().objects.filter(is_staff=False):
+            cart = Cart.objects.get_or_create_for_user(user)
+            CartItem.objects.create(cart=cart, variant=variant, quantity=2, price_at_add=variant.price)
+        customer_items = set(CartItem.objects.values_list('pk', 'cart_id', 'quantity'))
+        call_command(
+            'benchmark_api', '--scenario', 'cart_add', '--scenario', 'checkout',
+            requests=2, warmup=0, i_know=True, stdout=StringIO()
+        )
+        self.assertEqual(
+            set(CartItem.objects.exclude(cart__user__email=BENCHMARK_EMAIL).values_list('pk', 'cart_id', 'quantity')),
+            customer_items
+        )
+        self.assertFalse(CartItem.objects.filter(cart__user__email=BENCHMARK_EMAIL).exists())
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertFalse(ProductVariant.objects.filter(reserved__gt=0).exists())
+
+
+class CatalogQueryBudgetTestCase(QueryBudgetTestMixin, TestCase):
+    """Catalog endpoints stay within apps.utils.query_budgets."""
+
+    def setUp(self):
+        self.root = Category.objects.create(name='Budget Root')
+        self.middle = Category.objects.create(name='Budget Middle', parent=self.root)
+        self.leaf = Category.objects.create(name='Budget Leaf', parent=self.middle)
+        self.product = self.add_products(2)[0]
+        self.variant = self.product.variants.first()
+
+    def add_products(self, count):
+        """Products in fresh nested categories, each with variants and an image."""
+        start = Product.objects.count()
+        products = []
+        for index in range(start, start + count):
+            category = Category.objects.create(name=f'Budget {index}', parent=self.leaf)
+            product = Product.objects.create(
+                name=f'Budget Product {index}',
+                description='Test Description',
+                sku=f'QB{index:04d}',
+                category=category,
+                base_price=Decimal('10.00'),
+                is_featured=True,
+                is_bestseller=True,
+                is_new=True,
+            )
+            for suffix in ('A', 'B'):
+                variant = ProductVariant.objects.create(
+                    product=product,
+                    sku=f'QB{index:04d}-{suffix}',
+                    price=Decimal('12.00'),
+                    stock=3,
+                    attributes={'size': suffix},
+                )
+                ProductImage.objects.create(product=product, variant=variant, image=f'products/qb{index}{suffix}.jpg')
+            ProductImage.objects.create(product=product, image=f'products/qb{index}.jpg')
+            products.append(product)
+        return products
+
+    def grow(self):
+        self.add_products(3)
+
+    def test_registry_covers_every_route(self):
+        self.assertEqual(unlisted_routes(), [])
+        self.assertFalse(set(QUERY_BUDGETS) & set(EXEMPT))
+
+    def test_product_endpoints(self):
+        self.assertWithinQueryBudget('get', '/api/', status=200)
+        for path in ('/api/products/', '/api/products/featured/', '/api/products/bestsellers/',
+                     '/api/products/new/', '/api/products/facets/', '/shop/products/'):
+            with self.subTest(path=path):
+                self.assertWithinQueryBudget('get', path, grow=self.grow)
+        self.assertWithinQueryBudget('get', f'/api/products/{self.product.pk}/')
+        self.assertWithinQueryBudget('get', f'/api/products/{self.product.pk}/variants/')
+        self.assertWithinQueryBudget('get', f'/api/products/{self.product.pk}/images/')
+
+    def test_product_export(self):
+        staff = get_user_model().objects.create_user('budget-staff@example.com', 'pass12345', is_staff=True)
+        self.client.force_login(staff)
+        self.assertWithinQueryBudget('get', '/api/products/export/?format=csv', grow=self.grow)
+        self.assertWithinQueryBudget('get', '/api/products/export/?format=ndjson', grow=self.grow)
+
+    def test_category_endpoints(self):
+        for path in ('/api/categories/', '/api/categories/tree/', f'/api/categories/{self.root.pk}/products/'):
+            with self.subTest(path=path):
+                self.assertWithinQueryBudget('get', path, grow=self.grow)
+        self.assertWithinQueryBudget(
+            'get', f'/api/categories/{self.root.pk}/products/?include_descendants=true', grow=self.grow
+        )
+        self.assertWithinQueryBudget('get', f'/api/categories/{self.leaf.pk}/')
+        self.assertWithinQueryBudget('get', f'/api/categories/{self.leaf.pk}/breadcrumbs/')
+
+    def test_variant_endpoints(self):
+        self.assertWithinQueryBudget('get', '/api/variants/', grow=self.grow)
+        self.assertWithinQueryBudget('get', f'/api/variants/{self.variant.pk}/')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, REQUEST_METRICS_SERVER_TIMING=True)
+class RequestMetricsMiddlewareTestCase(TestCase):
+    """Per-request timing headers, log lines and route histograms."""
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        Product.objects.create(name='Metered', description='Test Description', sku='MET1')
+
+    def test_server_timing_counts_queries(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/products/')
+        timing = dict(
+            (part.split(';')[0], part) for part in response['Server-Timing'].split(', ')
+        )
+        self.assertEqual(set(timing), {'total', 'db', 'cache', 'serialize'})
+        self.assertIn(f'desc="{len(captured)} queries"', timing['db'])
+
+    @override_settings(REQUEST_METRICS_SERVER_TIMING=False)
+    def test_server_timing_can_be_disabled(self):
+        self.assertFalse(self.client.get('/api/products/').has_header('Server-Timing'))
+
+    def test_cache_events_are_counted_per_request(self):
+        self.client.get('/api/categories/tree/')
+        response = self.client.get('/api/categories/tree/')
+        self.assertIn('cache;desc="hits=1 misses=0"', response['Server-Timing'])
+
+    def test_structured_log_and_histograms(self):
+        with self.assertLogs('proshop.requests', level='INFO') as logs:
+            self.client.get('/api/products/')
+            self.client.get('/api/products/')
+        fields = json.loads(logs.records[0].getMessage())
+        self.assertEqual(fields['route'], 'api-products-list')
+        self.assertEqual(fields['status'], 200)
+        self.assertGreater(fields['db_queries'], 0)
+        self.assertEqual(logs.records[0].request_metrics, fields)
+
+        histograms = metrics.snapshot()['histograms']
+        series = histograms['http_request_duration_ms'][('api-products-list', 'GET')]
+        self.assertEqual(series['count'], 2)
+        self.assertEqual(sum(series['buckets']), 2)
+        self.assertEqual(histograms['http_request_db_queries'][('api-products-list', 'GET')]['count'], 2)
+
+
+class MetricsEndpointTestCase(TestCase):
+    """GET /metrics: Prometheus text format, auth and multiprocess merging."""
+
+    def setUp(self):
+        metrics.reset()
+
+    @override_settings(DEBUG=True)
+    def test_text_format(self):
+        self.client.get('/api/products/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_ms histogram', body)
+        self.assertIn('http_request_duration_ms_count{route="api-products-list",method="GET"} 1', body)
+        self.assertIn('http_request_duration_ms_bucket{route="api-products-list",method="GET",le="+Inf"} 1', body)
+        self.assertIn('process_resident_memory_bytes{pid=', body)
+
+    @override_settings(METRICS_AUTH_TOKEN='scrape-secret')
+    def test_token_required_when_configured(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_AUTH_TOKEN='', DEBUG=False)
+    def test_closed_without_token_in_production(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_cache_hit_ratio(self):
+        CACHE_EVENTS.set_total(('catalog', 'hit'), 3)
+        CACHE_EVENTS.set_total(('catalog', 'miss'), 1)
+        self.assertIn('cache_hit_ratio{cache="catalog"} 0.75', render_prometheus(snapshot()))
+
+    def test_worker_files_are_merged(self):
+        CHECKOUT_SESSIONS.inc(('created',))
+        with tempfile.TemporaryDirectory() as directory:
+            # Workers already gone (one of them an earlier process with this
+            # pid): their counters count, their gauges do not
+            for stem in ('999999999-1', f'{os.getpid()}-1'):
+                other = {
+                    'counters': {'checkout_sessions_total': [[['created'], 2]]},
+                    'gauges': {'process_resident_memory_bytes': [[[stem], 1024]]},
+                    'histograms': {},
+                }
+                with open(os.path.join(directory, f'{stem}.json'), 'w') as handle:
+                    json.dump(other, handle)
+            with override_settings(METRICS_MULTIPROC_DIR=directory):
+                data = collect()
+                # Folded into the archive once, files removed
+                self.assertEqual(
+                    sorted(os.listdir(directory)), sorted([f'{_worker_stem()}.json', ARCHIVE_FILENAME, 'archive.lock'])
+                )
+                self.assertEqual(collect()['counters'], data['counters'])
+
+        self.assertEqual(data['counters']['checkout_sessions_total'][('created',)], 5)
+        memory = data['gauges']['process_resident_memory_bytes']
+        self.assertEqual(set(memory), {(str(os.getpid()),)})
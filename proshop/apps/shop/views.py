@@ -1,15 +1,37 @@
 """
 Shop views and API endpoints
 """
+from decimal import Decimal
 from django.shortcuts import render, get_object_or_404
-from django.db.models import Q, Count
+from django.db.models import Prefetch
+from django.utils.decorators import method_decorator
 from rest_framework import viewsets, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
 
+from apps.utils.exports import EXPORT_RENDERERS, stream_export
+from apps.utils.pagination import KeysetPagination
+
+from .cache import (
+    PRODUCT_BULK_TAG,
+    PRODUCT_COLLECTIONS,
+    PRODUCT_LIST_TAG,
+    PRODUCT_STOCK_TAG,
+    cached_response,
+    catalog_condition,
+    catalog_stock_condition,
+    category_tag,
+    get_category_tree,
+    get_collection_ids,
+    product_tag,
+)
+from .exports import PRODUCT_EXPORT_HEADER, product_export_queryset, product_record, product_rows
+from .facets import apply_selections, get_facet_index, get_facet_search_limit, parse_selections
+from .filters import ProductSearchFilter, ProductOrderingFilter, VariantAttributeFilter
 from .models import Product, Category, ProductVariant, ProductImage
+from .search import get_search_backend
 from .serializers import (
     CategorySerializer,
     ProductListSerializer,
@@ -28,14 +50,10 @@ def shop_list(request):
     products = Product.objects.all()
     categories = Category.objects.all()
 
-    # Search
+    # Search (ranked full-text search, see apps.shop.search)
     query = request.GET.get('q')
     if query:
-        products = products.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(sku__icontains=query)
-        )
+        products = get_search_backend(products.db).search(products, query)
 
     # Category filter
     category_id = request.GET.get('category')
@@ -46,12 +64,13 @@ def shop_list(request):
     min_price = request.GET.get('min_price')
     max_price = request.GET.get('max_price')
     if min_price:
-        products = products.filter(price__gte=min_price)
+        products = products.filter(effective_min_price__gte=min_price)
     if max_price:
-        products = products.filter(price__lte=max_price)
+        products = products.filter(effective_min_price__lte=max_price)
 
-    # Sorting
-    sort = request.GET.get('sort', '-created_at')
+    # Sorting (search results default to relevance)
+    default_sort = '-search_rank' if query else '-created_at'
+    sort = request.GET.get('sort', default_sort)
     products = products.order_by(sort)
 
     context = {
@@ -90,18 +109,22 @@ def category_detail(request, slug):
 # API VIEWSETS
 # ===========================
 
+@method_decorator(catalog_condition, name='list')
+@method_decorator(catalog_condition, name='retrieve')
 class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     """
     API endpoint for product categories.
     
     Supports:
-    - Listing all categories
+    - Listing all categories (with subtree product counts)
     - Filtering by parent
     - Searching by name
     - Ordering by name, ordering
+    - Breadcrumbs and subtree product listings
+    - Conditional GET (ETag / Last-Modified from the catalog version)
     """
     
-    queryset = Category.objects.filter(is_active=True)
+    queryset = Category.objects.filter(is_active=True).with_product_counts()
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
@@ -111,23 +134,52 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     ordering = ['ordering', 'name']
     
     @action(detail=True, methods=['get'])
+    @method_decorator(catalog_stock_condition)
     def products(self, request, pk=None):
-        """Get products in this category."""
+        """
+        Get products in this category.
+        Pass ?include_descendants=true to include all subcategories.
+        """
         category = self.get_object()
-        products = Product.objects.filter(
-            category=category,
-            is_active=True
-        ).select_related('category').prefetch_related(
-            'variants', 'images'
-        )
+        include_descendants = request.query_params.get('include_descendants', '')
+        if include_descendants.lower() in ['true', '1', 'yes']:
+            products = category.get_descendant_products()
+        else:
+            products = Product.objects.filter(
+                category=category,
+                is_active=True
+            )
+        products = products.select_related('category', 'primary_image')
         serializer = ProductListSerializer(
             products,
             many=True,
             context={'request': request}
         )
         return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    @method_decorator(catalog_condition)
+    def tree(self, request):
+        """
+        Get the full nested category tree with subtree product counts.
+        Served from a versioned cache entry; warm requests skip the database.
+        """
+        return Response(get_category_tree())
+    
+    @action(detail=True, methods=['get'])
+    @method_decorator(catalog_condition)
+    def breadcrumbs(self, request, pk=None):
+        """Get the path from the root category down to this one."""
+        category = self.get_object()
+        breadcrumbs = [
+            {'id': crumb.id, 'name': crumb.name, 'slug': crumb.slug}
+            for crumb in category.get_breadcrumbs()
+        ]
+        return Response(breadcrumbs)
 
 
+@method_decorator(catalog_stock_condition, name='list')
+@method_decorator(catalog_stock_condition, name='retrieve')
 class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     """
     API endpoint for products.
@@ -138,31 +190,107 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     - Searching by name, brand, description
     - Ordering by name, price, rating, created date
     - Price range filtering via min_price/max_price
+    - Conditional GET (ETag / Last-Modified from the catalog and stock versions)
+    - Anonymous list/detail/collection responses served from a tagged
+      server-side cache (see apps.shop.cache)
     
     Query parameters:
     - ?category=1 - filter by category ID
     - ?is_featured=true - show only featured products
     - ?is_bestseller=true - show only bestsellers
     - ?brand=Apple - filter by brand
-    - ?search=iphone - search products
+    - ?search=iphone - full-text search (ranked by relevance by default)
     - ?ordering=-created_at - order by date (newest first)
-    - ?ordering=price - order by price (lowest first)
+    - ?ordering=price - order by effective price, i.e. the cheapest
+      variant (lowest first)
     - ?min_price=100 - filter products >= $100
     - ?max_price=500 - filter products <= $500
     - ?in_stock=true - only in-stock products
-    - ?page=1 - pagination
+    - ?attr.size=XL&attr.color=Red - products with a variant matching all
+      attributes (repeat a parameter to accept several values)
+    - ?cursor=... - keyset pagination (follow `next`/`previous` links)
+    - ?count=false - omit the total count (infinite scroll)
+    - ?page=1 - legacy page-number pagination
+
+    Faceted search (/api/products/facets/):
+    - Same search/ordering/price-range parameters as the list endpoint
+    - Facet selections, repeat a parameter to OR values within a facet:
+      ?brand=Apple&brand=Samsung&category=3&price=25-50&attr.size=XL
+    - Response adds `facets`: {facet: [{value, count}, ...]}, where each
+      facet's counts ignore that facet's own selection
+    - With ?search, counts cover the best-ranked SHOP_FACET_SEARCH_LIMIT
+      (10000) matches
+
+    Export (/api/products/export/, staff only):
+    - Streams the whole catalog as ?format=csv (one row per variant) or
+      ?format=ndjson (one product per line), see apps.shop.exports
     """
     
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    pagination_class = KeysetPagination
+    filter_backends = [
+        DjangoFilterBackend,
+        VariantAttributeFilter,
+        ProductSearchFilter,
+        ProductOrderingFilter,
+    ]
     filterset_fields = ['category', 'brand', 'is_featured', 'is_bestseller', 'is_new']
     search_fields = ['name', 'description', 'brand', 'sku']
-    ordering_fields = ['name', 'base_price', 'created_at', 'rating']
+    ordering_fields = ['name', 'base_price', 'effective_min_price', 'created_at', 'rating']
     ordering = ['-created_at']  # newest first
     
+    # Last object(s) handed to get_serializer(), for response cache tags
+    serialized = None
+
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        """List products (anonymous responses are cached)."""
+        return super().list(request, *args, **kwargs)
+
+    @cached_response
+    def retrieve(self, request, *args, **kwargs):
+        """Product detail (anonymous responses are cached)."""
+        return super().retrieve(request, *args, **kwargs)
+
+    def get_serializer(self, *args, **kwargs):
+        """Remember what is serialized so cached responses can be tagged."""
+        if args:
+            self.serialized = args[0] if kwargs.get('many') else [args[0]]
+        return super().get_serializer(*args, **kwargs)
+
+    def get_response_cache_tags(self):
+        """
+        Tags of a cached response: the product (detail) or the product list
+        tags, plus every product and category whose data the payload embeds,
+        plus the tag of bulk product writes.
+        """
+        tags = {PRODUCT_BULK_TAG}
+        if self.action == 'retrieve':
+            pk = str(self.kwargs.get(self.lookup_url_kwarg or self.lookup_field, ''))
+            if pk.isdigit():
+                tags.add(product_tag(int(pk)))
+        else:
+            tags.add(PRODUCT_LIST_TAG)
+            in_stock = self.request.query_params.get('in_stock')
+            if in_stock and in_stock.lower() in ['true', '1', 'yes']:
+                tags.add(PRODUCT_STOCK_TAG)
+        for product in self.serialized or []:
+            tags.add(product_tag(product.pk))
+            if product.category_id:
+                tags.add(category_tag(product.category_id))
+        return tags
+
+    def get_response_cache_defaults(self):
+        """Query parameter values equivalent to leaving them out."""
+        return {
+            'ordering': [','.join(self.ordering)],
+            'page_size': [str(self.paginator.page_size)],
+            'count': ['true'],
+        }
+
     def get_serializer_class(self):
         """Use different serializers for list vs detail views."""
-        if self.action == 'list':
+        if self.action in ('list', 'facets'):
             return ProductListSerializer
         elif self.action == 'retrieve':
             return ProductDetailSerializer
@@ -171,54 +299,68 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         """
         Optimize queries with select_related and prefetch_related.
-        Only return active products.
+        Only return active products. Price and stock filters read the
+        denormalized summary columns.
         """
         queryset = Product.objects.filter(is_active=True).select_related(
-            'category'
-        ).prefetch_related(
-            'variants',
-            'variants__images',
-            'images'
+            'category',
+            'primary_image'
         )
+        if self.action not in ('list', 'facets', 'variants', 'images'):
+            # The list serializer reads the summary columns and the nested
+            # actions query their own children; the detail serializer (also
+            # used by the collection actions) needs children
+            queryset = queryset.prefetch_related(
+                'variants',
+                'variants__images',
+                'images'
+            )
+        if self.action in PRODUCT_COLLECTIONS:
+            # Collection pages embed each product's category with its subtree
+            # product count: one annotated prefetch instead of a COUNT per row
+            queryset = queryset.select_related(None).select_related('primary_image').prefetch_related(
+                Prefetch('category', queryset=Category.objects.with_product_counts())
+            )
         
-        # Add price range filtering if provided
-        min_price = self.request.query_params.get('min_price')
-        max_price = self.request.query_params.get('max_price')
-        
-        if min_price:
-            try:
-                min_price = float(min_price)
-                queryset = queryset.filter(
-                    Q(base_price__gte=min_price) |
-                    Q(variants__price__gte=min_price)
-                )
-            except (ValueError, TypeError):
-                pass
-        
-        if max_price:
-            try:
-                max_price = float(max_price)
-                queryset = queryset.filter(
-                    Q(base_price__lte=max_price) |
-                    Q(variants__price__lte=max_price)
-                )
-            except (ValueError, TypeError):
-                pass
-        
+        queryset, _ = self.filter_price_range(queryset)
+
         # Filter by stock status if requested
         in_stock = self.request.query_params.get('in_stock')
         if in_stock and in_stock.lower() in ['true', '1', 'yes']:
-            queryset = queryset.filter(
-                Q(stock__gt=0) | Q(variants__stock__gt=0)
-            )
+            queryset = queryset.filter(effective_total_stock__gt=0)
         
-        return queryset.distinct()
+        return queryset
+
+    def price_bounds(self):
+        """(?min_price, ?max_price) as Decimals, None where absent or invalid."""
+        bounds = []
+        for param in ('min_price', 'max_price'):
+            try:
+                value = Decimal(self.request.query_params.get(param, ''))
+            except ArithmeticError:
+                value = None
+            bounds.append(value if value is not None and value.is_finite() else None)
+        return tuple(bounds)
+
+    def filter_price_range(self, queryset):
+        """
+        Apply ?min_price/?max_price to the effective (cheapest variant)
+        price. Returns (queryset, whether a bound was applied).
+        Uses the denormalized column, so no variant JOIN or DISTINCT.
+        """
+        applied = False
+        for bound, lookup in zip(self.price_bounds(), ('gte', 'lte')):
+            if bound is not None:
+                queryset = queryset.filter(**{f'effective_min_price__{lookup}': bound})
+                applied = True
+        return queryset, applied
     
     @action(detail=True, methods=['get'])
+    @method_decorator(catalog_stock_condition)
     def variants(self, request, pk=None):
         """Get all variants for a product."""
         product = self.get_object()
-        variants = product.variants.filter(is_active=True)
+        variants = product.variants.filter(is_active=True).prefetch_related('images')
         serializer = ProductVariantSerializer(
             variants,
             many=True,
@@ -227,6 +369,7 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
+    @method_decorator(catalog_condition)
     def images(self, request, pk=None):
         """Get all images for a product."""
         product = self.get_object()
@@ -238,49 +381,131 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         )
         return Response(serializer.data)
     
-    @action(detail=False, methods=['get'])
-    def featured(self, request):
-        """Get all featured products."""
-        products = self.get_queryset().filter(is_featured=True)
+    def collection_response(self, name):
+        """
+        Page through a precomputed collection id list and hydrate only the
+        page's products by id. Price/stock filters fall back to the database.
+        """
+        filtered = any(param in self.request.query_params for param in ('min_price', 'max_price', 'in_stock'))
+        if filtered:
+            products = self.get_queryset().filter(**{PRODUCT_COLLECTIONS[name]: True})
+        else:
+            products = get_collection_ids(name)
+
         page = self.paginate_queryset(products)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
+        if page is None:
+            page = products
+        if not filtered:
+            hydrated = self.get_queryset().in_bulk(page)
+            page = [hydrated[pk] for pk in page if pk in hydrated]
+
+        serializer = self.get_serializer(page, many=True)
+        if self.paginator is not None:
             return self.get_paginated_response(serializer.data)
-        
-        serializer = self.get_serializer(products, many=True)
         return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    @method_decorator(catalog_stock_condition)
+    @cached_response
+    def featured(self, request):
+        """Get all featured products."""
+        return self.collection_response('featured')
     
     @action(detail=False, methods=['get'])
+    @method_decorator(catalog_stock_condition)
+    @cached_response
     def bestsellers(self, request):
         """Get all bestseller products."""
-        products = self.get_queryset().filter(is_bestseller=True)
-        page = self.paginate_queryset(products)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        return self.collection_response('bestsellers')
     
     @action(detail=False, methods=['get'])
+    @method_decorator(catalog_stock_condition)
+    @cached_response
     def new(self, request):
         """Get newly added products."""
-        products = self.get_queryset().filter(is_new=True)
+        return self.collection_response('new')
+
+
+    @action(detail=False, methods=['get'])
+    @method_decorator(catalog_stock_condition)
+    def facets(self, request):
+        """
+        Products matching the search and facet selections, with per-value
+        facet counts served from the in-memory facet index.
+        """
+        selections = parse_selections(request.query_params)
+        products = Product.objects.filter(is_active=True).select_related(
+            'category',
+            'primary_image'
+        )
+        products = ProductSearchFilter().filter_queryset(request, products, self)
+
+        products, priced = self.filter_price_range(products)
+
+        # The index only knows facet values. Price bounds are read from its
+        # price arrays; a search narrows the counts to its best-ranked
+        # matches, rather than pulling every matching id
+        index = get_facet_index()
+        base = None
+        if 'search_rank' in products.query.annotations:
+            matches = products.order_by('-search_rank').values_list('pk', flat=True)
+            base = index.bitmap_of(matches[:get_facet_search_limit()])
+        elif priced:
+            base = index.price_range_bitmap(*self.price_bounds())
+        total, facet_counts = index.counts(selections, base=base)
+
+        products = apply_selections(products, selections)
+        products = ProductOrderingFilter().filter_queryset(request, products, self)
         page = self.paginate_queryset(products)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
+            response = self.get_paginated_response(serializer.data)
+            response.data['facets'] = facet_counts
+            return response
+
         serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        return Response({'count': total, 'results': serializer.data, 'facets': facet_counts})
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[permissions.IsAdminUser],
+        renderer_classes=EXPORT_RENDERERS
+    )
+    def export(self, request):
+        """
+        Stream every product with its variants (staff only), inactive ones
+        included. ?format=csv (default) or ?format=ndjson; the category,
+        brand, flag filters and ?is_active=true|false narrow the dump.
+        """
+        products = DjangoFilterBackend().filter_queryset(request, product_export_queryset(), self)
+        is_active = request.query_params.get('is_active', '').lower()
+        if is_active in ('true', '1', 'yes', 'false', '0', 'no'):
+            products = products.filter(is_active=is_active in ('true', '1', 'yes'))
+        return stream_export(
+            products,
+            request.accepted_renderer.format,
+            filename='products',
+            header=PRODUCT_EXPORT_HEADER,
+            rows=product_rows,
+            record=product_record,
+        )
 
 
+@method_decorator(catalog_stock_condition, name='list')
+@method_decorator(catalog_stock_condition, name='retrieve')
 class ProductVariantViewSet(viewsets.ReadOnlyModelViewSet):
     """
     API endpoint for product variants.
     
     Note: Variants are usually accessed via nested endpoint in ProductViewSet,
     but this is available for direct API access if needed.
+
+    Query parameters:
+    - ?product=1 - filter by product ID
+    - ?attr.size=XL&attr.color=Red - filter by attributes (repeat a
+      parameter to accept several values)
+    - ?cursor=... / ?count=false / ?page=1 - pagination, as for products
     """
     
     queryset = ProductVariant.objects.filter(is_active=True).select_related(
@@ -288,7 +513,8 @@ class ProductVariantViewSet(viewsets.ReadOnlyModelViewSet):
     ).prefetch_related('images')
     serializer_class = ProductVariantSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, VariantAttributeFilter, SearchFilter, OrderingFilter]
     filterset_fields = ['product', 'is_default', 'is_active']
     search_fields = ['sku', 'product__name']
     ordering_fields = ['sku', 'price', 'stock']
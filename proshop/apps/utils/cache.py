@@ -0,0 +1,150 @@
+"""
+Cache stampede protection
+
+fetch() wraps "get from cache or compute" for hot keys:
+- single flight: on a miss only the worker holding a short lock recomputes;
+  the others wait briefly for its result instead of piling onto the database
+- stale-while-revalidate: once an entry is outdated (expired, or its
+  version no longer current), workers that lose the lock race keep serving
+  the old value during the grace window
+- probabilistic early expiration (XFetch): shortly before expiry a worker
+  occasionally recomputes ahead of time, weighted by how long the value
+  took to compute, so hot keys rarely expire at all
+
+Hit/miss/stale counters are kept per process, see get_cache_stats(), and
+per request (apps.utils.metrics).
+"""
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, NamedTuple
+from django.core.cache import cache
+from .metrics import count_cache_event
+
+
+DEFAULT_GRACE = 60          # seconds an expired entry may still be served
+DEFAULT_LOCK_TIMEOUT = 10   # seconds a recompute may hold the lock
+WAIT_INTERVAL = 0.05        # seconds between polls while another worker computes
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+# Returned by _compute_locked() when another worker holds the lock
+_LOCKED = object()
+
+
+class Computed(NamedTuple):
+    """Optional compute() result carrying the entry version and cacheability."""
+    value: Any
+    version: Any = None
+    cache: bool = True
+
+
+def _record(name, event):
+    with _stats_lock:
+        _stats[f'{name}.{event}'] += 1
+    count_cache_event(event)
+
+
+def get_cache_stats():
+    """Return {'<name>.<event>': count} for this process."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_cache_stats():
+    """Clear the per-process counters (tests, periodic scrapes)."""
+    with _stats_lock:
+        _stats.clear()
+
+
+def fetch(key, compute, timeout, version=None, grace=DEFAULT_GRACE,
+          lock_timeout=DEFAULT_LOCK_TIMEOUT, beta=1.0, name='cache'):
+    """
+    Return the cached value for `key`, computing it with `compute()` when
+    needed, with stampede protection.
+
+    `version` is compared with the version stored alongside the entry; it
+    may also be a callable taking the stored version and returning whether
+    it is still current. `compute()` returns the value, or a Computed to
+    set the stored version itself or skip caching the result.
+
+    Events counted under `name`: hit, early, stale, miss, wait.
+    """
+    entry = cache.get(key)
+    now = time.time()
+
+    if entry is not None:
+        current = version(entry['version']) if callable(version) else entry['version'] == version
+        if current and now < entry['expires']:
+            # XFetch: recompute early with a probability that rises as the
+            # expiry approaches and with the cost of recomputing
+            early = now - entry['delta'] * beta * math.log(1.0 - random.random()) >= entry['expires']
+            if not early:
+                _record(name, 'hit')
+                return entry['value']
+            value = _compute_locked(key, compute, timeout, version, grace, lock_timeout)
+            if value is _LOCKED:
+                _record(name, 'hit')
+                return entry['value']
+            _record(name, 'early')
+            return value
+
+        # Outdated: serve stale while someone else recomputes
+        value = _compute_locked(key, compute, timeout, version, grace, lock_timeout)
+        if value is _LOCKED:
+            _record(name, 'stale')
+            return entry['value']
+        _record(name, 'miss')
+        return value
+
+    value = _compute_locked(key, compute, timeout, version, grace, lock_timeout)
+    if value is not _LOCKED:
+        _record(name, 'miss')
+        return value
+
+    # Someone else is computing - wait for their result rather than duplicate it
+    _record(name, 'wait')
+    deadline = time.time() + lock_timeout
+    while time.time() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['value']
+        if cache.get(f'{key}:lock') is None:
+            break  # Finished without caching (or died) - compute ourselves
+    return _store(key, compute, timeout, version, grace)
+
+
+def _compute_locked(key, compute, timeout, version, grace, lock_timeout):
+    """Compute and store under the key's lock, or return _LOCKED if it is taken."""
+    lock_key = f'{key}:lock'
+    token = uuid.uuid4().hex
+    if not cache.add(lock_key, token, lock_timeout):
+        return _LOCKED
+    try:
+        return _store(key, compute, timeout, version, grace)
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+def _store(key, compute, timeout, version, grace):
+    started = time.time()
+    result = compute()
+    delta = time.time() - started
+    if not isinstance(result, Computed):
+        result = Computed(result, None if callable(version) else version)
+    if result.cache:
+        entry = {
+            'value': result.value,
+            'version': result.version,
+            'expires': time.time() + timeout,
+            'delta': delta,
+        }
+        # Keep the entry physically around for the stale grace window
+        cache.set(key, entry, timeout + grace)
+    return result.value
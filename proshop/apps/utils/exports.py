@@ -0,0 +1,104 @@
+"""
+Streaming CSV / NDJSON exports
+
+Full dumps are written into a StreamingHttpResponse while the rows are read:
+objects come from QuerySet.iterator(chunk_size=...) - a server-side cursor
+on PostgreSQL, with prefetch_related() lookups run once per chunk - so memory
+stays flat however large the export is and the first bytes go out before the
+database has produced the last row.
+"""
+import csv
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+
+DEFAULT_CHUNK_SIZE = 2000   # rows fetched (and prefetched) per round trip
+WRITE_BUFFER_SIZE = 64 * 1024
+
+
+class CSVExportRenderer(BaseRenderer):
+    """
+    Selects CSV for export views (?format=csv or Accept: text/csv).
+    Exports stream their own body; this only renders error payloads.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+
+class NDJSONExportRenderer(CSVExportRenderer):
+    """Selects newline-delimited JSON (?format=ndjson)."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+EXPORT_RENDERERS = [CSVExportRenderer, NDJSONExportRenderer]
+
+
+class Echo:
+    """File-like object whose write() returns the data (for csv.writer)."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(header, rows):
+    """Yield encoded CSV lines: the header, then one per row."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(records):
+    """Yield one compact JSON document per line."""
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder, separators=(',', ':')) + '\n'
+
+
+def buffered(lines, size=WRITE_BUFFER_SIZE):
+    """
+    Join small lines into chunks of about `size` characters. The first line
+    is sent on its own so clients see the response start immediately.
+    """
+    buffer, length, first = [], 0, True
+    for line in lines:
+        buffer.append(line)
+        length += len(line)
+        if first or length >= size:
+            yield ''.join(buffer)
+            buffer, length, first = [], 0, False
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_export(queryset, export_format, filename, header, rows, record,
+                  chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Stream `queryset` as an attachment.
+
+    - header: CSV column names
+    - rows(obj): iterable of CSV rows for one object (e.g. one per variant)
+    - record(obj): JSON-serializable dict for one object (NDJSON)
+    """
+    objects = queryset.iterator(chunk_size=chunk_size)
+    if export_format == 'csv':
+        lines = csv_lines(header, (row for obj in objects for row in rows(obj)))
+        content_type = 'text/csv; charset=utf-8'
+    else:
+        lines = ndjson_lines(record(obj) for obj in objects)
+        content_type = 'application/x-ndjson; charset=utf-8'
+
+    response = StreamingHttpResponse(buffered(lines), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    response['Cache-Control'] = 'no-store'
+    # Don't let nginx hold the whole body back
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,531 @@
+"""
+Process metrics and Prometheus exposition
+
+RequestMetricsMiddleware (apps.utils.middleware) measures every request -
+wall time, SQL query count and time, cache events and serialization time -
+into a RequestStats bound to the current context, then folds it into the
+per-route histograms below. Business code records into the counters and
+histograms defined here (checkouts, webhooks, emails).
+
+Metrics are cumulative per process and thread-safe. With several worker
+processes (gunicorn), set METRICS_MULTIPROC_DIR to a directory shared by the
+workers of one host: each worker writes its values to `<pid>-<start>.json`
+there (at most every METRICS_FLUSH_INTERVAL seconds, and on every scrape;
+the process start time keeps a reused pid from overwriting an old file), and
+render_prometheus() merges all files, so whichever worker answers /metrics
+reports the whole host. Scrapes fold the counters and histograms of exited
+workers into `archive.json` and delete their files, so the directory stays
+as large as the live worker set; gauges are reported for live workers only.
+Values recorded less than one flush interval before a worker exits are lost.
+
+Code outside the middleware reports into the current request through
+count_cache_event() / add_serialize_time(), which do nothing when no
+request is being measured (management commands, Celery tasks).
+"""
+import bisect
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter as CounterDict
+from django.conf import settings
+
+
+# Upper bounds of the histogram buckets (an implicit +Inf bucket follows)
+DURATION_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+LAG_BUCKETS_SECONDS = (1, 5, 15, 30, 60, 300, 900, 3600, 21600, 86400)
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    """What one request spent, filled in while it runs."""
+
+    __slots__ = ('queries', 'db_time', 'cache_events', 'serialize_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0          # seconds
+        self.cache_events = CounterDict()
+        self.serialize_time = 0.0   # seconds
+
+    @property
+    def cache_hits(self):
+        """Entries served from the cache (stale ones included)."""
+        return self.cache_events['hit'] + self.cache_events['stale']
+
+    @property
+    def cache_misses(self):
+        """Entries that had to be computed (early recomputes included)."""
+        return self.cache_events['miss'] + self.cache_events['early']
+
+
+def start_request():
+    """Bind a fresh RequestStats to the current context; returns (stats, token)."""
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def finish_request(token):
+    """Unbind the RequestStats bound by start_request()."""
+    _current.reset(token)
+
+
+def current_request_stats():
+    """The RequestStats being filled in, or None outside a measured request."""
+    return _current.get()
+
+
+def count_cache_event(event):
+    """Count a cache event (hit, miss, stale, early, wait) for the current request."""
+    stats = _current.get()
+    if stats is not None:
+        stats.cache_events[event] += 1
+
+
+def add_serialize_time(seconds):
+    """Add time spent rendering the response body to the current request."""
+    stats = _current.get()
+    if stats is not None:
+        stats.serialize_time += seconds
+
+
+# ---- metric types ---------------------------------------------------------
+
+REGISTRY = []
+
+
+class Metric:
+    """Base class: named series keyed by a tuple of label values. Thread-safe."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def snapshot(self):
+        """Return {labels: value} (copies)."""
+        with self._lock:
+            return {labels: self._copy(value) for labels, value in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(Metric):
+    """Monotonic count, e.g. checkout_sessions_total{outcome="created"}."""
+
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def set_total(self, labels, value):
+        """Mirror a total counted elsewhere (e.g. apps.utils.cache stats)."""
+        with self._lock:
+            self._series[labels] = value
+
+
+class Gauge(Metric):
+    """Point-in-time value; only reported for live processes."""
+
+    kind = 'gauge'
+
+    def set(self, labels, value):
+        with self._lock:
+            self._series[labels] = value
+
+
+class Histogram(Metric):
+    """Cumulative histogram with fixed bucket upper bounds."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, value):
+        """Record one observation for the label values in `labels`."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {
+                    'buckets': [0] * (len(self.buckets) + 1),
+                    'sum': 0.0,
+                    'count': 0,
+                }
+            series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    @staticmethod
+    def _copy(value):
+        return {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+
+
+# ---- request metrics ------------------------------------------------------
+
+REQUEST_LABELS = ('route', 'method')
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_ms', 'Request wall time in milliseconds', REQUEST_LABELS, DURATION_BUCKETS_MS
+)
+REQUEST_DB_TIME = Histogram(
+    'http_request_db_time_ms', 'Time spent in SQL per request in milliseconds', REQUEST_LABELS, DURATION_BUCKETS_MS
+)
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', 'SQL queries per request', REQUEST_LABELS, QUERY_COUNT_BUCKETS
+)
+REQUEST_SERIALIZE_TIME = Histogram(
+    'http_request_serialize_time_ms', 'Response rendering time per request in milliseconds',
+    REQUEST_LABELS, DURATION_BUCKETS_MS
+)
+REQUEST_CACHE_EVENTS = Counter(
+    'http_request_cache_events_total', 'Cache events (hit, miss, stale, early, wait) by route', ('route', 'event')
+)
+
+
+def observe_request(route, method, duration, stats):
+    """Fold one finished request (duration in seconds) into the metrics."""
+    labels = (route, method)
+    REQUEST_DURATION.observe(labels, duration * 1000)
+    REQUEST_DB_TIME.observe(labels, stats.db_time * 1000)
+    REQUEST_QUERIES.observe(labels, stats.queries)
+    REQUEST_SERIALIZE_TIME.observe(labels, stats.serialize_time * 1000)
+    for event, count in stats.cache_events.items():
+        REQUEST_CACHE_EVENTS.inc((route, event), count)
+    maybe_flush()
+
+
+# ---- business and runtime metrics -----------------------------------------
+
+CHECKOUT_SESSIONS = Counter(
+    'checkout_sessions_total', 'Stripe checkout attempts by outcome', ('outcome',)
+)
+WEBHOOK_EVENTS = Counter(
+    'webhook_events_total', 'Stripe webhook deliveries by event type and outcome', ('type', 'outcome')
+)
+WEBHOOK_LAG = Histogram(
+    'webhook_lag_seconds', 'Delay between a Stripe event being created and processed',
+    ('type',), LAG_BUCKETS_SECONDS
+)
+EMAIL_SEND_DURATION = Histogram(
+    'email_send_duration_ms', 'Time to hand an email to the mail backend in milliseconds',
+    ('kind', 'outcome'), DURATION_BUCKETS_MS
+)
+CACHE_EVENTS = Counter(
+    'cache_events_total', 'apps.utils.cache.fetch() events by cache name', ('cache', 'event')
+)
+PROCESS_MEMORY = Gauge(
+    'process_resident_memory_bytes', 'Resident memory of each worker process', ('pid',)
+)
+
+
+def resident_memory():
+    """This process's resident set size in bytes (peak RSS where /proc is missing)."""
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def collect_runtime():
+    """Refresh the metrics read from elsewhere: cache stats and memory."""
+    from .cache import get_cache_stats
+
+    for key, count in get_cache_stats().items():
+        name, _, event = key.rpartition('.')
+        CACHE_EVENTS.set_total((name, event), count)
+    PROCESS_MEMORY.set((str(os.getpid()),), resident_memory())
+
+
+# ---- snapshots and multiprocess files --------------------------------------
+
+def snapshot():
+    """Return this process's metrics as {'<kind>s': {name: {labels: value}}}."""
+    result = {'counters': {}, 'gauges': {}, 'histograms': {}}
+    for metric in REGISTRY:
+        result[f'{metric.kind}s'][metric.name] = metric.snapshot()
+    return result
+
+
+def reset():
+    """Clear every metric of this process (tests)."""
+    for metric in REGISTRY:
+        metric.reset()
+
+
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+_identity = (None, None)  # (pid, file stem) - recomputed after a fork
+
+ARCHIVE_FILENAME = 'archive.json'
+ARCHIVE_LOCK_FILENAME = 'archive.lock'
+
+
+def get_multiproc_dir():
+    return getattr(settings, 'METRICS_MULTIPROC_DIR', '') or ''
+
+
+def _process_start(pid):
+    """Start time of a process (clock ticks since boot), None without /proc."""
+    try:
+        with open(f'/proc/{pid}/stat') as handle:
+            # Fields after the parenthesized command name; starttime is field 22
+            return handle.read().rpartition(')')[2].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def _worker_stem():
+    """File stem of this process: `<pid>-<start>`."""
+    global _identity
+    pid = os.getpid()
+    if _identity[0] != pid:
+        start = _process_start(pid) or f't{time.time_ns()}'
+        _identity = (pid, f'{pid}-{start}')
+    return _identity[1]
+
+
+def _worker_is_alive(stem):
+    """Whether the process that wrote `<stem>.json` is still running."""
+    pid, _, start = stem.partition('-')
+    current = _process_start(int(pid))
+    if current is not None:
+        return current == start
+    return _is_alive(int(pid))
+
+
+def _worker_files(directory):
+    """{stem: path} of the worker files in `directory`."""
+    files = {}
+    for filename in os.listdir(directory):
+        stem, extension = os.path.splitext(filename)
+        pid, _, start = stem.partition('-')
+        if extension == '.json' and pid.isdigit() and start:
+            files[stem] = os.path.join(directory, filename)
+    return files
+
+
+def _read(path):
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None  # Gone, or being replaced - picked up next scrape
+
+
+def _write(path, data):
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as handle:
+        json.dump(data, handle)
+    os.replace(temporary, path)
+
+
+def _encode(merged):
+    return {
+        kind: {name: [[list(labels), value] for labels, value in series.items()] for name, series in metrics.items()}
+        for kind, metrics in merged.items()
+    }
+
+
+def _merge_file(merged, data, gauges=True):
+    for kind, metrics in data.items():
+        if kind == 'gauges' and not gauges:
+            continue
+        for name, series in metrics.items():
+            target = merged[kind].setdefault(name, {})
+            for labels, value in series:
+                _merge(target, kind, tuple(labels), value)
+
+
+def maybe_flush():
+    """Write this process's file if the flush interval has passed."""
+    if get_multiproc_dir() and time.monotonic() - _last_flush >= getattr(settings, 'METRICS_FLUSH_INTERVAL', 5):
+        flush()
+
+
+def flush():
+    """Write this process's metrics to METRICS_MULTIPROC_DIR/<pid>.json."""
+    global _last_flush
+    directory = get_multiproc_dir()
+    if not directory:
+        return
+    collect_runtime()
+    data = _encode(snapshot())
+    path = os.path.join(directory, f'{_worker_stem()}.json')
+    with _flush_lock:
+        _write(path, data)
+        _last_flush = time.monotonic()
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def collect():
+    """
+    Metrics for the whole host: the archive of exited workers plus every
+    live worker file when METRICS_MULTIPROC_DIR is set, this process alone
+    otherwise.
+    """
+    directory = get_multiproc_dir()
+    if not directory:
+        collect_runtime()
+        return snapshot()
+
+    import fcntl
+
+    flush()
+    with open(os.path.join(directory, ARCHIVE_LOCK_FILENAME), 'a') as lock:
+        # One scrape at a time, so a dead worker is archived exactly once
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            archive = compact(directory)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    merged = {'counters': {}, 'gauges': {}, 'histograms': {}}
+    _merge_file(merged, archive, gauges=False)
+    for stem, path in sorted(_worker_files(directory).items()):
+        data = _read(path)
+        if data is not None:
+            _merge_file(merged, data, gauges=_worker_is_alive(stem))
+    return merged
+
+
+def compact(directory):
+    """
+    Fold the counters and histograms of exited workers into the archive
+    and delete their files (call with the archive lock held). Returns the
+    archive's metrics.
+    """
+    path = os.path.join(directory, ARCHIVE_FILENAME)
+    archive = _read(path) or {}
+    # Files already folded in but not deleted yet (interrupted compaction)
+    stored = set(archive.get('folded', ()))
+    folded = set(stored)
+    merged = {'counters': {}, 'gauges': {}, 'histograms': {}}
+    _merge_file(merged, archive.get('metrics', {}), gauges=False)
+    for stem, worker_path in _worker_files(directory).items():
+        if stem in folded or _worker_is_alive(stem):
+            continue
+        data = _read(worker_path)
+        if data is not None:
+            _merge_file(merged, data, gauges=False)
+            folded.add(stem)
+    if folded == stored == set():
+        return archive.get('metrics', {})
+
+    # Archive first: a crash before the deletes leaves them listed as folded
+    metrics = _encode(merged)
+    if folded != stored:
+        _write(path, {'metrics': metrics, 'folded': sorted(folded)})
+    for stem in folded:
+        try:
+            os.remove(os.path.join(directory, f'{stem}.json'))
+        except FileNotFoundError:
+            pass
+    _write(path, {'metrics': metrics, 'folded': []})
+    return metrics
+
+
+def _merge(target, kind, labels, value):
+    if kind == 'histograms':
+        current = target.get(labels)
+        if current is None:
+            target[labels] = {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+        else:
+            current['buckets'] = [a + b for a, b in zip(current['buckets'], value['buckets'])]
+            current['sum'] += value['sum']
+            current['count'] += value['count']
+    elif kind == 'counters':
+        target[labels] = target.get(labels, 0) + value
+    else:
+        target[labels] = value
+
+
+# ---- Prometheus text format ------------------------------------------------
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def render_prometheus(data=None):
+    """Render collect() output (or `data`) in the Prometheus text format."""
+    data = collect() if data is None else data
+    lines = []
+    for metric in REGISTRY:
+        series = data[f'{metric.kind}s'].get(metric.name, {})
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for labels, value in sorted(series.items()):
+            if metric.kind != 'histogram':
+                lines.append(f'{metric.name}{_labels(metric.labelnames, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            bounds = [*map(_number, metric.buckets), '+Inf']
+            for bound, count in zip(bounds, value['buckets']):
+                cumulative += count
+                lines.append(
+                    f'{metric.name}_bucket{_labels(metric.labelnames, labels, [("le", bound)])} {cumulative}'
+                )
+            lines.append(f'{metric.name}_sum{_labels(metric.labelnames, labels)} {_number(value["sum"])}')
+            lines.append(f'{metric.name}_count{_labels(metric.labelnames, labels)} {value["count"]}')
+
+    # Derived: hit ratio per cache name, from the merged event totals
+    events = data['counters'].get(CACHE_EVENTS.name, {})
+    totals = {}
+    for (name, event), count in events.items():
+        hits, lookups = totals.get(name, (0, 0))
+        served = event in ('hit', 'stale')
+        computed = event in ('miss', 'early')
+        totals[name] = (hits + (count if served else 0), lookups + (count if served or computed else 0))
+    lines.append('# HELP cache_hit_ratio Share of fetch() lookups served from the cache')
+    lines.append('# TYPE cache_hit_ratio gauge')
+    for name, (hits, lookups) in sorted(totals.items()):
+        if lookups:
+            lines.append(f'cache_hit_ratio{_labels(("cache",), (name,))} {_number(hits / lookups)}')
+    return '\n'.join(lines) + '\n'
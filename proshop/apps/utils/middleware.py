@@ -0,0 +1,120 @@
+"""
+Request performance instrumentation
+
+RequestMetricsMiddleware times each request and, through
+connection.execute_wrapper(), every SQL query it runs. The results are:
+- a Server-Timing header (total, db, cache, serialize), shown per request in
+  the browser's network panel
+- one structured log line on the 'proshop.requests' logger (JSON message,
+  the same fields under `extra['request_metrics']`); slow requests are
+  logged at WARNING
+- per-route histograms in apps.utils.metrics
+
+Settings:
+- REQUEST_METRICS_SERVER_TIMING: send the Server-Timing header (default DEBUG)
+- REQUEST_METRICS_SLOW_MS: WARNING threshold in milliseconds (default 1000)
+
+Streaming responses are measured up to the point their headers are ready;
+queries issued while the body streams are not counted.
+"""
+import json
+import logging
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from . import metrics
+
+
+logger = logging.getLogger('proshop.requests')
+
+UNRESOLVED_ROUTE = '<unresolved>'
+
+
+class QueryTimer:
+    """execute_wrapper hook adding each query's count and duration to the stats."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.stats.db_time += time.perf_counter() - started
+            self.stats.queries += 1
+
+
+class RequestMetricsMiddleware:
+    """
+    Measure wall time, SQL queries, cache events and serialization time per
+    request. Place it first in MIDDLEWARE so the whole stack is timed.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = getattr(settings, 'REQUEST_METRICS_SERVER_TIMING', False)
+        self.slow_ms = getattr(settings, 'REQUEST_METRICS_SLOW_MS', 1000)
+
+    def __call__(self, request):
+        stats, token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                timer = QueryTimer(stats)
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timer))
+                response = self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        duration = time.perf_counter() - started
+
+        route = self.get_route(request)
+        metrics.observe_request(route, request.method, duration, stats)
+        if self.server_timing:
+            response['Server-Timing'] = self.server_timing_header(duration, stats)
+        self.log(request, response, route, duration, stats)
+        return response
+
+    def process_template_response(self, request, response):
+        """Time the rendering of DRF/template responses (the serialization step)."""
+        started = time.perf_counter()
+        response.add_post_render_callback(
+            lambda rendered: metrics.add_serialize_time(time.perf_counter() - started)
+        )
+        return response
+
+    @staticmethod
+    def get_route(request):
+        """The URL pattern name (low cardinality), not the raw path."""
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return UNRESOLVED_ROUTE
+        return match.view_name or match.route or UNRESOLVED_ROUTE
+
+    @staticmethod
+    def server_timing_header(duration, stats):
+        return ', '.join([
+            f'total;dur={duration * 1000:.1f}',
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"',
+            f'cache;desc="hits={stats.cache_hits} misses={stats.cache_misses}"',
+            f'serialize;dur={stats.serialize_time * 1000:.1f}',
+        ])
+
+    def log(self, request, response, route, duration, stats):
+        duration_ms = duration * 1000
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 2),
+            'db_queries': stats.queries,
+            'db_time_ms': round(stats.db_time * 1000, 2),
+            'cache_hits': stats.cache_hits,
+            'cache_misses': stats.cache_misses,
+            'serialize_ms': round(stats.serialize_time * 1000, 2),
+        }
+        level = logging.WARNING if duration_ms >= self.slow_ms else logging.INFO
+        logger.log(level, json.dumps(fields), extra={'request_metrics': fields})
@@ -0,0 +1,283 @@
+"""
+Keyset (cursor) pagination for large listings
+
+Pages are fetched with `WHERE (ordering keys) > (last row keys)` instead of
+`OFFSET n`, so deep pages cost the same as the first one and rows cannot be
+skipped or repeated when the listing changes between requests. The keys are
+the queryset ordering plus the primary key as a tie-breaker; NULLs always
+sort last.
+
+Clients that still send ?page= get classic page-number pagination, as do
+plain lists (e.g. precomputed id lists) and orderings that cannot be keyed.
+"""
+import base64
+import binascii
+import datetime
+import decimal
+import json
+import uuid
+from collections import OrderedDict
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, OrderBy, Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class LegacyPageNumberPagination(PageNumberPagination):
+    """Page-number pagination used when a client asks for ?page=."""
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on the queryset ordering with a stable pk
+    tie-breaker.
+
+    Query parameters:
+    - ?cursor=<opaque> - position returned in `next` / `previous`
+    - ?page_size=50 - page size (max 100)
+    - ?count=false - skip the COUNT(*) (for infinite-scroll clients)
+    - ?page=3 - legacy page-number mode (always counts)
+    """
+
+    cursor_query_param = 'cursor'
+    page_query_param = 'page'
+    page_size_query_param = 'page_size'
+    count_query_param = 'count'
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    legacy_pagination_class = LegacyPageNumberPagination
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.legacy = None
+        keys = self.get_keys(queryset) if isinstance(queryset, QuerySet) else None
+        if self.page_query_param in request.query_params or keys is None:
+            self.legacy = self.legacy_pagination_class()
+            return self.legacy.paginate_queryset(queryset, request, view)
+
+        self.base_url = request.build_absolute_uri()
+        self.page_size_value = self.get_page_size(request)
+        self.keys = keys
+        self.count = queryset.count() if self.include_count(request) else None
+
+        reverse, position = self.decode_cursor(request)
+        # Walking back reverses the NULL placement too (see after())
+        nulls = {'nulls_first': True} if reverse else {'nulls_last': True}
+        ordering = [
+            F(name).desc(**nulls) if descending != reverse else F(name).asc(**nulls)
+            for name, descending, _ in keys
+        ]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(keys, position, reverse))
+
+        results = list(queryset[:self.page_size_value + 1])
+        has_more = len(results) > self.page_size_value
+        results = results[:self.page_size_value]
+        if reverse:
+            results.reverse()
+
+        # Coming from a cursor means there are rows on the other side
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else position is not None
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        if self.legacy is not None:
+            return self.legacy.get_paginated_response(data)
+        payload = OrderedDict()
+        if self.count is not None:
+            payload['count'] = self.count
+        payload['next'] = self.get_next_link()
+        payload['previous'] = self.get_previous_link()
+        payload['results'] = data
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer', 'example': 123},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': name,
+                'required': False,
+                'in': 'query',
+                'description': description,
+                'schema': {'type': kind},
+            }
+            for name, kind, description in (
+                (self.cursor_query_param, 'string', 'Pagination cursor value.'),
+                (self.page_size_query_param, 'integer', 'Number of results to return per page.'),
+                (self.count_query_param, 'boolean', 'Set to false to skip the total count.'),
+                (self.page_query_param, 'integer', 'Legacy page number (disables cursors).'),
+            )
+        ]
+
+    # ---- configuration --------------------------------------------------
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(size, self.max_page_size) if size > 0 else self.page_size
+
+    def include_count(self, request):
+        value = request.query_params.get(self.count_query_param, 'true')
+        return value.lower() not in ('false', '0', 'no')
+
+    def get_keys(self, queryset):
+        """
+        Return [(lookup, descending, nullable), ...] for the queryset
+        ordering plus the pk, or None if the ordering cannot be keyed
+        (e.g. arbitrary expressions).
+        """
+        query = queryset.query
+        if query.order_by:
+            ordering = query.order_by
+        elif query.default_ordering:
+            ordering = query.get_meta().ordering
+        else:
+            ordering = []
+
+        keys = []
+        for item in ordering:
+            if isinstance(item, OrderBy) and isinstance(item.expression, F):
+                name, descending = item.expression.name, item.descending
+            elif isinstance(item, str) and item not in ('?', ''):
+                descending = item.startswith('-')
+                name = item.lstrip('-')
+            else:
+                return None
+            resolved = self.resolve(queryset, name)
+            if resolved is None:
+                return None
+            keys.append((resolved[0], descending, resolved[1]))
+            if resolved[0] == 'pk':
+                return keys
+
+        descending = keys[-1][1] if keys else True
+        keys.append(('pk', descending, False))
+        return keys
+
+    def resolve(self, queryset, name):
+        """Return (lookup, nullable) for an ordering name."""
+        if name in queryset.query.annotations:
+            return name, True
+        meta = queryset.model._meta
+        if name in ('pk', meta.pk.name):
+            return 'pk', False
+
+        nullable = False
+        parts = name.split('__')
+        try:
+            for i, part in enumerate(parts):
+                field = meta.get_field(part)
+                nullable = nullable or field.null
+                if i < len(parts) - 1:
+                    meta = field.related_model._meta
+        except (FieldDoesNotExist, AttributeError):
+            return None
+        if field.is_relation:
+            # Order by the stored key rather than the related model's ordering
+            if not field.concrete:
+                return None
+            parts[-1] = field.attname
+        return '__'.join(parts), nullable
+
+    # ---- cursors --------------------------------------------------------
+
+    @staticmethod
+    def after(keys, position, reverse):
+        """Q matching rows that come after `position` in the page order."""
+        (name, descending, nullable), value = keys[0], position[0]
+        rest = KeysetPagination.after(keys[1:], position[1:], reverse) if keys[1:] else None
+        nulls_last = not reverse
+        is_null = Q(**{f'{name}__isnull': True})
+
+        if value is None:
+            condition = is_null & rest if rest is not None else Q(pk__in=[])
+            if not nulls_last:
+                condition |= ~is_null
+            return condition
+
+        lookup = 'lt' if descending != reverse else 'gt'
+        condition = Q(**{f'{name}__{lookup}': value})
+        if nullable and nulls_last:
+            condition |= is_null
+        if rest is not None:
+            condition |= Q(**{name: value}) & rest
+        return condition
+
+    def position_of(self, obj):
+        values = []
+        for name, _, _ in self.keys:
+            value = obj
+            for part in name.split('__'):
+                value = getattr(value, part, None)
+            values.append(self.encode_value(value))
+        return values
+
+    @staticmethod
+    def encode_value(value):
+        if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+            return value.isoformat()
+        if isinstance(value, (decimal.Decimal, uuid.UUID)):
+            return str(value)
+        return value
+
+    def encode_cursor(self, position, reverse):
+        payload = {'p': position, 'k': [name for name, _, _ in self.keys]}
+        if reverse:
+            payload['r'] = 1
+        data = json.dumps(payload, separators=(',', ':')).encode()
+        cursor = base64.urlsafe_b64encode(data).decode().rstrip('=')
+        url = replace_query_param(self.base_url, self.cursor_query_param, cursor)
+        return remove_query_param(url, self.page_query_param)
+
+    def decode_cursor(self, request):
+        """Return (reverse, position) from the request, (False, None) if absent."""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return False, None
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            payload = json.loads(data)
+            position = payload['p']
+            valid = (
+                payload['k'] == [name for name, _, _ in self.keys]
+                and isinstance(position, list)
+                and len(position) == len(self.keys)
+            )
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            valid = False
+        if not valid:
+            # Malformed, or issued for a different ordering
+            raise NotFound(self.invalid_cursor_message)
+        return bool(payload.get('r')), position
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.position_of(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.position_of(self.page[0]), reverse=True)
@@ -0,0 +1,207 @@
+"""
+Per-endpoint SQL query budgets
+
+Every named route in proshop/urls.py is listed here, either with a
+QueryBudget (the most queries one request may issue) or in EXEMPT with the
+reason it is not measured. Tests exercise the budgets through
+QueryBudgetTestMixin, which fails when a request goes over budget or - for
+listings - when its query count grows with the number of rows returned,
+the usual sign of an N+1. unlisted_routes() keeps the registry in step
+with the URLconf.
+
+Budgets are counted with the test settings (DummyCache), so cache-backed
+endpoints pay for their cold path on every request.
+"""
+from typing import NamedTuple, Optional
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver, resolve
+
+
+class QueryBudget(NamedTuple):
+    """
+    Query allowance for one route (every HTTP method it accepts).
+    `known_issue`: the route is known to overspend; its test is skipped
+    while it does and fails once it fits, so the note gets removed.
+    """
+    max_queries: int
+    known_issue: Optional[str] = None
+
+
+# Catalog reads include the catalog version lookup behind conditional GET
+# (4 aggregates) and the pagination COUNT(*)
+QUERY_BUDGETS = {
+    # ---- shop API (mounted under /api/ and /shop/) ----
+    'api-root': QueryBudget(0),
+    'api-products-list': QueryBudget(7),
+    'api-products-detail': QueryBudget(9),
+    'api-products-variants': QueryBudget(7),
+    'api-products-images': QueryBudget(6),
+    'api-products-featured': QueryBudget(10),
+    'api-products-bestsellers': QueryBudget(10),
+    'api-products-new': QueryBudget(10),
+    'api-products-facets': QueryBudget(9),
+    'api-products-export': QueryBudget(4),
+    'api-categories-list': QueryBudget(6),
+    'api-categories-detail': QueryBudget(5),
+    'api-categories-tree': QueryBudget(5),
+    'api-categories-breadcrumbs': QueryBudget(6),
+    'api-categories-products': QueryBudget(7),
+    'api-variants-list': QueryBudget(7),
+    'api-variants-detail': QueryBudget(6),
+
+    # ---- cart API (mounted under /api/cart/ and /cart/) ----
+    'cart-list': QueryBudget(5),
+    'cart-add': QueryBudget(14),
+    'cart-update-item': QueryBudget(8),
+    'cart-clear': QueryBudget(7),
+    'cart-batch': QueryBudget(12),
+    'cart-checkout': QueryBudget(5),
+
+    # ---- payment ----
+    # Also replaces the cart's stock holds and refreshes available stock
+    'stripe_checkout': QueryBudget(15),
+    'payment_status': QueryBudget(3),
+    'order_success': QueryBudget(4),
+    'order_cancel': QueryBudget(2),
+
+    # ---- orders API ----
+    'api-order-list': QueryBudget(5),
+    'api-order-detail': QueryBudget(4),
+    'api-order-by-number': QueryBudget(4),
+    'api-order-cancel': QueryBudget(4),
+    'api-order-export': QueryBudget(4),
+
+    # ---- operations ----
+    'metrics': QueryBudget(0),
+
+    # ---- reviews ----
+    'vote_helpful': QueryBudget(7),
+    'vote_unhelpful': QueryBudget(7),
+    'delete_review': QueryBudget(6),
+}
+
+EXEMPT = {
+    'schema': 'OpenAPI schema generation, no database access',
+    'swagger-ui': 'static documentation page',
+    'redoc': 'static documentation page',
+    'rest_framework:login': 'browsable API login form (django.contrib.auth)',
+    'rest_framework:logout': 'browsable API logout (django.contrib.auth)',
+    'stripe_webhook': 'rejected before any query without a valid Stripe signature',
+    'index': 'React frontend shell (production only), no database access',
+    'index-fallback': 'React frontend shell (production only), no database access',
+    # Server-rendered pages whose templates are not shipped (the React
+    # frontend replaced them); they cannot render in the test suite
+    'shop': 'server-rendered page, template not shipped',
+    'product_detail': 'server-rendered page, template not shipped',
+    'category': 'server-rendered page, template not shipped',
+    'order_list': 'server-rendered page, template not shipped',
+    'order_detail': 'server-rendered page, template not shipped',
+    'create_order': 'server-rendered page, template not shipped',
+    'cancel_order': 'server-rendered page, template not shipped',
+    'add_review': 'server-rendered page, template not shipped',
+    'accounts:register': 'server-rendered page, template not shipped',
+    'accounts:login': 'server-rendered page, template not shipped',
+    'accounts:logout': 'session logout, no application queries',
+    'accounts:profile': 'server-rendered page, template not shipped',
+    'accounts:change_password': 'server-rendered page, template not shipped',
+}
+
+# Third-party URLconfs with their own test suites
+EXCLUDED_NAMESPACES = {'admin', 'djdt'}
+
+
+def get_budget(view_name):
+    """Return the QueryBudget for a route name (KeyError if unbudgeted)."""
+    return QUERY_BUDGETS[view_name]
+
+
+def iter_route_names(patterns=None, namespace=None):
+    """Yield the namespaced name of every named route in the URLconf."""
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.namespace in EXCLUDED_NAMESPACES:
+                continue
+            inner = pattern.namespace
+            if namespace and inner:
+                inner = f'{namespace}:{inner}'
+            yield from iter_route_names(pattern.url_patterns, inner or namespace)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            yield f'{namespace}:{pattern.name}' if namespace else pattern.name
+
+
+def unlisted_routes():
+    """Route names that are neither budgeted nor exempt."""
+    return sorted(set(iter_route_names()) - set(QUERY_BUDGETS) - set(EXEMPT))
+
+
+def count_queries(client, method, path, data=None, using=DEFAULT_DB_ALIAS, **extra):
+    """
+    Send one request through the test client and return (response, queries).
+    Streaming responses are consumed inside the capture, since their
+    queries run while the body is produced.
+    """
+    if method != 'get' and data is not None:
+        extra.setdefault('content_type', 'application/json')
+    with CaptureQueriesContext(connections[using]) as captured:
+        response = getattr(client, method)(path, data, **extra)
+        if response.streaming:
+            response.streamed_content = b''.join(response.streaming_content)
+    return response, captured.captured_queries
+
+
+class QueryBudgetTestMixin:
+    """
+    TestCase mixin enforcing QUERY_BUDGETS.
+
+        self.assertWithinQueryBudget('get', '/api/products/', grow=self.add_products)
+
+    The route's budget is found by resolving the path. With `grow` (a
+    callable adding rows to the result) the request is repeated afterwards
+    and must issue exactly as many queries as before.
+    """
+
+    def assertWithinQueryBudget(self, method, path, data=None, grow=None, status=None, **extra):
+        view_name = resolve(path.split('?')[0]).view_name
+        budget = QUERY_BUDGETS.get(view_name)
+        if budget is None:
+            self.fail(f'No query budget registered for {view_name!r} ({path})')
+
+        problems = []
+        response, queries = count_queries(self.client, method, path, data, **extra)
+        self._check_response(response, status, path)
+        if len(queries) > budget.max_queries:
+            problems.append(self._over_budget(view_name, budget, queries))
+
+        if grow is not None:
+            grow()
+            grown, grown_queries = count_queries(self.client, method, path, data, **extra)
+            self._check_response(grown, status, path)
+            if len(grown_queries) != len(queries):
+                problems.append(
+                    f'{view_name}: query count grew with the result size '
+                    f'({len(queries)} -> {len(grown_queries)})'
+                )
+            elif len(grown_queries) > budget.max_queries and not problems:
+                problems.append(self._over_budget(view_name, budget, grown_queries))
+
+        if budget.known_issue:
+            if problems:
+                self.skipTest(f'known issue on {view_name}: {budget.known_issue}')
+            self.fail(f'{view_name} now fits its budget, remove known_issue={budget.known_issue!r}')
+        if problems:
+            self.fail('\n'.join(problems))
+        return response
+
+    def _check_response(self, response, status, path):
+        if status is None:
+            self.assertLess(response.status_code, 400, f'{path} returned {response.status_code}')
+        else:
+            self.assertEqual(response.status_code, status, path)
+
+    @staticmethod
+    def _over_budget(view_name, budget, queries):
+        listing = '\n'.join(f'  {index}. {query["sql"]}' for index, query in enumerate(queries, 1))
+        return f'{view_name}: {len(queries)} queries, budget is {budget.max_queries}\n{listing}'
@@ -0,0 +1,25 @@
+"""Operational endpoints"""
+import hmac
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_GET
+from .metrics import PROMETHEUS_CONTENT_TYPE, render_prometheus
+
+
+@require_GET
+def metrics(request):
+    """
+    Prometheus scrape endpoint (GET /metrics).
+    The scraper must send `Authorization: Bearer <METRICS_AUTH_TOKEN>`;
+    without a configured token the endpoint is only open with DEBUG.
+    """
+    token = getattr(settings, 'METRICS_AUTH_TOKEN', '')
+    if token:
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+            return HttpResponseForbidden()
+    elif not settings.DEBUG:
+        return HttpResponseForbidden()
+    response = HttpResponse(render_prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
+    response['Cache-Control'] = 'no-store'
+    return response
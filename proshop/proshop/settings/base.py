@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'apps.utils.middleware.RequestMetricsMiddleware',  # first: times the whole stack
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -163,6 +164,18 @@ SESSION_COOKIE_AGE = 1209600  # 2 weeks
 SESSION_SAVE_EVERY_REQUEST = False
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 
+# Anonymous carts live in CART_STORE (apps.cart.stores), keyed by a signed
+# cookie, and only become Cart rows on login or checkout
+CART_STORE = env('CART_STORE', default='apps.cart.stores.CacheCartStore')
+CART_STORE_CACHE = 'carts'  # cache alias (Redis connection for RedisCartStore)
+CART_STORE_TTL = env.int('CART_STORE_TTL', default=SESSION_COOKIE_AGE)  # seconds since the last change
+CART_COOKIE_NAME = 'cart'
+
+# How long checkout holds stock (apps.cart StockReservation). Stripe
+# checkout sessions expire with their holds, and Stripe's minimum session
+# lifetime is 30 minutes
+STOCK_RESERVATION_TTL = env.int('STOCK_RESERVATION_TTL', default=35 * 60)  # seconds
+
 # ===========================
 # AUTHENTICATION
 # ===========================
@@ -236,7 +249,12 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'proshop-cache',
-    }
+    },
+    'carts': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'proshop-carts',
+        'TIMEOUT': None,
+    },
 }
 
 # ===========================
@@ -267,6 +285,17 @@ LOGGING = {
     },
 }
 
+# Per-request timing (apps.utils.middleware.RequestMetricsMiddleware); the
+# Server-Timing header exposes query counts and timings, so debug only
+REQUEST_METRICS_SERVER_TIMING = env.bool('REQUEST_METRICS_SERVER_TIMING', default=DEBUG)
+REQUEST_METRICS_SLOW_MS = env.int('REQUEST_METRICS_SLOW_MS', default=1000)
+
+# /metrics (apps.utils.metrics): a directory shared by the workers of one
+# host aggregates their metrics; empty = this process only
+METRICS_MULTIPROC_DIR = env('METRICS_MULTIPROC_DIR', default='')
+METRICS_FLUSH_INTERVAL = env.int('METRICS_FLUSH_INTERVAL', default=5)  # seconds
+METRICS_AUTH_TOKEN = env('METRICS_AUTH_TOKEN', default='')  # required unless DEBUG
+
 # ===========================
 # EMAIL CONFIGURATION
 # ===========================
@@ -313,3 +342,10 @@ LOCAL_APPS = [
 
 INSTALLED_APPS += LOCAL_APPS
 
+
+# ===========================
+# PRODUCT SEARCH
+# ===========================
+# Dotted path to a search backend class; leave empty to pick one from the
+# database vendor (PostgreSQL tsvector, SQLite FTS5, icontains fallback).
+PRODUCT_SEARCH_BACKEND = env('PRODUCT_SEARCH_BACKEND', default=None)
@@ -7,6 +7,7 @@ from .base import *
 # Override base settings for development
 DEBUG = True
 ALLOWED_HOSTS = ['localhost', '127.0.0.1', '0.0.0.0']
+REQUEST_METRICS_SERVER_TIMING = env.bool('REQUEST_METRICS_SERVER_TIMING', default=True)
 
 # Database: SQLite for development
 DATABASES = {
@@ -41,7 +42,13 @@ SECURE_CONTENT_SECURITY_POLICY = False
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
-    }
+    },
+    # Anonymous carts need a cache that keeps what it is given
+    'carts': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'proshop-carts',
+        'TIMEOUT': None,
+    },
 }
 
 # Logging: More verbose
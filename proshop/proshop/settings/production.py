@@ -6,6 +6,7 @@ from .base import *
 
 # Override base settings for production
 DEBUG = False
+REQUEST_METRICS_SERVER_TIMING = env.bool('REQUEST_METRICS_SERVER_TIMING', default=False)
 ALLOWED_HOSTS = env.list('ALLOWED_HOSTS', default=['vibevault-production.up.railway.app', '*.railway.app', 'localhost', '127.0.0.1'])
 
 # Database: PostgreSQL with environment URL
@@ -107,9 +108,21 @@ CACHES = {
             'COMPRESSOR': 'django_redis.compressors.zlib.ZlibCompressor',
             'IGNORE_EXCEPTIONS': True,
         }
-    }
+    },
+    # Anonymous carts (apps.cart.stores.RedisCartStore uses the raw client)
+    'carts': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': env('CART_REDIS_URL', default=env('REDIS_URL', default='redis://127.0.0.1:6379/1')),
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'SOCKET_CONNECT_TIMEOUT': 5,
+            'SOCKET_TIMEOUT': 5,
+        }
+    },
 }
 
+CART_STORE = env('CART_STORE', default='apps.cart.stores.RedisCartStore')
+
 # ===========================
 # LOGGING - Production Grade
 # ===========================
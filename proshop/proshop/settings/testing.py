@@ -29,8 +29,17 @@ EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
-    }
+    },
+    # Anonymous carts need a cache that keeps what it is given
+    'carts': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'proshop-carts',
+        'TIMEOUT': None,
+    },
 }
 
 # Test settings
 TESTING = True
+
+# Per-request metric log lines (apps.utils.middleware) only when slow
+LOGGING['loggers'] = {'proshop.requests': {'level': 'WARNING'}}
@@ -17,6 +17,7 @@ from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from apps.shop.models import Product, ProductVariant, Category
 from apps.cart.models import Cart, CartItem
+from apps.cart.stores import StoredCart
 
 User = get_user_model()
 client = APIClient()
@@ -292,7 +293,7 @@ def test_merge_logic():
     """Test session to user merge logic"""
     print_header("Test 4: Session to User Merge Logic")
     
-    print("This test verifies the merge_from_session() method\n")
+    print("This test verifies Cart.merge_lines() with an anonymous stored cart\n")
     
     from apps.shop.models import ProductVariant
     
@@ -309,13 +310,12 @@ def test_merge_logic():
         print(f"{Colors.YELLOW}⚠ Not enough variants for merge test{Colors.RESET}")
         return
     
-    # Create session cart with items
-    print("4.1 Creating session cart with items:")
-    session_key = 'test-session-key-123'
-    session_cart = Cart.objects.create(session_id=session_key, user=None)
-    CartItem.objects.create(cart=session_cart, variant=variants[0], quantity=2, price_at_add=variants[0].price)
-    CartItem.objects.create(cart=session_cart, variant=variants[1], quantity=1, price_at_add=variants[1].price)
-    print(f"  Created session cart with 2 items")
+    # Create stored (anonymous) cart with items
+    print("4.1 Creating stored cart with items:")
+    session_cart = StoredCart()
+    session_cart.add_variant(variants[0], 2)
+    session_cart.add_variant(variants[1], 1)
+    print(f"  Created stored cart with 2 items")
     
     # Create user cart
     print("\n4.2 Creating user cart with existing items:")
@@ -323,16 +323,17 @@ def test_merge_logic():
     CartItem.objects.create(cart=user_cart, variant=variants[0], quantity=1, price_at_add=variants[0].price)
     print(f"  Created user cart with 1 item (same variant as session)")
     
-    print(f"\n  Session cart items: {session_cart.items.count()}")
+    print(f"\n  Stored cart items: {len(session_cart.items)}")
     print(f"  User cart items before merge: {user_cart.items.count()}")
     
     # Test merge
     print("\n4.3 Performing merge:")
-    user_cart.merge_from_session(session_key)
+    user_cart.merge_lines(session_cart.lines())
+    session_cart.clear()
     user_cart.refresh_from_db()
     
     print(f"  User cart items after merge: {user_cart.items.count()}")
-    print(f"  Session cart exists: {Cart.objects.filter(session_id=session_key).exists()}")
+    print(f"  Stored cart has items: {StoredCart(session_cart.token).has_items}")
     
     # Check if quantities merged correctly
     variant_items = user_cart.items.filter(variant=variants[0])